@@ -1,84 +1,232 @@
 # -*- coding: utf-8 -*-
+"""
+Commands import their pipelines when they run so `wise --help` stays fast.
+"""
 
 import click
 
-from src.commands.pipelines import Pipeline
+from src.common.ledger import ledger
+from src.common.tracing import tracer
+from src.constants import CONFIG_FILE_NAME, LOG_FILES
 
 
 @click.group(chain=True)
 @click.option('--file', '-f', type=click.Path(), help='Config file "django.json"')
-def main(file):
+@click.option('--trace', type=click.Path(), help='Write a Chrome trace of every step to this file')
+@click.option('--ledger', 'ledger_file', type=click.Path(), help='Write every command sent to the servers as JSONL')
+@click.pass_context
+def main(ctx, file, trace, ledger_file):
+    from src.common.session import Session
+
     click.echo("\nStarting...")
+    session = Session(config_file=file or CONFIG_FILE_NAME)
+    ctx.obj = session
+    ctx.call_on_close(session.close)
+    if trace:
+        tracer.enabled = True
+        ctx.call_on_close(lambda: tracer.summary())
+        ctx.call_on_close(lambda: tracer.export(trace))
+    if ledger_file:
+        ctx.call_on_close(lambda: ledger.summary())
+        ctx.call_on_close(lambda: ledger.dump(ledger_file))
 
 
 @main.command()
 def deploy():
+    from src.commands.pipelines import Pipeline
+
     Pipeline.deploy()
 
 
+@main.command()
+def wheelhouse():
+    from src.commands.pipelines import Pipeline
+
+    Pipeline.wheelhouse()
+
+
 @main.command()
 def deps():
+    from src.commands.pipelines import Pipeline
+
     Pipeline.deps()
 
 
 @main.command()
 def update():
+    from src.commands.pipelines import Pipeline
+
     Pipeline.update()
 
 
 @main.command()
 def install():
+    from src.commands.pipelines import Pipeline
+
     Pipeline.setup_server()
 
 
+@main.command()
+def plan():
+    from src.commands.pipelines import Pipeline
+
+    Pipeline.plan()
+
+
+@main.command()
+def apply():
+    from src.commands.pipelines import Pipeline
+
+    Pipeline.apply()
+
+
 @main.command()
 def uninstall():
+    from src.commands.pipelines import Pipeline
+
     Pipeline.clean_server()
 
 
 @main.command()
 def fix_permissions():
+    from src.commands.pipelines import Pipeline
+
     Pipeline.fix_permissions()
 
 
 @main.command()
 def add_remote():
+    from src.commands.pipelines import Pipeline
+
     Pipeline.add_remote()
 
 
 @main.command()
 def upload_key():
+    from src.commands.pipelines import Pipeline
+
     Pipeline.upload_sshkey()
 
 
 @main.command()
 def create_superuser():
+    from src.commands.pipelines import Pipeline
+
     Pipeline.createsuperuser()
 
 
 @main.command()
 def resetdb():
+    from src.commands.pipelines import Pipeline
+
     Pipeline.reset_db()
 
 
+@main.command()
+@click.option('--output', '-o', help='Backup folder, pass an existing one to resume it '
+                                     '[default: backups/<project>-<host>-<time>]')
+@click.option('--no-media', is_flag=True, help='Only dump the database')
+def backup(output, no_media):
+    from src.commands.pipelines import Pipeline
+
+    Pipeline.backup(output=output, media=not no_media)
+
+
+@main.command()
+@click.argument('path', type=click.Path(exists=True))
+@click.option('--jobs', '-j', type=int, help='Parallel restore jobs [default: remote cores]')
+@click.option('--yes', is_flag=True, help='Don\'t ask before replacing the database')
+def restore(path, jobs, yes):
+    from src.commands.pipelines import Pipeline
+
+    if not yes:
+        click.confirm('The current database will be dropped, continue?', abort=True)
+    Pipeline.restore(path=path, jobs=jobs)
+
+
+@main.command()
+@click.argument('action', type=click.Choice(['pull', 'push']))
+@click.option('--path', default='media', show_default=True, help='Local media folder')
+def media(action, path):
+    from src.commands.pipelines import Pipeline
+
+    Pipeline.media(action=action, path=path)
+
+
 @main.command()
 @click.argument('artifact')
 def setup_ssl(artifact):
+    from src.commands.pipelines import Pipeline
+
     Pipeline.setup_ssl(artifact=artifact)
 
 
 @main.command()
 def restart():
+    from src.commands.pipelines import Pipeline
+
     Pipeline.restart_server()
 
 
+@main.command()
+def reload():
+    from src.commands.pipelines import Pipeline
+
+    Pipeline.reload_server()
+
+
+@main.command()
+@click.argument('action', type=click.Choice(['install', 'add', 'drain', 'ready', 'remove']))
+@click.argument('node', required=False)
+def balancer(action, node):
+    from src.commands.pipelines import Pipeline
+
+    Pipeline.balancer(action=action, node=node)
+
+
+@main.command()
+@click.option('--file', 'files', multiple=True, type=click.Choice(sorted(LOG_FILES)),
+              help='Log to read, repeat for several [default: all]')
+@click.option('--lines', '-n', default=10, show_default=True, help='Lines per file to start with')
+@click.option('--follow', is_flag=True, help='Keep streaming new lines')
+@click.option('--grep', 'pattern', help='Only lines matching this regex')
+@click.option('--status', help='Only requests with these status codes, e.g. 5xx or 404,429')
+@click.option('--since', help='Only lines after this time: 15m, 2h, 1d or "YYYY-MM-DD HH:MM"')
+@click.option('--until', help='Only lines before this time')
+def logs(files, lines, follow, pattern, status, since, until):
+    from src.commands.pipelines import Pipeline
+
+    Pipeline.logs(
+        files=list(files or sorted(LOG_FILES)), lines=lines, follow=follow,
+        pattern=pattern, status=status, since=since, until=until,
+    )
+
+
+@main.command()
+@click.option('--since', help='Start of the window: 15m, 2h, 1d or "YYYY-MM-DD HH:MM"')
+@click.option('--until', help='End of the window')
+@click.option('--compare-since', help='Start of a baseline window to compare with, e.g. before a deploy')
+@click.option('--compare-until', help='End of the baseline window')
+@click.option('--top', default=15, show_default=True, help='Routes to show')
+def analyze(since, until, compare_since, compare_until, top):
+    from src.commands.pipelines import Pipeline
+
+    Pipeline.analyze(
+        since=since, until=until, compare_since=compare_since, compare_until=compare_until, top=top,
+    )
+
+
 @main.command()
 @click.argument('command')
 def run(command):
+    from src.commands.pipelines import Pipeline
+
     Pipeline.run_command(command=command)
 
 
 @main.command()
 def check_language():
+    from src.commands.pipelines import Pipeline
+
     Pipeline.server_language()
 
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+
+import queue
+import re
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import click
+
+from src.commands.logs import LOGS_BUFFER, STAMP_FORMAT, Logs
+from src.common.context import CommandContext
+from src.common.sketch import QuantileSketch
+
+MAX_ROUTES = 200
+OTHER_ROUTE = 'other'
+QUANTILES = (0.5, 0.95, 0.99)
+
+# The `<project>_timed` log_format of the nginx templates.
+TIMED_LINE = re.compile(
+    r'"(?P<method>[A-Z]+) (?P<path>\S+)[^"]*" (?P<status>\d{3}) \S+ "[^"]*" "[^"]*" '
+    r'rt=(?P<request_time>[0-9.]+) urt="(?P<upstream_time>[^"]*)"'
+)
+ID_SEGMENT = re.compile(r'^(\d+|[0-9a-f]{8}-[0-9a-f-]{27}|[0-9a-f]{24,})$', re.IGNORECASE)
+
+
+@dataclass
+class Request(object):
+    host: str
+    stamp: str
+    route: str
+    status: int
+    seconds: float
+
+
+@dataclass
+class Window(object):
+    name: str
+    since: str = ''
+    until: str = ''
+
+    def __contains__(self, stamp: str) -> bool:
+        return (not self.since or stamp >= self.since) and (not self.until or stamp <= self.until)
+
+
+@dataclass
+class RouteStats(object):
+    requests: int = 0
+    errors: int = 0
+    first: str = ''
+    last: str = ''
+    sketch: QuantileSketch = field(default_factory=QuantileSketch)
+
+    def add(self, request: Request):
+        self.requests += 1
+        if request.status >= 500:
+            self.errors += 1
+        if not self.first or request.stamp < self.first:
+            self.first = request.stamp
+        if request.stamp > self.last:
+            self.last = request.stamp
+        self.sketch.add(request.seconds)
+
+
+@dataclass
+class WindowReport(object):
+    window: Window
+    total: RouteStats = field(default_factory=RouteStats)
+    routes: Dict[str, RouteStats] = field(default_factory=dict)
+
+    def add(self, request: Request):
+        route = request.route
+        if route not in self.routes and len(self.routes) >= MAX_ROUTES:
+            route = OTHER_ROUTE
+        self.routes.setdefault(route, RouteStats()).add(request)
+        self.total.add(request)
+
+    @property
+    def seconds(self) -> float:
+        """
+        Length of the window, or of the traffic seen when the window is open ended.
+        """
+        start = self.window.since or self.total.first
+        end = self.window.until or self.total.last
+        if not start or not end:
+            return 1.0
+        elapsed = datetime.strptime(end, STAMP_FORMAT) - datetime.strptime(start, STAMP_FORMAT)
+        return max(elapsed.total_seconds(), 1.0)
+
+    def rps(self, stats: RouteStats) -> float:
+        return stats.requests / self.seconds
+
+
+class HostLines(object):
+    """
+    Writer of one host into a queue shared by all of them, every item is tagged with the host.
+    """
+
+    def __init__(self, host: str, lines: queue.Queue):
+        self.host = host
+        self.lines = lines
+
+    def put(self, item: Optional[tuple]):
+        self.lines.put(item if item is None else (self.host,) + item)
+
+
+class Analytics:
+
+    @staticmethod
+    def route(method: str, path: str) -> str:
+        """
+        `GET /api/users/42/?page=2` becomes `GET /api/users/:id/`.
+        """
+        segments = path.split('?', 1)[0].split('/')
+        segments = [':id' if ID_SEGMENT.match(segment) else segment for segment in segments]
+        return '{0} {1}'.format(method, '/'.join(segments))
+
+    @staticmethod
+    def drain(contexts: List[CommandContext], commands: Dict[str, str]) -> Iterator[tuple]:
+        """
+        `(host, stamp, file, line)` from every host as it arrives, through one bounded queue.
+        """
+        lines = queue.Queue(maxsize=LOGS_BUFFER)
+        for context in contexts:
+            host = context.connection.host
+            threading.Thread(
+                target=Logs.read, args=(context, commands[host], False, HostLines(host, lines)), daemon=True,
+            ).start()
+        running = len(contexts)
+        while running:
+            item = lines.get()
+            if item is None:
+                running -= 1
+            else:
+                yield item
+
+    @staticmethod
+    def requests(items: Iterable[tuple]) -> Iterator[Request]:
+        for host, stamp, label, text in items:
+            if label == 'wise':
+                click.echo(click.style('-> [{0}] {1}'.format(host, text), fg='red'))
+                continue
+            match = TIMED_LINE.search(text)
+            if match is None:
+                continue
+            yield Request(
+                host=host,
+                stamp=stamp,
+                route=Analytics.route(match.group('method'), match.group('path')),
+                status=int(match.group('status')),
+                seconds=float(match.group('request_time')),
+            )
+
+    @staticmethod
+    def windows(now: Optional[datetime], since: str = None, until: str = None,
+                compare_since: str = None, compare_until: str = None) -> List[Window]:
+        """
+        The current window and the optional baseline one, relative times count back from `now`.
+        """
+        windows = [Window(name='current', since=Logs.stamp(since, now), until=Logs.stamp(until, now))]
+        if compare_since or compare_until:
+            windows.append(Window(
+                name='baseline', since=Logs.stamp(compare_since, now), until=Logs.stamp(compare_until, now),
+            ))
+        return windows
+
+    @staticmethod
+    def aggregate(requests: Iterable[Request], windows: Dict[str, List[Window]]) -> List[WindowReport]:
+        """
+        Count the requests of every host in the windows of that host, they only differ by its clock.
+        """
+        reports = [WindowReport(window=window) for window in next(iter(windows.values()))]
+        for request in requests:
+            for report, window in zip(reports, windows[request.host]):
+                if request.stamp in window:
+                    report.add(request)
+        return reports
+
+    @staticmethod
+    def echo(report: WindowReport, baseline: Optional[WindowReport] = None, top: int = 15):
+        click.echo(click.style('\n>> {0}: {1} requests, {2:.2f} req/s'.format(
+            report.window.name, report.total.requests, report.rps(report.total),
+        ), fg='green'))
+        header = '{0:<48} {1:>8} {2:>8} {3:>8} {4:>8} {5:>8} {6:>6}'.format(
+            'route', 'count', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', '5xx%',
+        )
+        if baseline is not None:
+            header += ' {0:>9}'.format('p95 diff')
+        click.echo(header)
+
+        rows = sorted(report.routes.items(), key=lambda item: item[1].requests, reverse=True)[:top]
+        for route, stats in [('total', report.total)] + rows:
+            p50, p95, p99 = (stats.sketch.quantile(q) * 1000 for q in QUANTILES)
+            line = '{0:<48} {1:>8} {2:>8.2f} {3:>8.1f} {4:>8.1f} {5:>8.1f} {6:>6.1f}'.format(
+                route[:48], stats.requests, report.rps(stats), p50, p95, p99,
+                100.0 * stats.errors / stats.requests if stats.requests else 0.0,
+            )
+            if baseline is not None:
+                before = baseline.total if route == 'total' else baseline.routes.get(route)
+                if before is not None and before.requests:
+                    previous = before.sketch.quantile(0.95) * 1000
+                    change = (p95 - previous) / previous * 100 if previous else 0.0
+                    line += ' ' + click.style('{0:>+8.1f}%'.format(change), fg='red' if change > 10 else 'cyan')
+                else:
+                    line += ' {0:>9}'.format('new')
+            click.echo(line)
+
+    @staticmethod
+    def run(contexts: List[CommandContext], since: str = None, until: str = None,
+            compare_since: str = None, compare_until: str = None, top: int = 15):
+        clocks = Logs.clocks(contexts, since, until, compare_since, compare_until)
+        windows, commands = {}, {}
+        for host, now in clocks.items():
+            windows[host] = Analytics.windows(now, since, until, compare_since, compare_until)
+            # Rotated logs are read too, only lines inside some window leave the servers.
+            starts = [window.since for window in windows[host]]
+            ends = [window.until for window in windows[host]]
+            commands[host] = Logs.command(
+                contexts[0].config, ['access'], '+1', False,
+                since='' if '' in starts else min(starts),
+                until='' if '' in ends else max(ends),
+                ordered=False,
+                rotated=True,
+            )
+
+        click.echo(click.style('\n>> Reading access logs from {0} host(s)...'.format(len(contexts)), fg='green'))
+        reports = Analytics.aggregate(Analytics.requests(Analytics.drain(contexts, commands)), windows)
+        if not reports[0].total.requests and (len(reports) == 1 or not reports[1].total.requests):
+            click.echo(click.style(
+                '-> No timed requests found, run `wise apply` to enable the timed log format', fg='red',
+            ))
+            return
+        baseline = reports[1] if len(reports) > 1 else None
+        if baseline is not None:
+            Analytics.echo(baseline, top=top)
+        Analytics.echo(reports[0], baseline=baseline, top=top)
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import shlex
+import shutil
+import tarfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+import click
+
+from src.commands.config import Database
+from src.commands.server import Server
+from src.common.context import CommandContext
+from src.common.streams import STREAM_CHUNK_SIZE, remote_stdin, remote_stdout
+from src.common.tracing import traced_steps
+
+BACKUPS_PATH = 'backups'
+MANIFEST_NAME = 'manifest.json'
+CHECKSUMS_NAME = 'SHA256SUMS'
+DUMP_NAMES = {
+    Database.POSTGRESQL: 'db.dump',
+    Database.MYSQL: 'db.sql.gz',
+}
+MEDIA_NAME = 'media.tar.gz'
+RESTORE_PATTERN = '/tmp/wise-restore-{0}'
+# Indexes, constraints and triggers are created after the data is loaded.
+RESTORE_SECTIONS = ('pre-data', 'data', 'post-data')
+
+
+@traced_steps
+class Backup:
+
+    @staticmethod
+    def privileged(context: CommandContext, command: str, user: Optional[str] = None) -> str:
+        """
+        `command` under `sudo -S`, the password is written to the channel stdin.
+        """
+        return 'sudo -S -p "" {0}bash -o pipefail -c {1}'.format(
+            '-u {0} '.format(user) if user else '', shlex.quote(command),
+        )
+
+    @staticmethod
+    def password(context: CommandContext) -> bytes:
+        return '{0}\n'.format(context.connection.config.sudo.password or '').encode('utf-8')
+
+    @staticmethod
+    def dump_command(context: CommandContext) -> str:
+        """
+        Compressed dump written to stdout. PostgreSQL uses the custom format,
+        already compressed and restorable in parallel with `wise restore`.
+        """
+        name = context.config.project_name
+        if context.config.db_engine == Database.MYSQL:
+            return Backup.privileged(
+                context, 'mysqldump --single-transaction --quick --routines {0} | gzip -c'.format(name),
+            )
+        return Backup.privileged(context, 'pg_dump --format=custom --compress=6 {0}'.format(name), user='postgres')
+
+    @staticmethod
+    def media_command(context: CommandContext) -> str:
+        return Backup.privileged(context, 'tar -czf - -C {0}/htdocs media'.format(context.config.project_path))
+
+    @staticmethod
+    def path(context: CommandContext, output: Optional[str] = None) -> str:
+        if output:
+            # Every host gets its own folder under a shared output.
+            return os.path.join(output, context.connection.host) if len(context.config.hosts) > 1 else output
+        return os.path.join(BACKUPS_PATH, '{0}-{1}-{2}'.format(
+            context.config.project_name, context.connection.host, time.strftime('%Y%m%d-%H%M%S'),
+        ))
+
+    @staticmethod
+    def load_manifest(path: str) -> Dict:
+        manifest_file = os.path.join(path, MANIFEST_NAME)
+        if not os.path.isfile(manifest_file):
+            return {'parts': {}}
+        with open(manifest_file) as f:
+            return json.load(f)
+
+    @staticmethod
+    def save_manifest(path: str, manifest: Dict):
+        partial = os.path.join(path, '{0}.part'.format(MANIFEST_NAME))
+        with open(partial, 'w') as f:
+            json.dump(manifest, f, indent=4)
+        os.replace(partial, os.path.join(path, MANIFEST_NAME))
+
+        with open(os.path.join(path, CHECKSUMS_NAME), 'w') as f:
+            for name, part in sorted(manifest['parts'].items()):
+                if part.get('complete'):
+                    f.write('{0}  {1}\n'.format(part['sha256'], part['file']))
+
+    @staticmethod
+    def checksum(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def is_complete(path: str, part: Optional[Dict]) -> bool:
+        if not part or not part.get('complete'):
+            return False
+        file_path = os.path.join(path, part['file'])
+        return os.path.isfile(file_path) and Backup.checksum(file_path) == part['sha256']
+
+    @staticmethod
+    def download(context: CommandContext, command: str, destination: str) -> Dict:
+        """
+        Stream the stdout of `command` into `destination`, hashing on the fly.
+        The file only gets its final name once the command succeeded.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        started = time.monotonic()
+        partial = '{0}.part'.format(destination)
+        with remote_stdout(context.connection, command, stdin=Backup.password(context)) as chunks, \
+                open(partial, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+        os.replace(partial, destination)
+        return {
+            'file': os.path.basename(destination),
+            'sha256': digest.hexdigest(),
+            'bytes': size,
+            'seconds': round(time.monotonic() - started, 2),
+            'complete': True,
+        }
+
+    @staticmethod
+    def run(context: CommandContext, output: Optional[str] = None, media: bool = True):
+        """
+        Dump the database and archive htdocs/media side by side, straight into local files.
+
+        Re-running with the same `output` skips the parts whose checksum still matches the manifest.
+        """
+        path = Backup.path(context, output)
+        os.makedirs(path, exist_ok=True)
+        manifest = Backup.load_manifest(path)
+        manifest.update({
+            'project': context.config.project_name,
+            'host': context.connection.host,
+            'db_engine': str(context.config.db_engine),
+        })
+        manifest.setdefault('created', time.strftime('%Y-%m-%dT%H:%M:%S'))
+
+        parts = {}
+        if context.config.db_engine in DUMP_NAMES:
+            parts['db'] = (Backup.dump_command(context), DUMP_NAMES[context.config.db_engine])
+        else:
+            click.echo(click.style('-> [{0}] databases are not backed up'.format(context.config.db_engine), fg='red'))
+        if media:
+            parts['media'] = (Backup.media_command(context), MEDIA_NAME)
+
+        pending = {}
+        for name, (command, file_name) in parts.items():
+            if Backup.is_complete(path, manifest['parts'].get(name)):
+                click.echo(click.style('-> [{0}] already backed up, skipping'.format(name), fg='cyan'))
+            else:
+                manifest['parts'][name] = {'file': file_name, 'complete': False}
+                pending[name] = (command, os.path.join(path, file_name))
+        Backup.save_manifest(path, manifest)
+
+        click.echo(click.style(
+            '\n>> Backing up {0} into {1}'.format(', '.join(pending) or 'nothing', path), fg='green',
+        ))
+        with ThreadPoolExecutor(max_workers=max(1, len(pending))) as executor:
+            futures = {
+                name: executor.submit(Backup.download, context, command, destination)
+                for name, (command, destination) in pending.items()
+            }
+            errors = []
+            for name, future in futures.items():
+                try:
+                    manifest['parts'][name] = future.result()
+                    part = manifest['parts'][name]
+                    click.echo(click.style('-> [{0}] {1:.1f} MiB in {2}s'.format(
+                        name, part['bytes'] / 1024 / 1024, part['seconds'],
+                    ), fg='cyan'))
+                except Exception as exc:
+                    errors.append('[{0}] {1}'.format(name, exc))
+        Backup.save_manifest(path, manifest)
+
+        if errors:
+            raise IOError('Backup incomplete, run it again with --output {0}: {1}'.format(path, '; '.join(errors)))
+        click.echo(click.style('-> Backup ready, verify with: cd {0} && sha256sum -c {1}'.format(
+            path, CHECKSUMS_NAME,
+        ), fg='cyan'))
+        return path
+
+
+@traced_steps
+class Restore:
+
+    @staticmethod
+    def dump_path(path: str) -> str:
+        """
+        The PostgreSQL dump of a `wise backup` folder, checked against its manifest,
+        or `path` itself for a custom format file or a directory format dump.
+        """
+        manifest_file = os.path.join(path, MANIFEST_NAME)
+        if not os.path.isfile(manifest_file):
+            if os.path.isfile(path) or os.path.isfile(os.path.join(path, 'toc.dat')):
+                return path
+            raise IOError('[{0}] is not a backup, a custom format dump or a directory format dump'.format(path))
+
+        part = Backup.load_manifest(path)['parts'].get('db')
+        if not part or part['file'] != DUMP_NAMES[Database.POSTGRESQL]:
+            raise IOError('[{0}] has no PostgreSQL dump'.format(path))
+        if not Backup.is_complete(path, part):
+            raise IOError('[{0}] is incomplete or corrupted, check it with sha256sum -c {1}'.format(
+                path, CHECKSUMS_NAME,
+            ))
+        return os.path.join(path, part['file'])
+
+    @staticmethod
+    def upload(context: CommandContext, dump: str) -> str:
+        """
+        Stream the dump into a private folder of the server, readable only by postgres.
+        """
+        remote = RESTORE_PATTERN.format(uuid.uuid4().hex)
+        click.echo(click.style('\n>> Uploading {0}...'.format(dump), fg='green'))
+        if os.path.isdir(dump):
+            command = 'umask 077 && mkdir -p {0}/dump && tar -xf - -C {0}/dump'.format(remote)
+            with remote_stdin(context.connection, command) as writer:
+                with tarfile.open(fileobj=writer, mode='w|') as tar:
+                    for name in sorted(os.listdir(dump)):
+                        tar.add(os.path.join(dump, name), arcname=name)
+        else:
+            command = 'umask 077 && mkdir -p {0} && cat > {0}/dump'.format(remote)
+            with remote_stdin(context.connection, command) as writer, open(dump, 'rb') as f:
+                shutil.copyfileobj(f, writer, STREAM_CHUNK_SIZE)
+        context.connection.sudo('chown -R postgres {0}'.format(remote), hide='both')
+        return remote
+
+    @staticmethod
+    def pg_restore(context: CommandContext, remote: str, jobs: int):
+        """
+        Load the dump section by section with `jobs` parallel connections.
+        """
+        name = context.config.project_name
+        for section in RESTORE_SECTIONS:
+            click.echo(click.style('-> Restoring {0} with {1} job(s)'.format(section, jobs), fg='cyan'))
+            context.connection.sudo(
+                'pg_restore --section={0} --jobs={1} --no-owner --no-privileges --role={2} '
+                '--exit-on-error --dbname={2} {3}/dump'.format(section, jobs, name, remote),
+                user='postgres', hide='out',
+            )
+        context.connection.sudo(
+            'vacuumdb --analyze-only --jobs={0} {1}'.format(jobs, name), user='postgres', hide='out',
+        )
+
+    @staticmethod
+    def run(context: CommandContext, path: str, jobs: Optional[int] = None):
+        """
+        Upload a dump, reset the database and restore it in parallel, one job per remote core by default.
+        """
+        if context.config.db_engine != Database.POSTGRESQL:
+            click.echo(click.style('-> Only PostgreSQL databases can be restored', fg='red'))
+            return
+        dump = Restore.dump_path(path)
+        remote = Restore.upload(context, dump)
+        name = context.config.project_name
+        try:
+            click.echo(click.style('\n>> Resetting database {0}...'.format(name), fg='green'))
+            # The app would keep connections open and make the drop fail.
+            context.connection.sudo('supervisorctl stop {0}'.format(name), warn=True, hide='both')
+            Server.reset_db(context, force=True)
+            context.connection.sudo(
+                'psql -c "ALTER DATABASE {0} OWNER TO {0};"'.format(name), user='postgres', hide='out',
+            )
+            click.echo(click.style('\n>> Restoring database...', fg='green'))
+            Restore.pg_restore(context, remote, jobs or max(1, context.facts.cores))
+        finally:
+            with context.batch(hide='both') as batch:
+                batch.sudo('rm -rf {0}'.format(remote), warn=True)
+                batch.sudo('supervisorctl start {0}'.format(name), warn=True)
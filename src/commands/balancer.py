@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+import re
+import shlex
+
+import click
+
+from src.commands.server import Server
+from src.common.context import CommandContext
+from src.common.template import Artifact, Template
+from src.common.tracing import traced_steps
+
+HAPROXY_CONFIG = '/etc/haproxy/haproxy.cfg'
+HAPROXY_SOCKET = '/run/haproxy/admin.sock'
+ALGORITHMS = ('leastconn', 'roundrobin')
+# `add server` and `del server` on the runtime API.
+DYNAMIC_SERVERS_VERSION = (2, 4)
+
+
+@traced_steps
+class Balancer:
+
+    @staticmethod
+    def node_name(host: str) -> str:
+        return 'node-{0}'.format(re.sub(r'[^A-Za-z0-9]', '-', host))
+
+    @staticmethod
+    def backend(context: CommandContext) -> str:
+        return '{0}_cluster'.format(context.config.project_name)
+
+    @staticmethod
+    def settings(context: CommandContext) -> dict:
+        balancer = context.config.balancer
+        algorithm = balancer.get('algorithm', 'leastconn')
+        if algorithm not in ALGORITHMS:
+            raise click.BadParameter('[balancer.algorithm] must be one of {0}'.format(', '.join(ALGORITHMS)))
+        return {
+            'algorithm': algorithm,
+            'maxconn': balancer.get('maxconn', 4096),
+            'node_maxconn': balancer.get('node_maxconn', 256),
+            'health_check': balancer.get('health_check', '/'),
+            'https': balancer.get('https', False),
+            'admin': balancer.get('stats', {'username': 'admin', 'password': context.config.password}),
+        }
+
+    @staticmethod
+    def artifact(context: CommandContext) -> Artifact:
+        return Artifact(
+            template=Template(
+                name='haproxy.cfg',
+                context={
+                    'apps': [{
+                        'name': context.config.project_name,
+                        'domain': context.config.domain,
+                        'https': context.config.https,
+                        'port': context.config.balancer.get('node_port', 80),
+                    }],
+                    'cluster': [
+                        {'name': Balancer.node_name(host), 'ipv4': host} for host in context.config.hosts
+                    ],
+                    **Balancer.settings(context),
+                },
+            ),
+            remote=HAPROXY_CONFIG,
+            service='haproxy',
+        )
+
+    @staticmethod
+    def install(context: CommandContext):
+        """
+        1. Install haproxy and socat.
+        2. Render the cluster config and validate it.
+        3. Reload haproxy.
+        """
+        click.echo(click.style('\n>> Configuring load balancer...', fg='green'))
+        Server.install_packages(context, ['haproxy', 'socat'])
+        with context.batch() as batch:
+            batch.install(Balancer.artifact(context))
+            batch.sudo('haproxy -c -q -f {0}'.format(HAPROXY_CONFIG))
+            batch.sudo('systemctl enable haproxy', warn=True)
+            batch.sudo('systemctl reload-or-restart haproxy')
+        click.echo(click.style('-> Balancer configured for {0} node(s)'.format(len(context.config.hosts)), fg='cyan'))
+        version = Balancer.version(context)
+        if version < DYNAMIC_SERVERS_VERSION:
+            click.echo(click.style(
+                '-> HAProxy {0}.{1} can\'t add or remove nodes at runtime, upgrade to {2}.{3}+ for '
+                '`wise balancer add/remove`'.format(*version, *DYNAMIC_SERVERS_VERSION), fg='red',
+            ))
+
+    @staticmethod
+    def version(context: CommandContext) -> tuple:
+        result = context.connection.run('haproxy -v', warn=True, hide='both')
+        match = re.search(r'version (\d+)\.(\d+)', result.stdout)
+        return (int(match.group(1)), int(match.group(2))) if match else (0, 0)
+
+    @staticmethod
+    def require_dynamic_servers(context: CommandContext):
+        version = Balancer.version(context)
+        if version < DYNAMIC_SERVERS_VERSION:
+            raise click.ClickException(
+                'HAProxy {0}.{1} can\'t add or remove servers at runtime, {2}.{3}+ is required'.format(
+                    *version, *DYNAMIC_SERVERS_VERSION,
+                ),
+            )
+
+    @staticmethod
+    def runtime(batch, command: str, reply: str = ''):
+        """
+        Send `command` to the runtime API, socat exits 0 whatever haproxy answers,
+        so any reply other than the expected one fails the batch.
+        """
+        batch.sudo(
+            'set -o pipefail; answer=$(echo {0} | socat stdio {1} | sed "/^$/d") || exit $?; '
+            '[ "$answer" = {2} ] || {{ echo "haproxy: $answer" >&2; exit 1; }}'.format(
+                shlex.quote(command), HAPROXY_SOCKET, shlex.quote(reply),
+            ),
+        )
+
+    @staticmethod
+    def persist(context: CommandContext, batch):
+        """
+        Keep haproxy.cfg in sync with the runtime state without reloading.
+        """
+        batch.install(Balancer.artifact(context))
+        batch.sudo('haproxy -c -q -f {0}'.format(HAPROXY_CONFIG))
+
+    @staticmethod
+    def add_node(context: CommandContext, host: str):
+        """
+        Register `host` in the running haproxy and in haproxy.cfg, `context.config.hosts` must include it.
+        """
+        Balancer.require_dynamic_servers(context)
+        server = '{0}/{1}'.format(Balancer.backend(context), Balancer.node_name(host))
+        settings = Balancer.settings(context)
+        with context.batch() as batch:
+            Balancer.runtime(batch, 'add server {0} {1}:{2} check inter 3s fall 3 rise 2 maxconn {3}'.format(
+                server, host, context.config.balancer.get('node_port', 80), settings['node_maxconn'],
+            ), reply='New server registered.')
+            Balancer.runtime(batch, 'enable health {0}'.format(server))
+            Balancer.runtime(batch, 'enable server {0}'.format(server))
+            Balancer.persist(context, batch)
+        click.echo(click.style('-> {0} added'.format(host), fg='cyan'))
+
+    @staticmethod
+    def set_state(context: CommandContext, host: str, state: str):
+        server = '{0}/{1}'.format(Balancer.backend(context), Balancer.node_name(host))
+        with context.batch() as batch:
+            Balancer.runtime(batch, 'set server {0} state {1}'.format(server, state))
+        click.echo(click.style('-> {0} is {1}'.format(host, state), fg='cyan'))
+
+    @staticmethod
+    def remove_node(context: CommandContext, host: str):
+        """
+        Drop `host` from the running haproxy and from haproxy.cfg, `context.config.hosts` must exclude it.
+        """
+        Balancer.require_dynamic_servers(context)
+        server = '{0}/{1}'.format(Balancer.backend(context), Balancer.node_name(host))
+        with context.batch() as batch:
+            Balancer.runtime(batch, 'set server {0} state maint'.format(server))
+            Balancer.runtime(batch, 'del server {0}'.format(server), reply='Server deleted.')
+            Balancer.persist(context, batch)
+        click.echo(click.style('-> {0} removed'.format(host), fg='cyan'))
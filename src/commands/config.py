@@ -1,12 +1,14 @@
 # -*- coding: utf-8 -*-
 
 import json
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 from contextlib import contextmanager
-from typing import Optional
+from typing import List, Optional
 
-from src.commands.enums import WebServer, Database, Deployment
+from src.commands.enums import WebServer, Database, Deployment, Transport
+from src.common.transport import DEFAULT_IGNORE
+from src.common.wheelhouse import WHEELHOUSE_COMMAND
 from src.constants import CONFIG_FILE_NAME, SHARED_GROUP, HOME_BASE_PATH
 
 
@@ -27,6 +29,20 @@ class ProjectConfig(object):
     db_engine: Database = Database.POSTGRESQL
     web_server: WebServer = WebServer.NGINX
     port: int = 22
+    hosts: List[str] = field(default_factory=list)
+    concurrency: int = 4
+    apt_cache_max_age: int = 3600
+    transport: Transport = Transport.GIT
+    ignore: List[str] = field(default_factory=lambda: list(DEFAULT_IGNORE))
+    releases: bool = False
+    keep_releases: int = 5
+    wheelhouse: bool = False
+    static_brotli: bool = False
+    gunicorn: dict = field(default_factory=dict)
+    nginx: dict = field(default_factory=dict)
+    balancer: dict = field(default_factory=dict)
+    wheelhouse_python: str = '3'
+    wheelhouse_command: str = WHEELHOUSE_COMMAND
 
     @classmethod
     def build(cls, data: dict) -> 'ProjectConfig':
@@ -34,7 +50,7 @@ class ProjectConfig(object):
             project_name=data.get('project_name'),
             password=data.get('password'),
             domain=data.get('domain'),
-            ipv4=data.get('ipv4'),
+            ipv4=data.get('ipv4') or (data.get('hosts') or [None])[0],
             db_engine=Database.from_value(
                 data.get('db_engine', str(Database.POSTGRESQL)),
             ),
@@ -45,17 +61,52 @@ class ProjectConfig(object):
             superuser=data.get('superuser'),
             port=data.get('port', 22),
             sshkey=data.get('sshkey', '~/.ssh/id_rsa.pub'),
+            hosts=data.get('hosts') or [data.get('ipv4')],
+            concurrency=data.get('concurrency', 4),
+            apt_cache_max_age=data.get('apt_cache_max_age', 3600),
+            transport=Transport.from_value(
+                data.get('transport', str(Transport.GIT)),
+            ),
+            ignore=data.get('ignore', list(DEFAULT_IGNORE)),
+            releases=data.get('releases', False),
+            keep_releases=data.get('keep_releases', 5),
+            wheelhouse=data.get('wheelhouse', False),
+            static_brotli=data.get('static_brotli', False),
+            gunicorn=data.get('gunicorn', {}),
+            nginx=data.get('nginx', {}),
+            balancer=data.get('balancer', {}),
+            wheelhouse_python=data.get('wheelhouse_python', '3'),
+            wheelhouse_command=data.get('wheelhouse_command', WHEELHOUSE_COMMAND),
         )
 
+    @property
+    def current_path(self) -> str:
+        """
+        Directory with the code being served.
+        """
+        if self.releases:
+            return '{0}/current/'.format(self.project_path)
+        return '{0}/code/'.format(self.project_path)
+
+    @property
+    def wheelhouse_path(self) -> str:
+        return '{0}/wheelhouse'.format(self.project_path)
+
+    @property
+    def env_path(self) -> str:
+        if self.releases:
+            return '{0}/current/env'.format(self.project_path)
+        return '{0}/env'.format(self.project_path)
+
 
 def validate_config(config_json):
     pass
 
 
 @contextmanager
-def load_settings():
-    config_file = open(CONFIG_FILE_NAME, 'r')
-    config_json = json.load(config_file)
+def load_settings(config_file_name=CONFIG_FILE_NAME):
+    with open(config_file_name, 'r') as config_file:
+        config_json = json.load(config_file)
     validate_config(config_json)
     project_name = config_json.pop('project')
     config = ProjectConfig.build(config_json)
@@ -23,3 +23,9 @@ class Database(BaseEnum):
     POSTGRESQL = 'postgres'
     SQLITE = 'sqlite'
     MONGODB = 'mongodb'
+
+
+class Transport(BaseEnum):
+    GIT = 'git'
+    RSYNC = 'rsync'
+    TAR = 'tar'
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+
+import queue
+import re
+import shlex
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import click
+
+from src.commands.config import ProjectConfig
+from src.common.context import CommandContext
+from src.common.streams import remote_lines
+from src.constants import LOG_FILES
+
+LOGS_BUFFER = 1000
+MERGE_WINDOW = 1.0
+RELATIVE_TIME = re.compile(r'^(\d+)([smhd])$')
+STAMP_FORMAT = '%Y%m%d%H%M%S'
+TIME_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d')
+UNITS = {'s': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days'}
+
+# Prints "<stamp>\t<file>\t<line>" for every matching line. Stamps are
+# YYYYMMDDHHMMSS taken from the nginx access (10/Oct/2020:13:55:36), nginx
+# error (2020/10/10 13:55:36) and gunicorn ([2020-10-10 13:55:36]) formats;
+# lines without one (tracebacks) keep the stamp of the previous line.
+FILTER_PROGRAM = r'''
+BEGIN {
+    split("Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec", names, " ")
+    for (i = 1; i <= 12; i++) months[names[i]] = sprintf("%02d", i)
+    pattern = ENVIRON["WISE_PATTERN"]; status = ENVIRON["WISE_STATUS"]
+    since = ENVIRON["WISE_SINCE"]; until = ENVIRON["WISE_UNTIL"]
+}
+/^==> .* <==$/ {
+    if ($0 ~ /nginx-access/) label = "access"
+    else if ($0 ~ /nginx-error/) label = "error"
+    else label = "app"
+    next
+}
+/^$/ { next }
+{
+    t = ""
+    if (match($0, /[0-9][0-9]\/[A-Z][a-z][a-z]\/[0-9][0-9][0-9][0-9]:[0-9][0-9]:[0-9][0-9]:[0-9][0-9]/)) {
+        s = substr($0, RSTART, RLENGTH)
+        t = substr(s, 8, 4) months[substr(s, 4, 3)] substr(s, 1, 2) substr(s, 13, 2) substr(s, 16, 2) substr(s, 19, 2)
+    } else if (match($0, /[0-9][0-9][0-9][0-9][-\/][0-9][0-9][-\/][0-9][0-9][ T][0-9][0-9]:[0-9][0-9]:[0-9][0-9]/)) {
+        t = substr($0, RSTART, RLENGTH)
+        gsub(/[^0-9]/, "", t)
+    }
+    if (t == "") t = last[label]; else last[label] = t
+    if (since != "" && t < since) next
+    if (until != "" && t > until) next
+    if (pattern != "" && $0 !~ pattern) next
+    if (status != "") {
+        if (label != "access") next
+        split($0, quoted, "\"")
+        split(quoted[3], fields, " ")
+        if (fields[1] !~ status) next
+    }
+    print t "\t" label "\t" $0
+    fflush()
+}
+'''
+
+
+class Logs:
+
+    @staticmethod
+    def is_relative(value: Optional[str]) -> bool:
+        return bool(value and RELATIVE_TIME.match(value.strip()))
+
+    @staticmethod
+    def clock(context: CommandContext) -> datetime:
+        """
+        Local time of the server, the one its logs are written in.
+        """
+        result = context.connection.run('date +{0}'.format(STAMP_FORMAT), hide='both')
+        return datetime.strptime(result.stdout.strip(), STAMP_FORMAT)
+
+    @staticmethod
+    def clocks(contexts: List[CommandContext], *values: Optional[str]) -> Dict[str, Optional[datetime]]:
+        """
+        Clock of every host, only read when one of `values` is relative to it.
+        """
+        hosts = [context.connection.host for context in contexts]
+        if not any(Logs.is_relative(value) for value in values):
+            return dict.fromkeys(hosts)
+        with ThreadPoolExecutor(max_workers=len(contexts)) as executor:
+            return dict(zip(hosts, executor.map(Logs.clock, contexts)))
+
+    @staticmethod
+    def stamp(value: Optional[str], now: datetime = None) -> str:
+        """
+        `15m`, `2h`, `1d` or `YYYY-MM-DD[ HH:MM[:SS]]` as a YYYYMMDDHHMMSS stamp, in server local time.
+        Relative values count back from `now`, the server clock given by `Logs.clock`.
+        """
+        if not value:
+            return ''
+        relative = RELATIVE_TIME.match(value.strip())
+        if relative:
+            moment = (now or datetime.now()) - timedelta(**{UNITS[relative.group(2)]: int(relative.group(1))})
+            return moment.strftime(STAMP_FORMAT)
+        for time_format in TIME_FORMATS:
+            try:
+                return datetime.strptime(value.strip(), time_format).strftime(STAMP_FORMAT)
+            except ValueError:
+                continue
+        raise click.BadParameter('[{0}] is not a time, use 15m, 2h, 1d or YYYY-MM-DD HH:MM'.format(value))
+
+    @staticmethod
+    def status_pattern(status: Optional[str]) -> str:
+        """
+        `5xx`, `404` or `404,5xx` as an awk regex over the status code.
+        """
+        if not status:
+            return ''
+        codes = []
+        for code in status.split(','):
+            code = code.strip().lower()
+            if not re.match(r'^[1-5][0-9x]{2}$', code):
+                raise click.BadParameter('[{0}] is not a status code, use 404 or 5xx'.format(code))
+            codes.append(code.replace('x', '[0-9]'))
+        return '^({0})$'.format('|'.join(codes))
+
+    @staticmethod
+    def rotated(config: ProjectConfig, files: List[str], since: str = '') -> str:
+        """
+        Remote loop printing `files` and their rotated copies, gzipped or not, each after a `tail -v` header.
+        Copies last written before `since` can't hold newer lines and are not read.
+        """
+        names = ' -o '.join('-name {0}'.format(shlex.quote('{0}*'.format(LOG_FILES[name]))) for name in files)
+        newer = ''
+        if since:
+            newer = ' -newermt {0}'.format(shlex.quote(
+                datetime.strptime(since, STAMP_FORMAT).strftime('%Y-%m-%d %H:%M:%S'),
+            ))
+        return (
+            'find {0} -maxdepth 1 -type f \\( {1} \\){2} 2>/dev/null | sort | '
+            'while read -r name; do echo "==> $name <=="; zcat -f -- "$name"; done'.format(
+                shlex.quote('{0}/log'.format(config.project_path)), names, newer,
+            )
+        )
+
+    @staticmethod
+    def command(config: ProjectConfig, files: List[str], lines, follow: bool,
+                pattern: str = '', status: str = '', since: str = '', until: str = '', ordered: bool = True,
+                rotated: bool = False) -> str:
+        """
+        Remote pipeline printing `<stamp> <file> <line>` tab separated, `lines="+1"` reads whole files.
+        With `rotated` the rotated copies inside the window are read whole as well.
+        """
+        if rotated:
+            source = Logs.rotated(config, files, since)
+        else:
+            source = 'tail -v -n {0} {1} {2} 2>/dev/null'.format(lines, '-F' if follow else '', ' '.join(
+                shlex.quote('{0}/log/{1}'.format(config.project_path, LOG_FILES[name])) for name in files
+            ))
+        environment = ' '.join('{0}={1}'.format(key, shlex.quote(value)) for key, value in (
+            ('WISE_PATTERN', pattern),
+            ('WISE_STATUS', status),
+            ('WISE_SINCE', since),
+            ('WISE_UNTIL', until),
+        ))
+        command = '{0} | {1} awk {2}'.format(source, environment, shlex.quote(FILTER_PROGRAM))
+        if ordered and not follow:
+            # A finished tail can be ordered by stamp before it leaves the server.
+            command += ' | sort -s -k1,1'
+        return command
+
+    @staticmethod
+    def read(context: CommandContext, command: str, follow: bool, lines: queue.Queue):
+        """
+        Push `(stamp, file, line)` tuples into the bounded `lines` queue; `None` marks the end.
+        """
+        try:
+            with remote_lines(context.connection, command, pty=follow) as output:
+                for line in output:
+                    stamp, _, rest = line.partition('\t')
+                    label, _, text = rest.partition('\t')
+                    lines.put((stamp, label, text))
+        except Exception as exc:
+            lines.put(('', 'wise', '{0}'.format(exc)))
+        finally:
+            lines.put(None)
+
+    @staticmethod
+    def merge(sources: Dict[str, queue.Queue], window: Optional[float] = MERGE_WINDOW) \
+            -> Iterator[Tuple[str, str, str, str]]:
+        """
+        Interleave `(stamp, host, file, line)` by stamp.
+
+        A line is released once every host has a newer one pending, or after
+        `window` seconds for hosts that stay silent (never, when `window` is
+        None). Only one pending line per host is held here, the rest waits in
+        the bounded queues.
+        """
+        heads: Dict[str, Tuple[float, tuple]] = {}
+        active = set(sources)
+        while active or heads:
+            for host in list(active):
+                if host in heads:
+                    continue
+                try:
+                    item = sources[host].get(timeout=0.05)
+                except queue.Empty:
+                    continue
+                if item is None:
+                    active.discard(host)
+                else:
+                    heads[host] = (time.monotonic(), item)
+
+            if not heads:
+                continue
+            host = min(heads, key=lambda name: heads[name][1][0])
+            arrived, (stamp, label, text) = heads[host]
+            waiting = active - set(heads)
+            if waiting and (window is None or time.monotonic() - arrived < window):
+                continue
+            del heads[host]
+            yield stamp, host, label, text
+
+    @staticmethod
+    def tail(contexts: List[CommandContext], files: List[str], lines: int = 10, follow: bool = False,
+             pattern: str = '', status: str = '', since: str = '', until: str = ''):
+        config = contexts[0].config
+        status = Logs.status_pattern(status)
+        clocks = Logs.clocks(contexts, since, until)
+        sources = {}
+        for context in contexts:
+            host = context.connection.host
+            command = Logs.command(
+                config, files, lines, follow,
+                pattern=pattern or '',
+                status=status,
+                since=Logs.stamp(since, clocks[host]),
+                until=Logs.stamp(until, clocks[host]),
+            )
+            sources[host] = queue.Queue(maxsize=LOGS_BUFFER)
+            threading.Thread(target=Logs.read, args=(context, command, follow, sources[host]), daemon=True).start()
+
+        width = max(len(host) for host in sources)
+        for stamp, host, label, text in Logs.merge(sources, window=MERGE_WINDOW if follow else None):
+            click.echo('{0} {1} {2}'.format(
+                click.style('[{0}]'.format(host.ljust(width)), fg='cyan'),
+                click.style('{0:<6}'.format(label), fg='red' if label in ('error', 'wise') else 'green'),
+                text,
+            ))
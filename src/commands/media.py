@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import shlex
+import stat
+import tarfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import click
+
+from src.common.context import CommandContext
+from src.common.streams import ChunkReader, remote_stdin, remote_stdout
+from src.common.tracing import traced_steps
+
+MANIFEST_NAME = '.wise-media.json'
+PARTIAL_SUFFIX = '.wise-part'
+BATCH_FILES = 500
+BATCH_BYTES = 64 * 1024 * 1024
+HASH_BLOCK = 1024 * 1024
+
+# Same walk as `Media.scan`, run by python3 on the server: prints the manifest
+# of `root` and keeps it in `cache`, so only files whose size or mtime changed
+# since the last run are hashed again.
+SCAN_PROGRAM = r'''
+import hashlib, json, os, stat, sys
+root, cache = sys.argv[1], sys.argv[2]
+try:
+    with open(cache) as f:
+        previous = json.load(f)
+except (OSError, ValueError):
+    previous = {}
+entries = {}
+for base, _, names in os.walk(root):
+    for name in names:
+        path = os.path.join(base, name)
+        info = os.lstat(path)
+        if not stat.S_ISREG(info.st_mode):
+            continue
+        relative = os.path.relpath(path, root)
+        entry = [info.st_size, int(info.st_mtime)]
+        known = previous.get(relative)
+        if known and known[:2] == entry:
+            entry.append(known[2])
+        else:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1048576), b''):
+                    digest.update(block)
+            entry.append(digest.hexdigest())
+        entries[relative] = entry
+with open(cache + '.wise-new', 'w') as f:
+    json.dump(entries, f)
+os.replace(cache + '.wise-new', cache)
+sys.stdout.write(json.dumps(entries))
+'''
+
+
+@traced_steps
+class Media:
+    """
+    Manifests map every file under the media folder to `[size, mtime, sha256]`.
+    """
+
+    @staticmethod
+    def remote_root(context: CommandContext) -> str:
+        return '{0}/htdocs/media'.format(context.config.project_path)
+
+    @staticmethod
+    def load(path: str) -> Dict[str, list]:
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def save(path: str, manifest: Dict[str, list]):
+        partial = '{0}{1}'.format(path, PARTIAL_SUFFIX)
+        with open(partial, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(partial, path)
+
+    @staticmethod
+    def hash_file(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(HASH_BLOCK), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def scan(root: str) -> Dict[str, list]:
+        """
+        Manifest of the local `root`, rehashing only files whose size or mtime changed since the last scan.
+        """
+        manifest_file = os.path.join(root, MANIFEST_NAME)
+        previous = Media.load(manifest_file)
+        entries = {}
+        for base, _, names in os.walk(root):
+            for name in names:
+                path = os.path.join(base, name)
+                relative = os.path.relpath(path, root)
+                info = os.lstat(path)
+                if relative == MANIFEST_NAME or name.endswith(PARTIAL_SUFFIX) or not stat.S_ISREG(info.st_mode):
+                    continue
+                entry = [info.st_size, int(info.st_mtime)]
+                known = previous.get(relative)
+                entries[relative] = entry + [known[2] if known and known[:2] == entry else Media.hash_file(path)]
+        Media.save(manifest_file, entries)
+        return entries
+
+    @staticmethod
+    def remote_scan(context: CommandContext) -> Dict[str, list]:
+        root = Media.remote_root(context)
+        cache = '{0}/{1}'.format(context.config.project_path, MANIFEST_NAME)
+        command = 'mkdir -p {0} && python3 -c {1} {0} {2}'.format(
+            shlex.quote(root), shlex.quote(SCAN_PROGRAM), shlex.quote(cache),
+        )
+        with remote_stdout(context.connection, command) as chunks:
+            return json.loads(b''.join(chunks).decode('utf-8'))
+
+    @staticmethod
+    def changes(source: Dict[str, list], target: Dict[str, list]) -> List[str]:
+        return sorted(path for path, entry in source.items() if path not in target or target[path][2] != entry[2])
+
+    @staticmethod
+    def batches(paths: List[str], manifest: Dict[str, list]) -> List[List[str]]:
+        """
+        Split `paths` in batches of at most BATCH_FILES files or about BATCH_BYTES bytes.
+        """
+        batches, current, size = [], [], 0
+        for path in paths:
+            if current and (len(current) >= BATCH_FILES or size + manifest[path][0] > BATCH_BYTES):
+                batches.append(current)
+                current, size = [], 0
+            current.append(path)
+            size += manifest[path][0]
+        if current:
+            batches.append(current)
+        return batches
+
+    @staticmethod
+    def destination(root: str, name: str) -> str:
+        path = os.path.normpath(os.path.join(root, name))
+        if os.path.isabs(name) or not path.startswith(os.path.join(os.path.normpath(root), '')):
+            raise IOError('[{0}] is outside of the media folder'.format(name))
+        return path
+
+    @staticmethod
+    def pull_batch(context: CommandContext, root: str, paths: List[str]) -> Dict[str, list]:
+        """
+        Stream one tar of `paths` from the server and write each file next to its destination before renaming it.
+        """
+        command = 'tar -cf - -C {0} --null -T -'.format(shlex.quote(Media.remote_root(context)))
+        stdin = b''.join(path.encode('utf-8') + b'\0' for path in paths)
+        entries = {}
+        with remote_stdout(context.connection, command, stdin=stdin) as chunks:
+            with tarfile.open(fileobj=ChunkReader(chunks), mode='r|') as tar:
+                for member in tar:
+                    if not member.isfile():
+                        continue
+                    path = Media.destination(root, member.name)
+                    partial = '{0}{1}'.format(path, PARTIAL_SUFFIX)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    digest = hashlib.sha256()
+                    source = tar.extractfile(member)
+                    with open(partial, 'wb') as f:
+                        for block in iter(lambda: source.read(HASH_BLOCK), b''):
+                            f.write(block)
+                            digest.update(block)
+                    os.replace(partial, path)
+                    os.utime(path, (member.mtime, member.mtime))
+                    entries[os.path.relpath(path, root)] = [member.size, int(member.mtime), digest.hexdigest()]
+        return entries
+
+    @staticmethod
+    def push_batch(context: CommandContext, root: str, paths: List[str]):
+        command = 'tar -xf - -C {0}'.format(shlex.quote(Media.remote_root(context)))
+        with remote_stdin(context.connection, command) as writer:
+            with tarfile.open(fileobj=writer, mode='w|') as tar:
+                for path in paths:
+                    tar.add(os.path.join(root, path), arcname=path, recursive=False)
+
+    @staticmethod
+    def transfer(context: CommandContext, batches: List[List[str]], transfer_batch, done=None):
+        """
+        Run the batches over up to `concurrency` channels; `done` is called after every finished batch.
+        """
+        lock = threading.Lock()
+        errors = []
+
+        def run(batch):
+            try:
+                result = transfer_batch(batch)
+            except Exception as exc:
+                errors.append('{0}'.format(exc))
+                return
+            with lock:
+                if done is not None:
+                    done(result)
+                click.echo(click.style('-> {0} file(s) transferred'.format(len(batch)), fg='cyan'))
+
+        with ThreadPoolExecutor(max_workers=max(1, context.config.concurrency)) as executor:
+            list(executor.map(run, batches))
+        if errors:
+            raise IOError('{0} batch(es) failed, run it again to resume: {1}'.format(len(errors), errors[0]))
+
+    @staticmethod
+    def pull(context: CommandContext, root: str):
+        click.echo(click.style('\n>> Comparing media manifests...', fg='green'))
+        os.makedirs(root, exist_ok=True)
+        remote = Media.remote_scan(context)
+        local = Media.scan(root)
+        paths = Media.changes(remote, local)
+        click.echo(click.style('-> {0} of {1} file(s) to pull, {2:.1f} MiB'.format(
+            len(paths), len(remote), sum(remote[path][0] for path in paths) / 1024 / 1024,
+        ), fg='cyan'))
+
+        def done(entries):
+            # Finished batches are kept, an interrupted pull starts where it stopped.
+            local.update(entries)
+            Media.save(os.path.join(root, MANIFEST_NAME), local)
+
+        Media.transfer(
+            context, Media.batches(paths, remote), lambda batch: Media.pull_batch(context, root, batch), done,
+        )
+
+    @staticmethod
+    def push(context: CommandContext, root: str):
+        if not os.path.isdir(root):
+            click.echo(click.style('-> [{0}] folder doesn\'t exists'.format(root), fg='red'))
+            return
+        click.echo(click.style('\n>> Comparing media manifests of {0}...'.format(context.connection.host), fg='green'))
+        local = Media.scan(root)
+        remote = Media.remote_scan(context)
+        paths = Media.changes(local, remote)
+        click.echo(click.style('-> {0} of {1} file(s) to push, {2:.1f} MiB'.format(
+            len(paths), len(local), sum(local[path][0] for path in paths) / 1024 / 1024,
+        ), fg='cyan'))
+        Media.transfer(context, Media.batches(paths, local), lambda batch: Media.push_batch(context, root, batch))
@@ -1,13 +1,23 @@
 # -*- coding: utf-8 -*-
 
+from typing import List
 
 import click
 
+from src.commands.analyze import Analytics
+from src.commands.backup import Backup, Restore
+from src.commands.balancer import Balancer
+from src.commands.logs import Logs
+from src.commands.media import Media
 from src.commands.project import Project
 from src.commands.server import Server
 from src.commands.config import WebServer
 from src.common.context import CommandContext
 from src.common.decorators import settings, update_config_file
+from src.common.ledger import budget
+from src.common.plan import Plan
+from src.common.scheduler import Scheduler
+from src.common.session import Session
 
 
 class Pipeline:
@@ -25,23 +35,55 @@ class Pipeline:
 
     @staticmethod
     @settings(allow_sudo=True)
+    @budget(commands=19)
     def setup_server(context: CommandContext):
-        Server.deps(context)
-        Server.user(context)
-        Server.group(context)
-        Server.layout(context)
-        Server.create_db(context)
-        Server.fix_permissions(context)
-        Server.git(context)
-        Server.add_remote(context)
-        Server.web_server(context)
-        Server.gunicorn(context)
-        Server.supervisor(context)
-        Server.fix_permissions(context)
-        Server.letsencrypt(context)
+        """
+        Provision the server, independent steps run concurrently once what they need is in place.
+        """
+        # Config files and commands of the batched steps travel in one bundle and one privileged command.
+        (Scheduler(max_workers=context.config.concurrency, hide='both')
+         .add(Server.deps)
+         # Package scripts add system users too, /etc/passwd can't be locked by two of them.
+         .add(Server.user, after=[Server.deps])
+         .add(Server.group, after=[Server.user])
+         .add(Server.layout, after=[Server.group])
+         .add(Server.create_db, after=[Server.deps])
+         .add(Server.add_remote)
+         .add(Server.git, after=[Server.deps, Server.layout], batched=True)
+         .add(Server.web_server, after=[Server.deps, Server.layout], batched=True)
+         .add(Server.gunicorn, after=[Server.layout], batched=True)
+         .add(Server.supervisor, after=[Server.deps], batched=True)
+         .add(Server.fix_permissions, after=[Server.git, Server.gunicorn], batched=True)
+         .add(Server.letsencrypt, after=[Server.web_server])
+         .run(context))
+
+    @staticmethod
+    @settings(allow_sudo=True)
+    @budget(commands=3)
+    def plan(context: CommandContext):
+        """
+        Show which managed files differ from the server.
+        """
+        click.echo(click.style('\n>> Comparing managed files...', fg='green'))
+        Plan.build(context.connection, Server.artifacts(context)).echo()
+
+    @staticmethod
+    @settings(allow_sudo=True)
+    @budget(commands=6)
+    def apply(context: CommandContext):
+        """
+        Upload only the managed files that changed and restart services if needed.
+        """
+        click.echo(click.style('\n>> Applying managed files...', fg='green'))
+        plan = Plan.build(context.connection, Server.artifacts(context))
+        plan.echo()
+        plan.apply(context)
+        if plan.services:
+            Server.reload_services(context, services=plan.services)
 
     @staticmethod
     @settings(allow_sudo=True)
+    @budget(commands=3)
     def clean_server(context: CommandContext):
         """
         Uninstall app in selected server(s)
@@ -50,20 +92,54 @@ class Pipeline:
 
     @staticmethod
     @settings(allow_sudo=True)
+    @budget(commands=3)
     def restart_server(context: CommandContext):
         """
         Restart all app services.
         """
         Server.restart_services(context)
 
+    @staticmethod
+    @settings(allow_sudo=True)
+    @budget(commands=3)
+    def reload_server(context: CommandContext):
+        """
+        Reload all app services without dropping requests.
+        """
+        Server.reload_services(context)
+
     @staticmethod
     @settings()
+    @budget(commands=15)
     def deploy(context: CommandContext):
         Project.push(context)
         Project.environment(context)
+        if context.config.wheelhouse:
+            Project.wheelhouse(context)
         Project.install(context)
         Project.clean(context)
 
+    @staticmethod
+    @settings(merged=True, compress=True)
+    def logs(contexts: List[CommandContext], **options):
+        """
+        Tail the project logs of every host, filtered on the servers and merged by time.
+        """
+        Logs.tail(contexts, **options)
+
+    @staticmethod
+    @settings(merged=True, compress=True)
+    def analyze(contexts: List[CommandContext], **options):
+        """
+        Throughput and latency percentiles per route from the access logs of every host.
+        """
+        Analytics.run(contexts, **options)
+
+    @staticmethod
+    @settings()
+    def wheelhouse(context: CommandContext):
+        Project.wheelhouse(context)
+
     @staticmethod
     @settings(allow_sudo=True)
     def fix_permissions(context: CommandContext):
@@ -116,7 +192,7 @@ class Pipeline:
                 ) or 'n'
 
                 if is_agree.upper() == "Y":
-                    update_config_file(key="https", value=True)
+                    update_config_file(key="https", value=True, config_file=Session.current().config_file)
 
             if artifact == 'renew':
                 Server.renew_ssl(context)
@@ -130,6 +206,41 @@ class Pipeline:
             Server.certbot(context)
             Server.letsencrypt(context)
 
+    @staticmethod
+    @settings(allow_sudo=True, balancer=True)
+    def balancer(context: CommandContext, action: str, node: str = None):
+        """
+        Provision the load balancer or add, drain, re-enable and remove app nodes at runtime.
+        """
+        if action == 'install':
+            return Balancer.install(context)
+        if not node:
+            click.echo(click.style('-> A node address is required', fg='red'))
+            return
+
+        hosts = list(context.config.hosts)
+        if action == 'add':
+            context.config.hosts = hosts + ([node] if node not in hosts else [])
+        elif action == 'remove':
+            context.config.hosts = [host for host in hosts if host != node]
+
+        try:
+            if action == 'add':
+                Balancer.add_node(context, node)
+            elif action == 'drain':
+                Balancer.set_state(context, node, 'drain')
+            elif action == 'ready':
+                Balancer.set_state(context, node, 'ready')
+            elif action == 'remove':
+                Balancer.remove_node(context, node)
+        except Exception:
+            context.config.hosts = hosts
+            raise
+
+        # Only a runtime change that went through is written to the config file.
+        if context.config.hosts != hosts:
+            update_config_file(key='hosts', value=context.config.hosts, config_file=Session.current().config_file)
+
     @staticmethod
     @settings(allow_sudo=True)
     def server_language(context: CommandContext):
@@ -147,10 +258,30 @@ class Pipeline:
     def reset_db(context: CommandContext):
         Server.reset_db(context)
 
-    # @classmethod
-    # def make_backup(cls):
-    #     Global.set_user(superuser=True)
-    #     with settings(hide('warnings'), warn_only=True):
-    #         execute(Project.backup, hosts=env.hosts)
-    #         execute(Project.download_backup, hosts=env.hosts)
-    #
+    @staticmethod
+    @settings(allow_sudo=True)
+    def backup(context: CommandContext, output: str = None, media: bool = True):
+        """
+        Stream a database dump and the media files of the selected server(s) into local files.
+        """
+        Backup.run(context, output=output, media=media)
+
+    @staticmethod
+    @settings(allow_sudo=True)
+    def restore(context: CommandContext, path: str, jobs: int = None):
+        """
+        Replace the database of the selected server(s) with a dump, restored in parallel.
+        """
+        Restore.run(context, path, jobs=jobs)
+
+    @staticmethod
+    @settings(merged=True)
+    def media(contexts: List[CommandContext], action: str, path: str = 'media'):
+        """
+        Pull the media files of the first host into `path`, or push `path` to every host.
+        """
+        if action == 'pull':
+            Media.pull(contexts[0], path)
+            return
+        for context in contexts:
+            Media.push(context, path)
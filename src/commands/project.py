@@ -1,14 +1,23 @@
 # -*- coding: utf-8 -*-
 
 import os
+import shutil
+import time
 
 import click
-from invoke import run, Responder
+from invoke import Responder
 
 from src.commands.config import ProjectConfig
+from src.commands.enums import Transport
+from src.commands.server import Server
 from src.common.context import CommandContext
+from src.common import wheelhouse
+from src.common.streams import STREAM_CHUNK_SIZE, remote_stdin
+from src.common.tracing import traced_steps
+from src.common.transport import rsync_command, write_tar
 
 
+@traced_steps
 class Project:
     python = 'DJANGO_SETTINGS_MODULE=config.settings.production ./env/bin/python'
     pip = './env/bin/pip'
@@ -20,13 +29,57 @@ class Project:
     @staticmethod
     def push(context: CommandContext, origin='production'):
         """ Push changes to selected server"""
-        run('git push {0} master'.format(origin))
+        if context.config.transport == Transport.RSYNC:
+            return Project.push_rsync(context)
+        if context.config.transport == Transport.TAR:
+            return Project.push_tar(context)
+
+        if len(context.config.hosts) > 1:
+            origin = '{0}@{1}:{2}'.format(
+                context.config.project_user,
+                context.connection.host,
+                Server.git_repo_path(context.config),
+            )
+        context.connection.local('git push {0} master'.format(origin))
+
+    @staticmethod
+    def push_rsync(context: CommandContext):
+        """ Sync the working tree to `code/` sending only the changed blocks"""
+        click.echo(click.style('-> Syncing working tree with rsync', fg='cyan'))
+        destination = '{0}@{1}:{2}/code/'.format(
+            context.config.project_user, context.connection.host, context.config.project_path,
+        )
+        context.connection.local(rsync_command(
+            '.', destination, context.config.ignore,
+            port=context.config.port, key_filename=context.config.sshkey,
+        ))
+
+    @staticmethod
+    def push_tar(context: CommandContext):
+        """ Stream a compressed tar of the whole working tree and swap it in as `code/`"""
+        click.echo(click.style('-> Streaming working tree', fg='cyan'))
+        code_path = '{0}/code'.format(context.config.project_path)
+        with remote_stdin(context.connection, Project.tar_command(code_path)) as stdin:
+            sent = write_tar('.', context.config.ignore, stdin)
+        click.echo(click.style('-> {0:.1f} KiB sent'.format(sent / 1024), fg='cyan'))
+
+    @staticmethod
+    def tar_command(code_path: str) -> str:
+        """
+        Extract the stream into `<code_path>.new` and put it in place of `code_path`,
+        so files deleted locally don't stay importable. The uploaded `.env` is carried over.
+        """
+        return (
+            'rm -rf {0}.new {0}.old && mkdir -p {0}.new && tar -xzf - -C {0}.new && '
+            '{{ [ ! -f {0}/.env ] || [ -e {0}.new/.env ] || cp -a {0}/.env {0}.new/; }} && '
+            '{{ [ ! -d {0} ] || mv {0} {0}.old; }} && mv {0}.new {0} && rm -rf {0}.old'.format(code_path)
+        )
 
     @staticmethod
     def get_python(config: ProjectConfig):
         return (
             'DJANGO_ENV=production '
-            '{0}/env/bin/python'.format(config.project_path)
+            '{0}/bin/python'.format(config.env_path)
         )
 
     @staticmethod
@@ -34,6 +87,9 @@ class Project:
         """
         Run intall command.
         """
+        if context.config.releases:
+            return Project.install_release(context)
+
         code_path = '{0}/code/'.format(context.config.project_path)
         venv_path = '{0}/env/'.format(context.config.project_path)
         pip = '{0}/env/bin/pip'.format(context.config.project_path)
@@ -52,8 +108,50 @@ class Project:
         with context.connection.cd(code_path):
 
             click.echo(click.style('-> Installing production requirements ', fg='cyan'))
-            context.connection.run('{0} install -r requirements/production.txt'.format(pip))
+            context.connection.run('{0} install {1}-r requirements/production.txt'.format(
+                pip, Project.pip_options(context.config),
+            ))
+
+        Project.prepare(context, code_path, python)
 
+    @staticmethod
+    def pip_options(config: ProjectConfig) -> str:
+        if not config.wheelhouse:
+            return ''
+        return '--no-index --find-links {0}/{1} '.format(
+            config.wheelhouse_path, wheelhouse.requirements_hash(config.wheelhouse_python),
+        )
+
+    @staticmethod
+    def wheelhouse(context: CommandContext):
+        """
+        Build the production wheels locally and ship them once per requirements hash.
+        """
+        digest = wheelhouse.requirements_hash(context.config.wheelhouse_python)
+        remote_path = '{0}/{1}'.format(context.config.wheelhouse_path, digest)
+        if context.connection.run('test -d {0}'.format(remote_path), warn=True, hide='both').ok:
+            click.echo(click.style('-> Wheelhouse {0} already on server'.format(digest), fg='cyan'))
+            return
+
+        click.echo(click.style('-> Building wheelhouse {0}'.format(digest), fg='cyan'))
+        archive = wheelhouse.build(digest, context.config.wheelhouse_command)
+
+        click.echo(click.style('-> Uploading wheelhouse {0}'.format(digest), fg='cyan'))
+        command = 'rm -rf {0}.tmp && mkdir -p {0}.tmp && tar -xzf - -C {0}.tmp && mv {0}.tmp {0}'.format(remote_path)
+        if not context.config.releases:
+            # Only the installed env needs a wheelhouse, releases prune theirs in `prune_releases`.
+            command += ' && find {0} -mindepth 1 -maxdepth 1 ! -name {1} -exec rm -rf {{}} +'.format(
+                context.config.wheelhouse_path, digest,
+            )
+        with remote_stdin(context.connection, command) as stdin, open(archive, 'rb') as f:
+            shutil.copyfileobj(f, stdin, STREAM_CHUNK_SIZE)
+
+    @staticmethod
+    def prepare(context: CommandContext, code_path: str, python: str):
+        """
+        Apply migrations and collect static files for the code in `code_path`.
+        """
+        with context.connection.cd(code_path):
             click.echo(click.style('-> Loading migrations', fg='cyan'))
             context.connection.run('{0} manage.py migrate'.format(python))
 
@@ -70,6 +168,92 @@ class Project:
                 '-i \'*.sass\' '.format(python)
             )
 
+        click.echo(click.style('-> Compressing static files', fg='cyan'))
+        context.connection.run(
+            '{0} {1}/bin/compress_static.py {1}/htdocs/static/ {1}/etc/static.json'.format(
+                python, context.config.project_path,
+            ),
+            warn=True,
+        )
+
+    @staticmethod
+    def install_release(context: CommandContext):
+        """
+        1. Copy `code/` into a new `releases/<id>` directory.
+        2. Reuse the virtualenv keyed by the requirements hash or build it.
+        3. Migrate and collect static files from the release.
+        4. Point `current` to the release atomically.
+        5. Prune old releases, unused virtualenvs and wheelhouses.
+        """
+        project_path = context.config.project_path
+        release_id = time.strftime('%Y%m%d%H%M%S')
+        release_path = '{0}/releases/{1}'.format(project_path, release_id)
+
+        click.echo(click.style('-> Creating release {0}'.format(release_id), fg='cyan'))
+        result = context.connection.run(
+            'mkdir -p {release} {path}/venvs && cp -a {path}/code/. {release}/ && '
+            '(cat {release}/requirements/*.txt; python3 -V) | sha256sum | cut -c1-16'.format(
+                release=release_path, path=project_path,
+            ),
+            hide='both',
+        )
+        requirements_hash = result.stdout.strip()
+        venv_path = '{0}/venvs/{1}'.format(project_path, requirements_hash)
+
+        venv_ready = context.connection.run(
+            'test -f {0}/.complete'.format(venv_path), warn=True, hide='both',
+        ).ok
+        if venv_ready:
+            click.echo(click.style('-> Reusing virtualenv {0}'.format(requirements_hash), fg='cyan'))
+        else:
+            click.echo(click.style('-> Building virtualenv {0}'.format(requirements_hash), fg='cyan'))
+            context.connection.run(
+                'rm -rf {0} && virtualenv -p python3 {0} --always-copy'.format(venv_path),
+                hide='both',
+            )
+            context.connection.run(
+                '{0}/bin/pip install {2}-r {1}/requirements/production.txt && touch {0}/.complete'.format(
+                    venv_path, release_path, Project.pip_options(context.config),
+                )
+            )
+
+        command = 'ln -sfn {0} {1}/env'.format(venv_path, release_path)
+        if context.config.wheelhouse:
+            command += ' && echo {0} > {1}/.wheelhouse'.format(
+                wheelhouse.requirements_hash(context.config.wheelhouse_python), release_path,
+            )
+        context.connection.run(command)
+        Project.prepare(
+            context, release_path,
+            'DJANGO_ENV=production {0}/env/bin/python'.format(release_path),
+        )
+
+        click.echo(click.style('-> Activating release {0}'.format(release_id), fg='cyan'))
+        context.connection.run(
+            'ln -sfn {0} {1}/current.tmp && mv -T {1}/current.tmp {1}/current'.format(release_path, project_path),
+        )
+        Project.prune_releases(context)
+
+    @staticmethod
+    def prune_releases(context: CommandContext):
+        """
+        Keep the newest `keep_releases` releases and the virtualenvs and wheelhouses they use.
+        """
+        context.connection.run(
+            'cd {path} && '
+            'ls -1d releases/*/ | sort -r | tail -n +{keep} | xargs -r rm -rf && '
+            'for venv in venvs/*; do '
+            '  [ -d "$venv" ] || continue; '
+            '  used=$(for env in releases/*/env; do readlink -f "$env"; done | grep -cx "$(readlink -f "$venv")"); '
+            '  [ "$used" -gt 0 ] || rm -rf "$venv"; '
+            'done; '
+            'for house in wheelhouse/*; do '
+            '  [ -d "$house" ] || continue; '
+            '  grep -qsxF "$(basename "$house")" releases/*/.wheelhouse || rm -rf "$house"; '
+            'done'.format(path=context.config.project_path, keep=context.config.keep_releases + 1),
+            warn=True, hide='both',
+        )
+
     @staticmethod
     def migrate(context: CommandContext):
         Project.run_command(context, command='migrate')
@@ -120,7 +304,7 @@ class Project:
 
     @staticmethod
     def run_command(context: CommandContext, command: str):
-        code_path = '{0}/code/'.format(context.config.project_path)
+        code_path = context.config.current_path
         manage_py = '{0}manage.py'.format(code_path)
         python = Project.get_python(context.config)
 
@@ -140,56 +324,9 @@ class Project:
                 pattern=r'.*password:',
                 response='{0}\n'.format(context.config.password),
             )
-            run(
-                'ssh-copy-id {0}@{1}'.format(context.config.project_user, context.config.ipv4),
+            context.connection.local(
+                'ssh-copy-id {0}@{1}'.format(context.config.project_user, context.connection.host),
                 pty=True, watchers=[project_password],
             )
         except Exception:
             raise Exception('Unfulfilled local requirements')
-
-    # def backup(context: CommandContext):
-    #     """
-    #     Create a database backup
-    #     """
-    #
-    #     # Backup DB
-    #     sudo('pg_dump %(app)s > /tmp/%(app)s.sql' % {
-    #         "app": make_app(env.project),
-    #     }, user='postgres')
-    #
-    #     with settings(user=make_user(env.project), password=env.passwd):
-    #         with cd(get_user_home(env.stage)):
-    #             # Copy backup from temporal
-    #             run("cp /tmp/%(app)s.sql ." %
-    #                 {"app": make_app(env.project)})
-    #             # Compress DB
-    #             run("tar -cvf %(app)s.db.tar %(app)s.sql" %
-    #                 {"app": make_app(env.project)})
-    #
-    #             run("rm %(app)s.sql" %
-    #                 {"app": make_app(env.project)})
-    #             # Compress media
-    #             run("tar -cvf %(app)s.media.tar %(app)s/src/public/media/" %
-    #                 {"app": make_app(env.project)})
-    #
-    #     # Clean DB from temporal
-    #     sudo('rm /tmp/%(app)s.sql' % {"app": make_app(env.project)})
-    #
-    # @staticmethod
-    # def download_backup(context: CommandContext):
-    #
-    #     click.echo("\n----------------------------------------------------------")
-    #     click.echo("Downloading backup patient please ...!!!")
-    #     click.echo("----------------------------------------------------------")
-    #
-    #     get(remote_path="%(home)s/%(app)s.db.tar" % {
-    #         "home": get_user_home(env.stage),
-    #         "app": make_app(env.project)
-    #     }, local_path=".", use_sudo=True)
-    #     click.echo("---> DB Backup                          OK")
-    #     get(remote_path="%(home)s/%(app)s.media.tar" % {
-    #         "home": get_user_home(env.stage),
-    #         "app": make_app(env.project)
-    #     }, local_path=".", use_sudo=True)
-    #     click.echo("---> MEDIA Backup                       OK")
-    #     click.echo("----------------------------------------------------------\n")
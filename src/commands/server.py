@@ -1,18 +1,54 @@
 # -*- coding: utf-8 -*-
 
+import pkgutil
+from typing import List
+
 import click
-from invoke import Responder, run
-from pkg_resources import Requirement
-from pkg_resources import resource_filename as src
+from invoke import Responder
 
-from src.commands.config import Database, WebServer, Deployment
+from src.commands.config import Database, WebServer, Deployment, ProjectConfig
 from src.common.context import CommandContext
-from src.common.template import Template
-from src.constants import HOME_BASE_PATH
+from src.common.template import Artifact, Template
+from src.common.tracing import traced_steps
+from src.common.tuning import HostFacts, gunicorn_settings, nginx_settings
+from src.constants import HOME_BASE_PATH, LETSENCRYPT_PATH
+
+APT_LISTS_MARKER = '__APT_LISTS_AGE__'
+SOCKET_PATH = '/tmp/{0}.socket'
+READINESS_TIMEOUT = 30
 
 
+@traced_steps
 class Server:
 
+    @staticmethod
+    def system_packages(distro: str) -> List[str]:
+        """
+        Packages listed in `system-<distro>.txt`, without comments or blank lines.
+        """
+        content = pkgutil.get_data('src', 'templates/system-{0}.txt'.format(distro)).decode('utf-8')
+        lines = [line.split('#', 1)[0].strip() for line in content.splitlines()]
+        return [line for line in lines if line]
+
+    @staticmethod
+    def packages(config: ProjectConfig, distro: str) -> List[str]:
+        packages = Server.system_packages(distro)
+
+        if config.db_engine == Database.POSTGRESQL:
+            packages += ['postgresql', 'postgresql-contrib', 'libpq-dev']
+        elif config.db_engine == Database.MYSQL:
+            packages += ['mysql-server', 'libmysqlclient-dev']
+
+        if config.web_server == WebServer.NGINX:
+            packages.append('nginx')
+        elif config.web_server == WebServer.APACHE:
+            packages.append('apache2')
+
+        if config.https:
+            packages.append('certbot')
+
+        return list(dict.fromkeys(packages))
+
     @staticmethod
     def deps(context: CommandContext):
         """
@@ -25,70 +61,73 @@ class Server:
 
         click.echo(click.style(distro, fg='green'))
 
-        deps_file = src(Requirement.parse('wise-cli'), 'src/templates/system-{0}.txt'.format(distro))
-        result = context.connection.local(
-            "grep -vE '^\s*\#' {0}  | tr '\n' ' '".format(deps_file),
-            hide=True,
-        ) # noqa
-        pkgs = result.stdout.strip()
-
-        context.connection.sudo('apt install -y %s' % pkgs)
-        context.connection.sudo('apt autoremove -y')
-
-        click.echo(click.style('\nInstalling [DATABASES] dependencies...\n', fg='green'))
-
-        if context.config.db_engine == Database.POSTGRESQL:
-            context.connection.sudo('apt install -y postgresql postgresql-contrib libpq-dev')
-        elif context.config.db_engine == Database.MYSQL:
-            context.connection.sudo('apt install -y mysql-server libmysqlclient-dev')
-
-        click.echo(click.style('\nInstalling [WEB SERVER] dependencies...\n', fg='green'))
-        if context.config.web_server == WebServer.NGINX:
-            context.connection.sudo('apt install -y nginx')
-        elif context.config.web_server == WebServer.APACHE:
-            context.connection.sudo('apt install -y apache2')
-
-        if context.config.https:
-            # context.connection.sudo('apt install -y software-properties-common')
-            # context.connection.sudo('add-apt-repository -y ppa:certbot/certbot')
-            context.connection.sudo('apt update')
-            context.connection.sudo('apt install -y certbot')
+        if Server.install_packages(context, Server.packages(context.config, distro)):
+            context.connection.sudo('apt-get autoremove -y')
+        else:
+            click.echo(click.style('-> All packages already installed', fg='cyan'))
 
-        context.connection.sudo(
-            'adduser {0} {1}'.format(context.config.superuser, context.config.project_group),
-            warn=True, hide='both'
+    @staticmethod
+    def install_packages(context: CommandContext, packages: List[str]) -> List[str]:
+        """
+        Install the `packages` dpkg doesn't report as installed and return them. The apt
+        lists are only updated when they are older than `apt_cache_max_age` seconds.
+        """
+        result = context.connection.run(
+            "dpkg-query -W -f='${{Package}} ${{Status}}\\n' {0} 2>/dev/null; "
+            "echo {1} $(( $(date +%s) - $(stat -c %Y /var/lib/apt/lists 2>/dev/null || echo 0) ))".format(
+                ' '.join(packages), APT_LISTS_MARKER,
+            ),
+            warn=True, hide='both',
         )
+        installed = set()
+        lists_age = None
+        for line in result.stdout.splitlines():
+            fields = line.split()
+            if fields and fields[0] == APT_LISTS_MARKER:
+                lists_age = int(fields[1])
+            elif len(fields) > 1 and fields[-1] == 'installed':
+                installed.add(fields[0].split(':')[0])
+
+        missing = [package for package in packages if package not in installed]
+        if missing:
+            click.echo(click.style('-> Installing {0}'.format(' '.join(missing)), fg='cyan'))
+            if lists_age is None or lists_age > context.config.apt_cache_max_age:
+                context.connection.sudo('apt-get update')
+            context.connection.sudo('apt-get install -y --no-upgrade {0}'.format(' '.join(missing)))
+        return missing
 
     @staticmethod
     def layout(context: CommandContext):
         click.echo(click.style('\n>> Configuring project layout...', fg='green'))
-        context.connection.sudo(
-            'mkdir -p '
-            '{project_path} '
-            '{project_path}/code/ '
-            '{project_path}/repo/ '
-            '{project_path}/etc/ '
-            '{project_path}/etc/nginx/ '
-            '{project_path}/etc/ssl/ '
-            '{project_path}/log/ '
-            '{project_path}/bin/ '
-            '{project_path}/htdocs/ '
-            '{project_path}/htdocs/media/ '
-            '{project_path}/htdocs/static/'.format(project_path=context.config.project_path),
-            hide='both',
-        )
+        with context.batch(hide='both') as batch:
+            batch.sudo(
+                'mkdir -p '
+                '{project_path} '
+                '{project_path}/code/ '
+                '{project_path}/repo/ '
+                '{project_path}/etc/ '
+                '{project_path}/etc/nginx/ '
+                '{project_path}/etc/ssl/ '
+                '{project_path}/log/ '
+                '{project_path}/bin/ '
+                '{project_path}/htdocs/ '
+                '{project_path}/htdocs/media/ '
+                '{project_path}/htdocs/static/'.format(project_path=context.config.project_path),
+            )
 
-        if context.config.deployment == Deployment.DOCKER:
-            context.connection.sudo('mkdir -p {0}/volumes/'.format(context.config.project_path), hide='both')
+            if context.config.deployment == Deployment.DOCKER:
+                batch.sudo('mkdir -p {0}/volumes/'.format(context.config.project_path))
 
-        context.connection.sudo(
-            'chown -R {0}:{1} {2}'.format(
-                context.config.project_user,
-                context.config.project_group,
-                context.config.project_path,
-            ),
-            hide='both',
-        )
+            if context.config.releases:
+                batch.sudo('mkdir -p {0}/releases/ {0}/venvs/'.format(context.config.project_path))
+
+            batch.sudo(
+                'chown -R {0}:{1} {2}'.format(
+                    context.config.project_user,
+                    context.config.project_group,
+                    context.config.project_path,
+                ),
+            )
         click.echo(click.style('-> Layout configured', fg='cyan'))
 
     @staticmethod
@@ -121,36 +160,41 @@ class Server:
                     web_server=context.config.web_server,
                 )
             )
-            context.connection.sudo(
-                'chmod -R go-rwx /etc/letsencrypt/live/{0}'.format(context.config.domain),
-            )
 
             # (crontab -l ; echo "0 * * * * your_command") | sort - | uniq - | crontab -
 
-            letsencrypt_folder = '/opt/letsencrypt'
-            letsencrypt_renew = '{0}/renew.sh'.format(letsencrypt_folder)
+            letsencrypt_folder = LETSENCRYPT_PATH
             letsencrypt_crontab = '{0}/crontab.sh'.format(letsencrypt_folder)
 
-            context.connection.sudo(f"mkdir -p {letsencrypt_folder}")
-
             click.echo(click.style('-> Adding crontab task', fg='cyan'))
 
-            (Template(name='renew_le.sh', context={'web_server': context.config.web_server})
-             .upload(context.connection, remote=f"{letsencrypt_renew}"))
+            with context.batch() as batch:
+                batch.sudo('chmod -R go-rwx /etc/letsencrypt/live/{0}'.format(context.config.domain))
+                batch.sudo(f"mkdir -p {letsencrypt_folder}")
 
-            (Template(name='crontab_le.sh', context={'le_path': letsencrypt_folder})
-             .upload(context.connection, remote=letsencrypt_crontab))
+                batch.install(Server.renew_artifact(context.config))
 
-            context.connection.sudo('chmod +x {0}'.format(letsencrypt_renew))
-            context.connection.sudo('chmod +x {0}'.format(letsencrypt_crontab))
-            context.connection.sudo(letsencrypt_crontab)
-            context.connection.sudo('rm {0}'.format(letsencrypt_crontab))
-            context.connection.sudo('service cron restart')
+                batch.install(Artifact(
+                    template=Template(name='crontab_le.sh', context={'le_path': letsencrypt_folder}),
+                    remote=letsencrypt_crontab,
+                    mode='+x',
+                ))
+                batch.sudo(letsencrypt_crontab)
+                batch.sudo('rm {0}'.format(letsencrypt_crontab))
+                batch.sudo('service cron restart')
 
             click.echo(click.style('-> Let\'s Encrypt configured', fg='cyan'))
         else:
             click.echo(click.style('-> Let\'s Encrypt configurations skipped!', fg='cyan'))
 
+    @staticmethod
+    def renew_artifact(config: ProjectConfig) -> Artifact:
+        return Artifact(
+            template=Template(name='renew_le.sh', context={'web_server': config.web_server}),
+            remote='{0}/renew.sh'.format(LETSENCRYPT_PATH),
+            mode='+x',
+        )
+
     @staticmethod
     def renew_ssl(context: CommandContext):
         context.connection.sudo(
@@ -196,12 +240,14 @@ class Server:
          Create project Group.
         """
         click.echo(click.style('\n>> Configuring project group...', fg='green'))
-        context.connection.sudo('groupadd --system {0}'.format(context.config.project_group), warn=True)
-        context.connection.sudo(
-            'useradd --system --gid {0} --shell /bin/bash --home {1} {2}'.format(
-                context.config.project_group, context.config.project_path, context.config.project_user
-            ), warn=True, hide='out'
-        )
+        with context.batch(hide='out') as batch:
+            batch.sudo('groupadd --system {0}'.format(context.config.project_group), warn=True)
+            batch.sudo(
+                'useradd --system --gid {0} --shell /bin/bash --home {1} {2}'.format(
+                    context.config.project_group, context.config.project_path, context.config.project_user
+                ), warn=True,
+            )
+            batch.sudo('adduser {0} {1}'.format(context.config.superuser, context.config.project_group))
 
     @staticmethod
     def create_db(context: CommandContext):
@@ -219,18 +265,20 @@ class Server:
         1. Create DB user.
         2. Create DB and assign to user.
         """
-        result_db = context.connection.sudo(
-            'psql -c "CREATE DATABASE {0};"'.format(context.config.project_name),
-            warn=True, hide='err', user='postgres',
-        )
+        with context.batch(hide='err') as batch:
+            batch.sudo(
+                'psql -c "CREATE DATABASE {0};"'.format(context.config.project_name),
+                warn=True, user='postgres',
+            )
+            batch.sudo(
+                'psql -c "CREATE USER {0} WITH ENCRYPTED PASSWORD \'{1}\';"'.format(
+                    context.config.project_name, context.config.password
+                ), warn=True, user='postgres',
+            )
+        result_db, result_user = batch.results
         if not result_db.ok:
             click.echo(click.style('-> DB alredy exists', fg='cyan'))
 
-        result_user = context.connection.sudo(
-            'psql -c "CREATE USER {0} WITH ENCRYPTED PASSWORD \'{1}\';"'.format(
-                context.config.project_name, context.config.password
-            ), warn=True, hide='err', user='postgres',
-        )
         if not result_user.ok:
             click.echo(click.style('-> DB User alredy exists', fg='cyan'))
 
@@ -299,32 +347,35 @@ class Server:
         click.echo(click.style('\n>> Configuring project repository...', fg='green'))
         repo_git_path = Server.git_repo_path(context.config)
 
-        context.connection.sudo(
-            'mkdir -p {0}'.format(repo_git_path),
-            user=context.config.project_user,
-        )
-
-        context.connection.sudo(
-            'git init --bare --shared {0}'.format(repo_git_path),
-            user=context.config.project_user,
-            warn=True
-        )
-
-        work_dir = '{0}/code/'.format(context.config.project_path)
-        post_receive_file = '{0}/hooks/post-receive'.format(repo_git_path)
+        with context.batch() as batch:
+            batch.sudo(
+                'mkdir -p {0}'.format(repo_git_path),
+                user=context.config.project_user,
+            )
+            batch.sudo(
+                'git init --bare --shared {0}'.format(repo_git_path),
+                user=context.config.project_user,
+                warn=True
+            )
 
-        (Template(name='post-receive', context={'work_dir': work_dir})
-         .upload(context.connection, remote=post_receive_file))
+            batch.install(Server.git_artifact(context.config))
+            batch.sudo(
+                'chown -R {0}:{1} {2}'.format(
+                    context.config.project_user,
+                    context.config.project_group,
+                    repo_git_path,
+                ),
+            )
+        click.echo(click.style('-> Git repository configured', fg='cyan'))
 
-        context.connection.sudo('chmod +x {0}'.format(post_receive_file))
-        context.connection.sudo(
-            'chown -R {0}:{1} {2}'.format(
-                context.config.project_user,
-                context.config.project_group,
-                repo_git_path,
-            ), hide='both'
+    @staticmethod
+    def git_artifact(config: ProjectConfig) -> Artifact:
+        return Artifact(
+            template=Template(name='post-receive', context={'work_dir': '{0}/code/'.format(config.project_path)}),
+            remote='{0}/hooks/post-receive'.format(Server.git_repo_path(config)),
+            mode='+x',
+            owner='{0}:{1}'.format(config.project_user, config.project_group),
         )
-        click.echo(click.style('-> Git repository configured', fg='cyan'))
 
     @staticmethod
     def add_remote(context: CommandContext, origin="production"):
@@ -339,69 +390,57 @@ class Server:
             git_repo_path,
         )
 
-        run('git remote remove {0}'.format(origin), warn=True, hide='both')
-        run('git remote add {0} {1}'.format(origin, git_remote_path), warn=True, hide='both')
+        context.connection.local('git remote remove {0}'.format(origin), warn=True, hide='both')
+        context.connection.local('git remote add {0} {1}'.format(origin, git_remote_path), warn=True, hide='both')
 
         click.echo(click.style('-> Git origin configured', fg='cyan'))
 
     @staticmethod
     def nginx(context: CommandContext):
         """
-        1. Remove default nginx config file
-        2. Create new config file
-        3. Copy local config to remote config
-        4. Setup new symbolic link
+        1. Render the project site locally and install it.
+        2. Enable it in place of the default site, see `nginx_artifact`.
         """
         click.echo(click.style('\n>> Configuring nginx setting for the project ...', fg='green'))
 
-        context.connection.sudo(
-            'rm /etc/nginx/sites-enabled/default',
-            hide='both', warn=True,
-        )
-        context.connection.sudo(
-            'rm /etc/nginx/sites-enabled/{0}.conf'.format(context.config.project_name),
-            hide='both', warn=True,
-        )
-        context.connection.sudo(
-            'rm /etc/nginx/sites-available/{0}.conf'.format(context.config.project_name),
-            hide='both', warn=True,
-        )
+        with context.batch(hide='both') as batch:
+            batch.install(Server.nginx_artifact(context))
 
-        template_context = {
-            'project_name': context.config.project_name,
-            'project_path': context.config.project_path,
-            'project_htdocs': '{0}/htdocs/'.format(context.config.project_path),
-            'project_domain': context.config.domain
-        }
-        if context.config.https:
-            nginx_config = Template(
-                name='django_nginx_ssl.conf',
-                context=template_context,
-            )
-        else:
-            nginx_config = Template(
-                name='django_nginx.conf',
-                context=template_context,
-            )
+        click.echo(click.style('-> Nginx configured', fg='cyan'))
 
-        tmp_nginx_conf = '/tmp/{0}.conf'.format(context.config.project_name)
-        dest_nginx_conf = '/etc/nginx/sites-available/{0}.conf'.format(context.config.project_name)
-        context.connection.put(
-            local=nginx_config,
-            remote=tmp_nginx_conf,
-        )
+    @staticmethod
+    def nginx_context(config: ProjectConfig, facts: HostFacts) -> dict:
+        return {
+            'project_name': config.project_name,
+            'project_path': config.project_path,
+            'project_htdocs': '{0}/htdocs/'.format(config.project_path),
+            'project_domain': config.domain,
+            'static_brotli': config.static_brotli,
+            'nginx': nginx_settings(
+                facts, config.nginx, worker_class=gunicorn_settings(facts, config.gunicorn)['worker_class'],
+            ),
+        }
 
-        context.connection.sudo(
-            'mv {0} {1}'.format(tmp_nginx_conf, dest_nginx_conf),
-            warn=True, hide='both',
-        )
-        context.connection.sudo(
-            'ln -s {0} /etc/nginx/sites-enabled/'.format(dest_nginx_conf),
-            warn=True, hide='both',
+    @staticmethod
+    def nginx_artifact(context: CommandContext) -> Artifact:
+        """
+        The project site, enabled in place of the default one whenever it is installed.
+        """
+        config = context.config
+        remote = '/etc/nginx/sites-available/{0}.conf'.format(config.project_name)
+        return Artifact(
+            template=Template(
+                name='django_nginx_ssl.conf' if config.https else 'django_nginx.conf',
+                context=Server.nginx_context(config, context.facts),
+            ),
+            remote=remote,
+            service='nginx',
+            post_install=[
+                'rm -f /etc/nginx/sites-enabled/default',
+                'ln -sfn {0} /etc/nginx/sites-enabled/{1}.conf'.format(remote, config.project_name),
+            ],
         )
 
-        click.echo(click.style('-> Nginx configured', fg='cyan'))
-
     @staticmethod
     def apache(context: CommandContext):
         """
@@ -420,34 +459,47 @@ class Server:
         """
         click.echo(click.style('\n>> Configuring gunicorn settings', fg='green'))
 
-        context.connection.sudo(
-            'mkdir -p {0}/bin'.format(context.config.project_path),
-            warn=True, hide='both',
-        )
-        tmp_gunicorn = '/tmp/start.sh'
-        dest_gunicorn = '{0}/bin/start.sh'.format(context.config.project_path)
-        context.connection.put(
-            local=Template(
-                name='start.sh',
-                context={
-                    'project_name': context.config.project_name,
-                    'project_path': context.config.project_path,
-                    'project_code_path': '{0}/code/'.format(context.config.project_path),
-                    'project_user': context.config.project_user,
-                    'project_group': context.config.project_group,
-                }
-            ),
-            remote=tmp_gunicorn
-        )
-        context.connection.sudo(
-            'mv {0} {1}'.format(tmp_gunicorn, dest_gunicorn),
-            warn=True, hide='both',
+        with context.batch(hide='both') as batch:
+            batch.sudo('mkdir -p {0}/bin'.format(context.config.project_path), warn=True)
+            batch.install(Server.gunicorn_artifact(context))
+            batch.install(Server.static_artifact(context.config))
+        click.echo(click.style('-> Gunicorn configured', fg='cyan'))
+
+    @staticmethod
+    def gunicorn_settings(context: CommandContext) -> dict:
+        return gunicorn_settings(context.facts, context.config.gunicorn)
+
+    @staticmethod
+    def gunicorn_context(config: ProjectConfig, facts: HostFacts) -> dict:
+        return {
+            'project_name': config.project_name,
+            'project_path': config.project_path,
+            'project_code_path': config.current_path,
+            'python_env': config.env_path,
+            'project_user': config.project_user,
+            'project_group': config.project_group,
+            **gunicorn_settings(facts, config.gunicorn),
+        }
+
+    @staticmethod
+    def gunicorn_artifact(context: CommandContext) -> Artifact:
+        config = context.config
+        return Artifact(
+            template=Template(name='start.sh', context=Server.gunicorn_context(config, context.facts)),
+            remote='{0}/bin/start.sh'.format(config.project_path),
+            mode='+x',
+            owner='{0}:{1}'.format(config.project_user, config.project_group),
+            service='gunicorn',
         )
-        context.connection.sudo(
-            'chmod +x {0}'.format(dest_gunicorn),
-            warn=True, hide='both',
+
+    @staticmethod
+    def static_artifact(config: ProjectConfig) -> Artifact:
+        return Artifact(
+            template=Template(name='compress_static.py', context={}),
+            remote='{0}/bin/compress_static.py'.format(config.project_path),
+            mode='+x',
+            owner='{0}:{1}'.format(config.project_user, config.project_group),
         )
-        click.echo(click.style('-> Gunicorn configured', fg='cyan'))
 
     @staticmethod
     def supervisor(context: CommandContext):
@@ -457,19 +509,45 @@ class Server:
         3. Register new command.
         """
         click.echo(click.style('\n>> Configuring Supervisor for project', fg='green'))
-        dest_supervisor = '/etc/supervisor/conf.d/{0}.conf'.format(context.config.project_name)
-        (Template(
-            name='django_supervisor.conf',
-            context={
-                'project_name': context.config.project_name,
-                'project_path': context.config.project_path,
-                'project_user': context.config.project_user,
-                'project_group': context.config.project_group,
-            }
-        ).upload(context.connection, remote=dest_supervisor))
+        with context.batch() as batch:
+            batch.install(Server.supervisor_artifact(context.config))
 
         click.echo(click.style('-> Supervisor configured', fg='cyan'))
 
+    @staticmethod
+    def supervisor_artifact(config: ProjectConfig) -> Artifact:
+        return Artifact(
+            template=Template(
+                name='django_supervisor.conf',
+                context={
+                    'project_name': config.project_name,
+                    'project_path': config.project_path,
+                    'project_user': config.project_user,
+                    'project_group': config.project_group,
+                }
+            ),
+            remote='/etc/supervisor/conf.d/{0}.conf'.format(config.project_name),
+            service='supervisor',
+        )
+
+    @staticmethod
+    def artifacts(context: CommandContext) -> List[Artifact]:
+        """
+        Every file rendered from templates and kept on the server by `wise`.
+        """
+        config = context.config
+        artifacts = [Server.git_artifact(config)]
+        if config.web_server == WebServer.NGINX:
+            artifacts.append(Server.nginx_artifact(context))
+        artifacts += [
+            Server.gunicorn_artifact(context),
+            Server.static_artifact(config),
+            Server.supervisor_artifact(config),
+        ]
+        if config.https:
+            artifacts.append(Server.renew_artifact(config))
+        return artifacts
+
     @staticmethod
     def restart_services(context: CommandContext):
         """
@@ -477,39 +555,77 @@ class Server:
         2. Restart nginx.
         3. Restart supervisor.
         """
-        context.connection.sudo('supervisorctl reread')
-        context.connection.sudo('supervisorctl update')
+        with context.batch() as batch:
+            batch.sudo('supervisorctl reread')
+            batch.sudo('supervisorctl update')
 
-        context.connection.sudo('service nginx restart')
-        context.connection.sudo('service supervisor restart')
-        context.connection.sudo('supervisorctl restart {0}'.format(context.config.project_name))
+            batch.sudo('service nginx restart')
+            batch.sudo('service supervisor restart')
+            batch.sudo('supervisorctl restart {0}'.format(context.config.project_name))
+
+    @staticmethod
+    def reload_services(context: CommandContext, services=None):
+        """
+        1. Validate and reload nginx without dropping connections.
+        2. Reload supervisor only if its config changed, restart the app only if start.sh changed.
+        3. Otherwise send HUP to gunicorn for a graceful worker rollover.
+        4. Wait until the gunicorn socket answers.
+        """
+        services = services or set()
+        project_name = context.config.project_name
+        click.echo(click.style('\n>> Reloading services...', fg='green'))
+
+        with context.batch() as batch:
+            if context.config.web_server == WebServer.NGINX:
+                batch.sudo('nginx -t -q')
+                batch.sudo('nginx -s reload')
+
+            if 'supervisor' in services:
+                batch.sudo('supervisorctl reread')
+                batch.sudo('supervisorctl update')
+            if 'gunicorn' in services:
+                batch.sudo('supervisorctl restart {0}'.format(project_name))
+            else:
+                # A preloaded app is not re-imported on HUP, only a restart picks up new code.
+                batch.sudo(
+                    'if grep -q -- --preload {0}/bin/start.sh; then supervisorctl restart {1}; '
+                    'else supervisorctl signal HUP {1}; fi'.format(context.config.project_path, project_name)
+                )
+
+            batch.sudo(
+                'for i in $(seq {timeout}); do '
+                'code=$(curl -s -o /dev/null -w "%{{http_code}}" --unix-socket {socket} http://localhost/); '
+                '[ "$code" != "000" ] && exit 0; sleep 1; '
+                'done; echo "{socket} is not ready" >&2; exit 1'.format(
+                    socket=SOCKET_PATH.format(project_name), timeout=READINESS_TIMEOUT,
+                ),
+            )
+        click.echo(click.style('-> Services reloaded', fg='cyan'))
 
     @staticmethod
     def configure_locales(context: CommandContext):
         """
         Generate and configure locales in recently installed server.
         """
-        context.connection.sudo('locale-gen en_US.UTF-8', warn=True, hide='both')
-        context.connection.sudo('dpkg-reconfigure locales', warn=True, hide='both')
+        with context.batch(hide='both') as batch:
+            batch.sudo('locale-gen en_US.UTF-8', warn=True)
+            batch.sudo('dpkg-reconfigure locales', warn=True)
 
     @staticmethod
     def fix_permissions(context: CommandContext):
         """
          Fix Permissions.
         """
-        context.connection.sudo(
-            'chown -R {0}:{1} {2}'.format(
-                context.config.project_user,
-                context.config.project_group,
-                context.config.project_path,
-            ),
-            warn=True, hide='both',
-        )
-
-        context.connection.sudo(
-            'chmod -R g+w {0}'.format(context.config.project_path),
-            warn=True, hide='both',
-        )
+        with context.batch(hide='both') as batch:
+            batch.sudo(
+                'chown -R {0}:{1} {2}'.format(
+                    context.config.project_user,
+                    context.config.project_group,
+                    context.config.project_path,
+                ),
+                warn=True,
+            )
+            batch.sudo('chmod -R g+w {0}'.format(context.config.project_path), warn=True)
 
     @staticmethod
     def clean(context: CommandContext):
@@ -524,35 +640,49 @@ class Server:
         8. Delete app user.
         """
         click.echo(click.style('\n>> Uninstalling project ...', fg='green'))
-        cmd = {'warn': True, 'hide': 'both'}
-        context.connection.sudo('pkill -u {0}'.format(context.config.project_user), **cmd)
-        Server.drop_db(context)
-
-        context.connection.sudo(
-            'rm -f /etc/supervisor/conf.d/{0}.conf'.format(context.config.project_name), **cmd)
-        context.connection.sudo(
-            'rm -f /etc/nginx/sites-enabled/{0}.conf'.format(context.config.project_name), **cmd)
-        context.connection.sudo(
-            'rm -f /etc/nginx/sites-available/{0}.conf'.format(context.config.project_name), **cmd)
-        context.connection.sudo(
-            'rm -rf {0}/bin/{1}.socket'.format(context.config.project_path, context.config.project_name), **cmd)
-        context.connection.sudo(
-            'groupdel {0}'.format(context.config.project_group), **cmd)
-        context.connection.sudo(
-            'userdel -r {0}'.format(context.config.project_user), **cmd)
-        context.connection.sudo(
-            'rm -rf {0}'.format(context.config.project_path), **cmd)
+        cmd = {'warn': True}
+        with context.batch(hide='both') as batch:
+            batch.sudo('pkill -u {0}'.format(context.config.project_user), **cmd)
+            Server.drop_db(context, batch=batch)
+
+            batch.sudo(
+                'rm -f /etc/supervisor/conf.d/{0}.conf'.format(context.config.project_name), **cmd)
+            batch.sudo(
+                'rm -f /etc/nginx/sites-enabled/{0}.conf'.format(context.config.project_name), **cmd)
+            batch.sudo(
+                'rm -f /etc/nginx/sites-available/{0}.conf'.format(context.config.project_name), **cmd)
+            batch.sudo(
+                'rm -rf {0}/bin/{1}.socket'.format(context.config.project_path, context.config.project_name), **cmd)
+            batch.sudo(
+                'groupdel {0}'.format(context.config.project_group), **cmd)
+            batch.sudo(
+                'userdel -r {0}'.format(context.config.project_user), **cmd)
+            batch.sudo(
+                'rm -rf {0}'.format(context.config.project_path), **cmd)
 
         click.echo(click.style('-> Project uninstalled', fg='cyan'))
 
     @staticmethod
-    def drop_db(context: CommandContext):
+    def drop_db(context: CommandContext, batch=None, force=False):
+        """
+        With `force` open connections are terminated first and a failed drop raises.
+        """
+        if batch is None:
+            with context.batch() as batch:
+                return Server.drop_db(context, batch=batch, force=force)
+
         if context.config.db_engine == Database.POSTGRESQL:
-            context.connection.sudo(
-                'psql -c "DROP DATABASE {0};"'.format(context.config.project_name),
-                user='postgres', warn=True,
+            if force:
+                batch.sudo(
+                    'psql -c "SELECT pg_terminate_backend(pid) FROM pg_stat_activity '
+                    'WHERE datname = \'{0}\' AND pid <> pg_backend_pid();"'.format(context.config.project_name),
+                    user='postgres',
+                )
+            batch.sudo(
+                'psql -c "DROP DATABASE {0}{1};"'.format('IF EXISTS ' if force else '', context.config.project_name),
+                user='postgres', warn=not force,
             )
-            context.connection.sudo(
+            batch.sudo(
                 'psql -c "DROP ROLE IF EXISTS {0};"'.format(context.config.project_user),
                 user='postgres', warn=True,
             )
@@ -581,6 +711,6 @@ class Server:
             click.echo(click.style('-> Unsupported DB Engine', fg='red'))
 
     @staticmethod
-    def reset_db(context: CommandContext):
-        Server.drop_db(context)
+    def reset_db(context: CommandContext, force=False):
+        Server.drop_db(context, force=force)
         Server.create_db(context)
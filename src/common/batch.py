@@ -0,0 +1,121 @@
+import shlex
+import sys
+import threading
+from dataclasses import dataclass
+from typing import List, Optional
+
+from invoke import Result, UnexpectedExit
+
+from src.common.bundle import Bundle
+from src.common.template import Artifact
+
+MARKER = '__WISE_BATCH__'
+
+
+@dataclass
+class BatchCommand(object):
+    command: str
+    warn: bool = False
+    user: Optional[str] = None
+
+    def wrapped(self) -> str:
+        if self.user:
+            return 'sudo -H -u {0} bash -c {1}'.format(self.user, shlex.quote(self.command))
+        return self.command
+
+
+@dataclass
+class BatchResult(object):
+    command: str
+    exited: int
+
+    @property
+    def ok(self):
+        return self.exited == 0
+
+    @property
+    def failed(self):
+        return not self.ok
+
+
+class CommandBatch(object):
+    """
+    Queue privileged commands and ship them to the server as a single script.
+
+    Every command keeps its own exit status and `warn` flag: a failing
+    command without `warn=True` stops the script and raises `UnexpectedExit`
+    exactly like `connection.sudo` would.
+
+    Artifacts queued with `install` travel in one bundle, uploaded right
+    before the script runs and unpacked where the first one was queued;
+    their `post_install` commands are queued right after each of them.
+    """
+
+    def __init__(self, connection, hide=None):
+        self.connection = connection
+        self.hide = hide
+        self.commands: List[BatchCommand] = []
+        self.results: List[BatchResult] = []
+        self.bundle: Optional[Bundle] = None
+        self._bundle_command: Optional[BatchCommand] = None
+        self._lock = threading.Lock()
+
+    def sudo(self, command: str, warn: bool = False, user: Optional[str] = None):
+        with self._lock:
+            self.commands.append(BatchCommand(command=command, warn=warn, user=user))
+
+    def install(self, artifact: Artifact):
+        with self._lock:
+            if self.bundle is None:
+                self.bundle = Bundle()
+                # Filled in by `execute` once the bundle has a remote path.
+                self._bundle_command = BatchCommand(command='')
+                self.commands.append(self._bundle_command)
+            self.bundle.add(artifact)
+            # Queued after the bundle command, they see the file in place.
+            self.commands += [BatchCommand(command=command) for command in artifact.post_install]
+
+    def script(self) -> str:
+        lines = []
+        for index, item in enumerate(self.commands):
+            lines.append('(\n{0}\n); rc=$?; echo "{1} {2} $rc" >&2'.format(item.wrapped(), MARKER, index))
+            if not item.warn:
+                lines.append('[ $rc -eq 0 ] || exit $rc')
+        return '\n'.join(lines)
+
+    def execute(self) -> List[BatchResult]:
+        if not self.commands:
+            return self.results
+        if self.bundle is not None:
+            self._bundle_command.command = Bundle.install_command(self.bundle.upload(self.connection))
+
+        hide_out = self.hide in ('out', 'stdout', 'both', True)
+        hide_err = self.hide in ('err', 'stderr', 'both', True)
+        result = self.connection.sudo(
+            'bash -c {0}'.format(shlex.quote(self.script())),
+            warn=True, hide='both' if hide_out else 'err',
+        )
+
+        stderr = []
+        for line in result.stderr.splitlines():
+            if line.startswith(MARKER):
+                _, index, exited = line.split()
+                self.results.append(BatchResult(command=self.commands[int(index)].command, exited=int(exited)))
+            else:
+                stderr.append(line)
+
+        if not hide_err and stderr:
+            sys.stderr.write('\n'.join(stderr) + '\n')
+
+        for item, item_result in zip(self.commands, self.results):
+            if item_result.failed and not item.warn:
+                raise UnexpectedExit(Result(
+                    stdout=result.stdout,
+                    stderr='\n'.join(stderr),
+                    command=item.command,
+                    exited=item_result.exited,
+                    hide=('stdout', 'stderr'),
+                ))
+        if len(self.results) < len(self.commands):
+            raise UnexpectedExit(result)
+        return self.results
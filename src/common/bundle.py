@@ -0,0 +1,87 @@
+import io
+import json
+import shlex
+import tarfile
+import uuid
+from typing import List
+
+from src.common.template import Artifact
+
+MANIFEST_NAME = 'manifest.json'
+INSTALL_NAME = 'install.sh'
+REMOTE_PATTERN = '/tmp/wise-bundle-{0}.tar.gz'
+
+
+class Bundle(object):
+    """
+    Rendered artifacts packed into one tar.gz with a manifest and an install script.
+
+    The bundle is uploaded once under a unique name and unpacked by a single
+    privileged command; every file is written next to its destination and
+    renamed over it, so readers never see a half written config.
+    """
+
+    def __init__(self, artifacts: List[Artifact] = None):
+        self.artifacts: List[Artifact] = list(artifacts or [])
+
+    def add(self, artifact: Artifact):
+        self.artifacts.append(artifact)
+
+    def ordered(self) -> List[Artifact]:
+        """
+        Artifacts by destination, so steps queueing them concurrently always produce the same archive.
+        """
+        return sorted(self.artifacts, key=lambda artifact: artifact.remote)
+
+    def manifest(self) -> List[dict]:
+        return [
+            {
+                'file': 'files/{0}'.format(index),
+                'dest': artifact.remote,
+                'mode': artifact.mode,
+                'owner': artifact.owner,
+                'sha256': artifact.checksum,
+            }
+            for index, artifact in enumerate(self.ordered())
+        ]
+
+    def install_script(self) -> str:
+        lines = ['set -e', 'root="$1"']
+        for entry in self.manifest():
+            dest = shlex.quote(entry['dest'])
+            staged = shlex.quote('{0}.wise-new'.format(entry['dest']))
+            lines.append('cp "$root"/{0} {1}'.format(entry['file'], staged))
+            if entry['mode']:
+                lines.append('chmod {0} {1}'.format(entry['mode'], staged))
+            if entry['owner']:
+                lines.append('chown {0} {1}'.format(entry['owner'], staged))
+            lines.append('mv -f {0} {1}'.format(staged, dest))
+        return '\n'.join(lines) + '\n'
+
+    def archive(self) -> bytes:
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+            members = [(MANIFEST_NAME, json.dumps(self.manifest(), indent=2)), (INSTALL_NAME, self.install_script())]
+            members += [('files/{0}'.format(index), artifact.content) for index, artifact in enumerate(self.ordered())]
+            for name, content in members:
+                data = content.encode('utf-8')
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mode = 0o644
+                tar.addfile(info, io.BytesIO(data))
+        return buffer.getvalue()
+
+    def upload(self, connection) -> str:
+        """
+        Send the bundle in one transfer and return its remote path.
+        """
+        remote = REMOTE_PATTERN.format(uuid.uuid4().hex)
+        connection.put(local=io.BytesIO(self.archive()), remote=remote)
+        return remote
+
+    @staticmethod
+    def install_command(remote: str) -> str:
+        return (
+            'root=$(mktemp -d) && tar -xzf {0} -C "$root" && bash "$root"/{1} "$root"; '
+            'rc=$?; rm -rf "$root" {0}; exit $rc'.format(remote, INSTALL_NAME)
+        )
@@ -0,0 +1,46 @@
+from fabric.connection import Connection
+
+from src.common.ledger import LOCAL, ledger, output_size, payload_size
+from src.common.tracing import COMMAND, tracer
+
+
+class InstrumentedConnection(Connection):
+    """
+    Connection that records every remote and local call as a command span
+    and as a ledger entry.
+    """
+
+    def instrument(self, kind: str, command: str, method, *args, bytes_out: int = None, **kwargs):
+        name = command.strip().splitlines()[0][:80] if command.strip() else kind
+        if bytes_out is None:
+            bytes_out = 0 if kind == LOCAL else len(command.encode('utf-8'))
+        with tracer.span(name, COMMAND, host=self.host, kind=kind) as span, \
+                ledger.entry(kind, command, host=self.host, bytes_out=bytes_out) as entry:
+            result = method(*args, **kwargs)
+            entry.exited = getattr(result, 'exited', 0)
+            if kind == 'get':
+                entry.bytes_in = payload_size(getattr(result, 'local', ''))
+            elif kind != LOCAL:
+                entry.bytes_in = output_size(result)
+            if span is not None:
+                span.exit_code = entry.exited
+            return result
+
+    def run(self, command, **kwargs):
+        return self.instrument('run', command, super().run, command, **kwargs)
+
+    def sudo(self, command, **kwargs):
+        return self.instrument('sudo', command, super().sudo, command, **kwargs)
+
+    def local(self, *args, **kwargs):
+        command = args[0] if args else kwargs.get('command', '')
+        return self.instrument(LOCAL, command, super().local, *args, **kwargs)
+
+    def put(self, local, remote=None, **kwargs):
+        return self.instrument(
+            'put', 'put {0}'.format(remote), super().put, local, remote,
+            bytes_out=payload_size(local), **kwargs
+        )
+
+    def get(self, remote, local=None, **kwargs):
+        return self.instrument('get', 'get {0}'.format(remote), super().get, remote, local, **kwargs)
@@ -1,11 +1,58 @@
-from dataclasses import dataclass
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Optional
 
 from fabric import Connection
 
 from src.commands.config import ProjectConfig
+from src.common.batch import CommandBatch
+from src.common.tuning import HostFacts
 
 
 @dataclass
 class CommandContext(object):
     connection: Connection
     config: ProjectConfig
+    _facts: Optional[HostFacts] = field(default=None, init=False, repr=False)
+    _batch: Optional[CommandBatch] = field(default=None, init=False, repr=False)
+    _parent: Optional['CommandContext'] = field(default=None, init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    @property
+    def facts(self) -> HostFacts:
+        """
+        Cores and memory of the remote host, probed once per context and its forks.
+        """
+        if self._parent is not None:
+            return self._parent.facts
+        with self._lock:
+            if self._facts is None:
+                self._facts = HostFacts.probe(self.connection)
+        return self._facts
+
+    def fork(self, batch: Optional[CommandBatch] = None) -> 'CommandContext':
+        """
+        Context for a step running concurrently: same connection and facts, its own batch
+        or `batch`, which its `batch()` blocks join without running it.
+        """
+        context = CommandContext(connection=self.connection, config=self.config)
+        context._parent = self._parent or self
+        context._batch = batch
+        return context
+
+    @contextmanager
+    def batch(self, hide=None):
+        """
+        Collect `sudo` commands and run them in one round trip on exit.
+        Nested batches join the outermost one, which runs everything.
+        """
+        if self._batch is not None:
+            yield self._batch
+            return
+        self._batch = CommandBatch(self.connection, hide=hide)
+        try:
+            yield self._batch
+            self._batch.execute()
+        finally:
+            self._batch = None
@@ -1,16 +1,17 @@
 import json
 import sys
+import time
 import warnings
 
 import click
-from fabric import Config
 from os.path import isfile, exists
-from functools import wraps
-from getpass import getpass
-from fabric.connection import Connection
+from functools import partial, wraps
 from paramiko import AuthenticationException
-from src.commands.config import CONFIG_FILE_NAME, load_settings
+from src.commands.config import CONFIG_FILE_NAME
 from src.common.context import CommandContext
+from src.common.fanout import fan_out, print_summary
+from src.common.session import Session
+from src.common.tracing import PIPELINE, tracer
 
 
 def logit(logfile='out.log'):
@@ -23,64 +24,89 @@ def logit(logfile='out.log'):
             with open(logfile, 'a') as opened_file:
                 # Now we log to the specified logfile
                 opened_file.write(log_string + '\n')
+            return func(*args, **kwargs)
         return wrapped_function
     return logging_decorator
 
 
-def update_config_file(key, value):
-    with open(CONFIG_FILE_NAME, 'r+') as f:
+def update_config_file(key, value, config_file=CONFIG_FILE_NAME):
+    with open(config_file, 'r+') as f:
         data = json.load(f)
-        if 'https' in data:
-            data['https'] = True  # <--- add `https` value.
-            f.seek(0)  # <--- should reset file position to the beginning.
-            json.dump(data, f, indent=4)
-            f.truncate()  # remove remaining part
+        data[key] = value
+        f.seek(0)  # <--- should reset file position to the beginning.
+        json.dump(data, f, indent=4)
+        f.truncate()  # remove remaining part
 
 
-def settings(allow_sudo=False, only_local=False):
+def execute(func, context, only_local, *args, **kwargs):
+    try:
+        with tracer.span(func.__name__, PIPELINE, host=context.connection.host):
+            if not only_local and not context.connection.is_connected:
+                context.connection.run('uname', hide='both', warn=True)
+            func(context, *args, **kwargs)
+    except AuthenticationException:
+        click.echo(
+            click.style(
+                'Your ssh connection isn\'t configured correctly\n'
+                'Set your private ssh_keyfile for [{0}]'.format(context.connection.user),
+                fg='red'
+            )
+        )
+
+
+def settings(allow_sudo=False, only_local=False, balancer=False, merged=False, compress=False):
+    """
+    Run the pipeline once per host, or once with the contexts of every host when `merged`.
+    """
     def settings_decorator(func):
         @wraps(func)
         def wrapped_function(*args, **kwargs):
             with warnings.catch_warnings():
                 warnings.simplefilter('ignore')
-                file_exists = exists(CONFIG_FILE_NAME)
+                session = Session.current()
+                file_exists = exists(session.config_file)
                 if not file_exists:
-                    print('Valid [{0}] file is required!'.format(CONFIG_FILE_NAME))
+                    print('Valid [{0}] file is required!'.format(session.config_file))
+                    return
+                config = session.config
+                if not isfile(config.sshkey):
+                    sys.exit('[sshkey] file doesn\'t exists')
+
+                hosts = [config.balancer.get('host')] if balancer else config.hosts
+                if not all(hosts):
+                    print('[balancer.host] is required!' if balancer else '[hosts] are required!')
+                    return
+                if merged:
+                    contexts = [
+                        CommandContext(connection=session.connection(host, allow_sudo, compress), config=config)
+                        for host in hosts
+                    ]
+                    try:
+                        func(contexts, *args, **kwargs)
+                    except AuthenticationException:
+                        click.echo(click.style('Your ssh connection isn\'t configured correctly', fg='red'))
                     return
-                with load_settings() as config:
-                    key_filename = config.sshkey
-                    connection_config = {
-                        'host': config.ipv4,
-                        'port': config.port
-                    }
-                    if allow_sudo:
-                        sudo_pass = getpass('Put your [SUDO] password for User [{0}]: '.format(config.superuser))
-                        connection_config['user'] = config.superuser
-                        connection_config['config'] = Config(
-                            overrides={'sudo': {'password': sudo_pass}}
-                        )
-                    else:
-                        connection_config['user'] = config.project_user
 
-                    if not isfile(key_filename):
-                        sys.exit('[sshkey] file doesn\'t exists')
-                    connection_config['connect_kwargs'] = {'key_filename': key_filename}
+                if len(hosts) == 1:
                     context = CommandContext(
-                        connection=Connection(**connection_config),
+                        connection=session.connection(hosts[0], allow_sudo, compress),
                         config=config,
                     )
+                    execute(func, context, only_local, *args, **kwargs)
+                    return
 
-                    try:
-                        if not only_local:
-                            context.connection.run('uname', hide='both', warn=True)
-                        func(context, *args, **kwargs)
-                    except AuthenticationException:
-                        click.echo(
-                            click.style(
-                                'Your ssh connection isn\'t configured correctly\n'
-                                'Set your private ssh_keyfile for [{0}]'.format(connection_config['user']),
-                                fg='red'
-                            )
-                        )
+                jobs = []
+                for host in hosts:
+                    context = CommandContext(
+                        connection=session.connection(host, allow_sudo, compress),
+                        config=config,
+                    )
+                    jobs.append((host, session.stream(host), partial(execute, func, context, only_local, *args, **kwargs)))
+
+                started = time.monotonic()
+                results = fan_out(jobs, concurrency=config.concurrency)
+                print_summary(results, elapsed=time.monotonic() - started)
+                if not all(result.ok for result in results):
+                    sys.exit(1)
         return wrapped_function
     return settings_decorator
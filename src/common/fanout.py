@@ -0,0 +1,138 @@
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+import click
+
+_local = threading.local()
+
+
+def current_stream():
+    return getattr(_local, 'stream', None)
+
+
+def bind_stream(stream):
+    """
+    Route this thread's output to `stream`, used by threads started inside a host job.
+    """
+    _local.stream = stream
+
+
+class HostStream(object):
+    """
+    Line buffered writer that prefixes every line with the host label.
+    """
+
+    def __init__(self, host: str, target=None):
+        self.host = host
+        self.target = target or sys.stdout
+        self._buffer = ''
+        self._lock = threading.Lock()
+
+    def write(self, data):
+        if isinstance(data, bytes):
+            data = data.decode('utf-8', 'replace')
+        with self._lock:
+            self._buffer += data
+            *lines, self._buffer = self._buffer.split('\n')
+        for line in lines:
+            HostStream.emit(self.target, '[{0}] {1}\n'.format(self.host, line))
+        return len(data)
+
+    def flush(self):
+        with self._lock:
+            pending, self._buffer = self._buffer, ''
+        if pending:
+            HostStream.emit(self.target, '[{0}] {1}\n'.format(self.host, pending))
+        self.target.flush()
+
+    def isatty(self):
+        return False
+
+    _emit_lock = threading.Lock()
+
+    @staticmethod
+    def emit(target, line):
+        with HostStream._emit_lock:
+            target.write(line)
+
+
+class DispatchStream(object):
+    """
+    `sys.stdout` replacement that routes writes to the current thread's HostStream.
+    """
+
+    def __init__(self, target):
+        self.target = target
+
+    def _current(self):
+        return getattr(_local, 'stream', None) or self.target
+
+    def write(self, data):
+        return self._current().write(data)
+
+    def flush(self):
+        self._current().flush()
+
+    def isatty(self):
+        return False
+
+    def __getattr__(self, item):
+        return getattr(self.target, item)
+
+
+@dataclass
+class HostResult(object):
+    host: str
+    ok: bool
+    duration: float
+    error: Optional[str] = None
+
+
+def run_on_host(host: str, stream: Optional[HostStream], func: Callable) -> HostResult:
+    _local.stream = stream
+    started = time.monotonic()
+    try:
+        func()
+        return HostResult(host=host, ok=True, duration=time.monotonic() - started)
+    except (Exception, SystemExit) as exc:
+        click.echo(click.style('-> {0}'.format(exc or exc.__class__.__name__), fg='red'))
+        return HostResult(host=host, ok=False, duration=time.monotonic() - started, error=str(exc))
+    finally:
+        if stream is not None:
+            stream.flush()
+        _local.stream = None
+
+
+def fan_out(jobs: List[tuple], concurrency: int = 1) -> List[HostResult]:
+    """
+    Run `(host, stream, func)` jobs on a bounded thread pool.
+    Results keep the order of `jobs`.
+    """
+    original_stdout = sys.stdout
+    sys.stdout = DispatchStream(original_stdout)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            futures = [
+                executor.submit(run_on_host, host, stream, func)
+                for host, stream, func in jobs
+            ]
+            return [future.result() for future in futures]
+    finally:
+        sys.stdout = original_stdout
+
+
+def print_summary(results: List[HostResult], elapsed: float):
+    width = max([len(result.host) for result in results] + [4])
+    click.echo(click.style('\n>> Summary', fg='green'))
+    click.echo('{0}  {1:<6}  {2:>9}'.format('HOST'.ljust(width), 'STATUS', 'DURATION'))
+    for result in results:
+        click.echo('{0}  {1}  {2:>8.1f}s'.format(
+            result.host.ljust(width),
+            click.style('{0:<6}'.format('ok' if result.ok else 'failed'), fg='cyan' if result.ok else 'red'),
+            result.duration,
+        ))
+    click.echo('Total: {0:.1f}s across {1} host(s)'.format(elapsed, len(results)))
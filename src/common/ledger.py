@@ -0,0 +1,144 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from functools import wraps
+from typing import List, Optional
+
+import click
+
+LOCAL = 'local'
+STRICT_ENV = 'WISE_STRICT_BUDGETS'
+
+
+@dataclass
+class LedgerEntry(object):
+    kind: str
+    command: str
+    host: Optional[str]
+    start: float
+    duration: float = 0.0
+    bytes_in: int = 0
+    bytes_out: int = 0
+    exited: Optional[int] = None
+
+    @property
+    def remote(self) -> bool:
+        return self.kind != LOCAL
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+def payload_size(local) -> int:
+    """
+    Size in bytes of what `put` sends: a local path or a file-like object.
+    """
+    if isinstance(local, str):
+        return os.path.getsize(local) if os.path.isfile(local) else 0
+    data = local.getvalue() if hasattr(local, 'getvalue') else b''
+    return len(data.encode('utf-8') if isinstance(data, str) else data)
+
+
+def output_size(result) -> int:
+    return sum(
+        len((getattr(result, stream, '') or '').encode('utf-8')) for stream in ('stdout', 'stderr')
+    )
+
+
+class Ledger(object):
+    """
+    Every command sent through an InstrumentedConnection, with its cost.
+
+    Round trips are what a deploy to a far away region pays for, so the
+    ledger is always on; it keeps a few fields per command.
+    """
+
+    def __init__(self):
+        self.entries: List[LedgerEntry] = []
+        self.strict = bool(os.environ.get(STRICT_ENV))
+        self._lock = threading.Lock()
+        self._origin = time.monotonic()
+
+    @contextmanager
+    def entry(self, kind: str, command: str, host: Optional[str] = None, bytes_out: int = 0):
+        started = time.monotonic()
+        entry = LedgerEntry(
+            kind=kind, command=command, host=host,
+            start=started - self._origin, bytes_out=bytes_out,
+        )
+        try:
+            yield entry
+        except Exception as exc:
+            if entry.exited is None:
+                entry.exited = getattr(getattr(exc, 'result', None), 'exited', 1)
+            raise
+        finally:
+            entry.duration = time.monotonic() - started
+            with self._lock:
+                self.entries.append(entry)
+
+    def mark(self) -> int:
+        with self._lock:
+            return len(self.entries)
+
+    def since(self, mark: int, host: Optional[str] = None) -> List[LedgerEntry]:
+        with self._lock:
+            entries = self.entries[mark:]
+        return [entry for entry in entries if host is None or entry.host == host]
+
+    def dump(self, path: str):
+        with open(path, 'w') as f:
+            for entry in self.entries:
+                f.write(json.dumps(asdict(entry)) + '\n')
+
+    def summary(self):
+        remote = [entry for entry in self.entries if entry.remote]
+        if not remote:
+            return
+        click.echo(click.style('\n>> Remote commands', fg='green'))
+        for host in sorted({entry.host for entry in remote}):
+            entries = [entry for entry in remote if entry.host == host]
+            click.echo('{0:<24} {1:>5} round trips  {2:>9.1f} KiB out  {3:>9.1f} KiB in  {4:>7.2f}s'.format(
+                host,
+                len(entries),
+                sum(entry.bytes_out for entry in entries) / 1024,
+                sum(entry.bytes_in for entry in entries) / 1024,
+                sum(entry.duration for entry in entries),
+            ))
+
+
+ledger = Ledger()
+
+
+def budget(commands: Optional[int] = None, bytes: Optional[int] = None):
+    """
+    Declare how many remote commands and bytes a pipeline may spend per host.
+
+    Overruns are reported, and raise `BudgetExceeded` when the ledger is
+    strict (tests, or `WISE_STRICT_BUDGETS=1`).
+    """
+    def budget_decorator(func):
+        @wraps(func)
+        def wrapped_function(context, *args, **kwargs):
+            mark = ledger.mark()
+            result = func(context, *args, **kwargs)
+            entries = [entry for entry in ledger.since(mark, context.connection.host) if entry.remote]
+            spent = sum(entry.bytes_in + entry.bytes_out for entry in entries)
+
+            overruns = []
+            if commands is not None and len(entries) > commands:
+                overruns.append('{0} remote commands (budget {1})'.format(len(entries), commands))
+            if bytes is not None and spent > bytes:
+                overruns.append('{0} bytes (budget {1})'.format(spent, bytes))
+            if overruns:
+                message = '[{0}] on {1} used {2}'.format(func.__name__, context.connection.host, ', '.join(overruns))
+                if ledger.strict:
+                    raise BudgetExceeded(message)
+                click.echo(click.style('-> Over budget: {0}'.format(message), fg='red'))
+            return result
+        return wrapped_function
+    return budget_decorator
@@ -0,0 +1,86 @@
+import shlex
+from dataclasses import dataclass
+from typing import Dict, List, Set
+
+import click
+
+from src.common.template import Artifact
+
+CREATE = 'create'
+UPDATE = 'update'
+UNCHANGED = 'unchanged'
+
+
+@dataclass
+class PlanEntry(object):
+    artifact: Artifact
+    action: str
+
+
+class Plan(object):
+    """
+    Difference between the locally rendered artifacts and the files on the server.
+    """
+
+    def __init__(self, entries: List[PlanEntry]):
+        self.entries = entries
+
+    @staticmethod
+    def remote_checksums(connection, paths: List[str]) -> Dict[str, str]:
+        result = connection.sudo(
+            'sha256sum -- {0}'.format(' '.join(shlex.quote(path) for path in paths)),
+            warn=True, hide='both',
+        )
+        checksums = {}
+        for line in result.stdout.splitlines():
+            checksum, _, path = line.partition('  ')
+            if path:
+                checksums[path] = checksum
+        return checksums
+
+    @classmethod
+    def build(cls, connection, artifacts: List[Artifact]) -> 'Plan':
+        checksums = cls.remote_checksums(connection, [artifact.remote for artifact in artifacts])
+        entries = []
+        for artifact in artifacts:
+            remote_checksum = checksums.get(artifact.remote)
+            if remote_checksum is None:
+                action = CREATE
+            elif remote_checksum != artifact.checksum:
+                action = UPDATE
+            else:
+                action = UNCHANGED
+            entries.append(PlanEntry(artifact=artifact, action=action))
+        return cls(entries)
+
+    @property
+    def changed(self) -> List[Artifact]:
+        return [entry.artifact for entry in self.entries if entry.action != UNCHANGED]
+
+    @property
+    def services(self) -> Set[str]:
+        """
+        Services whose configuration changed and need to pick it up.
+        """
+        return {artifact.service for artifact in self.changed if artifact.service}
+
+    def apply(self, context):
+        changed = self.changed
+        if not changed:
+            return changed
+        with context.batch(hide='both') as batch:
+            for artifact in changed:
+                batch.install(artifact)
+        return changed
+
+    def echo(self):
+        colors = {CREATE: 'green', UPDATE: 'yellow', UNCHANGED: 'white'}
+        for entry in self.entries:
+            click.echo('{0} {1}'.format(
+                click.style('{0:<10}'.format(entry.action), fg=colors[entry.action]),
+                entry.artifact.remote,
+            ))
+        if self.services:
+            click.echo(click.style('-> Restart required: {0}'.format(', '.join(sorted(self.services))), fg='cyan'))
+        else:
+            click.echo(click.style('-> No service restart required', fg='cyan'))
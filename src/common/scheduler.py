@@ -0,0 +1,120 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Set
+
+from src.common.batch import CommandBatch
+from src.common.fanout import bind_stream, current_stream
+
+# Pseudo step running the shared batch once every batched step queued its commands.
+FLUSH = '<flush>'
+
+
+def step_name(func: Callable) -> str:
+    return getattr(func, '__qualname__', func.__name__)
+
+
+@dataclass
+class Step(object):
+    name: str
+    func: Callable
+    after: Set[str] = field(default_factory=set)
+    batched: bool = False
+
+
+class Scheduler(object):
+    """
+    Run steps as soon as the steps they depend on are done, on a bounded pool.
+
+    Each step receives its own fork of the CommandContext: they share the SSH
+    connection, each running its commands on separate channels. Adding a
+    step twice keeps one node with the union of its dependencies.
+
+    `batched` steps only queue their `context.batch()` commands and files
+    into one batch shared by the whole run, which is uploaded and executed
+    once all of them are queued. A batched step may follow another one, its
+    commands are queued after them; any other step that depends on a
+    batched one waits for that single flush.
+    """
+
+    def __init__(self, max_workers: int = 4, hide=None):
+        self.max_workers = max(1, max_workers)
+        self.hide = hide
+        self.steps: Dict[str, Step] = {}
+
+    def add(self, func: Callable, after: Iterable[Callable] = (), batched: bool = False) -> 'Scheduler':
+        name = step_name(func)
+        step = self.steps.setdefault(name, Step(name=name, func=func))
+        step.after.update(step_name(dependency) for dependency in after)
+        step.batched = step.batched or batched
+        return self
+
+    def graph(self) -> Dict[str, Set[str]]:
+        """
+        Dependencies of every step, with batched dependencies of other steps replaced by the flush.
+        """
+        for step in self.steps.values():
+            unknown = step.after - set(self.steps)
+            if unknown:
+                raise ValueError('[{0}] depends on unknown steps: {1}'.format(step.name, ', '.join(sorted(unknown))))
+
+        batched = {name for name, step in self.steps.items() if step.batched}
+        graph = {}
+        for name, step in self.steps.items():
+            if not step.batched and step.after & batched:
+                graph[name] = (step.after - batched) | {FLUSH}
+            else:
+                graph[name] = set(step.after)
+        if batched:
+            graph[FLUSH] = batched
+        return graph
+
+    def order(self) -> List[str]:
+        """
+        Step names in a valid sequential order, raises `ValueError` on unknown steps or cycles.
+        """
+        graph = self.graph()
+        ordered, done = [], set()
+        while len(done) < len(graph):
+            ready = [name for name, after in graph.items() if name not in done and after <= done]
+            if not ready:
+                pending = [name for name in graph if name not in done]
+                raise ValueError('Cyclic step dependencies: {0}'.format(', '.join(pending)))
+            ordered += ready
+            done.update(ready)
+        return [name for name in ordered if name != FLUSH]
+
+    def run(self, context):
+        self.order()
+        graph = self.graph()
+        stream = current_stream()
+        shared = CommandBatch(context.connection, hide=self.hide) if FLUSH in graph else None
+
+        def call(name):
+            bind_stream(stream)
+            try:
+                if name == FLUSH:
+                    shared.execute()
+                    return
+                step = self.steps[name]
+                step.func(context.fork(batch=shared if step.batched else None))
+            finally:
+                bind_stream(None)
+
+        done, running, error = set(), {}, None
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while len(done) < len(graph):
+                if error is None:
+                    for name, after in graph.items():
+                        if name not in done and name not in running.values() and after <= done:
+                            running[executor.submit(call, name)] = name
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    if future.exception() is not None:
+                        error = error or future.exception()
+                    else:
+                        done.add(name)
+        if error is not None:
+            raise error
@@ -0,0 +1,107 @@
+import threading
+from getpass import getpass
+from typing import Callable, Dict, Optional, Tuple
+
+import click
+
+from src.commands.config import ProjectConfig, load_settings
+from src.common.fanout import HostStream
+from src.constants import CONFIG_FILE_NAME
+
+
+def build_connection(config, host, allow_sudo=False, sudo_pass=None, stream=None, compress=False):
+    from fabric import Config
+
+    from src.common.connection import InstrumentedConnection
+
+    connection_config = {
+        'host': host,
+        'port': config.port,
+        'connect_kwargs': {'key_filename': config.sshkey, 'compress': compress},
+    }
+    overrides = {}
+    if allow_sudo:
+        connection_config['user'] = config.superuser
+        overrides['sudo'] = {'password': sudo_pass}
+    else:
+        connection_config['user'] = config.project_user
+
+    if stream is not None:
+        overrides['run'] = {'out_stream': stream, 'err_stream': stream}
+    if overrides:
+        connection_config['config'] = Config(overrides=overrides)
+    return InstrumentedConnection(**connection_config)
+
+
+class Session(object):
+    """
+    State shared by every command of a single `wise` invocation.
+
+    The config file is read once, the sudo password is asked once and kept
+    in memory, and one SSH connection per (host, role) stays open until the
+    session is closed. `connection_factory` builds those connections and can
+    be swapped for a stand-in that never touches the network.
+    """
+
+    def __init__(
+        self,
+        config_file: str = CONFIG_FILE_NAME,
+        connection_factory: Callable = build_connection,
+        sudo_pass: Optional[str] = None,
+    ):
+        self.config_file = config_file
+        self.connection_factory = connection_factory
+        self._config: Optional[ProjectConfig] = None
+        self._sudo_pass: Optional[str] = sudo_pass
+        self._streams: Dict[str, HostStream] = {}
+        self._connections: Dict[Tuple[str, bool, bool], 'InstrumentedConnection'] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def current(cls) -> 'Session':
+        click_context = click.get_current_context(silent=True)
+        session = click_context.find_object(cls) if click_context else None
+        return session or cls()
+
+    @property
+    def config(self) -> ProjectConfig:
+        if self._config is None:
+            with load_settings(self.config_file) as config:
+                self._config = config
+        return self._config
+
+    @property
+    def multi_host(self) -> bool:
+        return len(self.config.hosts) > 1
+
+    def sudo_password(self) -> str:
+        if self._sudo_pass is None:
+            self._sudo_pass = getpass(
+                'Put your [SUDO] password for User [{0}]: '.format(self.config.superuser)
+            )
+        return self._sudo_pass
+
+    def stream(self, host: str) -> Optional[HostStream]:
+        if not self.multi_host:
+            return None
+        if host not in self._streams:
+            self._streams[host] = HostStream(host)
+        return self._streams[host]
+
+    def connection(self, host: str, allow_sudo: bool = False, compress: bool = False) -> 'InstrumentedConnection':
+        key = (host, allow_sudo, compress)
+        with self._lock:
+            if key not in self._connections:
+                self._connections[key] = self.connection_factory(
+                    self.config, host,
+                    allow_sudo=allow_sudo,
+                    sudo_pass=self.sudo_password() if allow_sudo else None,
+                    stream=self.stream(host),
+                    compress=compress,
+                )
+            return self._connections[key]
+
+    def close(self):
+        for connection in self._connections.values():
+            connection.close()
+        self._connections.clear()
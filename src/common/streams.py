@@ -0,0 +1,144 @@
+from contextlib import contextmanager
+
+from src.common.ledger import ledger
+
+STREAM_CHUNK_SIZE = 64 * 1024
+MAX_LINE_SIZE = 1024 * 1024
+
+
+class ChannelWriter(object):
+    """
+    File-like writer over the stdin of a remote command.
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.sent = 0
+
+    def write(self, data):
+        self.channel.sendall(data)
+        self.sent += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+@contextmanager
+def remote_stdin(connection, command: str):
+    """
+    Run `command` on a new channel of the open transport and yield a writer to its stdin.
+    Raises `IOError` when the command exits with a non zero status.
+    """
+    connection.open()
+    channel = connection.transport.open_session()
+    with ledger.entry('stream', command, host=connection.host) as entry:
+        channel.exec_command(command)
+        writer = ChannelWriter(channel)
+        try:
+            yield writer
+            channel.shutdown_write()
+            entry.exited = channel.recv_exit_status()
+            if entry.exited != 0:
+                error = channel.makefile_stderr('rb').read().decode('utf-8', 'replace')
+                raise IOError('[{0}] exited with {1}: {2}'.format(command, entry.exited, error.strip()))
+        finally:
+            entry.bytes_out = len(command.encode('utf-8')) + writer.sent
+            channel.close()
+
+
+@contextmanager
+def remote_lines(connection, command: str, pty: bool = False):
+    """
+    Run `command` on a new channel and yield an iterator over its stdout lines.
+
+    Output is read in chunks and never accumulated, so a command that runs
+    for hours (`tail -F`) keeps memory flat. With `pty` the remote processes
+    get a hangup when the channel closes.
+    """
+    connection.open()
+    channel = connection.transport.open_session()
+    if pty:
+        channel.get_pty()
+    with ledger.entry('stream', command, host=connection.host) as entry:
+        entry.bytes_out = len(command.encode('utf-8'))
+        channel.exec_command(command)
+
+        def lines():
+            pending = b''
+            while True:
+                chunk = channel.recv(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                entry.bytes_in += len(chunk)
+                *complete, pending = (pending + chunk).split(b'\n')
+                if len(pending) > MAX_LINE_SIZE:
+                    complete.append(pending)
+                    pending = b''
+                for line in complete:
+                    yield line.rstrip(b'\r').decode('utf-8', 'replace')
+            if pending:
+                yield pending.rstrip(b'\r').decode('utf-8', 'replace')
+
+        try:
+            yield lines()
+        finally:
+            channel.close()
+            entry.exited = channel.exit_status if channel.exit_status_ready() else None
+
+
+@contextmanager
+def remote_stdout(connection, command: str, stdin: bytes = b''):
+    """
+    Run `command` on a new channel and yield an iterator over its stdout chunks.
+
+    `stdin` is written first (e.g. a password for `sudo -S`). Once the chunks
+    are consumed, a non zero exit status raises `IOError`.
+    """
+    connection.open()
+    channel = connection.transport.open_session()
+    with ledger.entry('stream', command, host=connection.host) as entry:
+        entry.bytes_out = len(command.encode('utf-8')) + len(stdin)
+        channel.exec_command(command)
+        if stdin:
+            channel.sendall(stdin)
+        channel.shutdown_write()
+
+        def chunks():
+            while True:
+                chunk = channel.recv(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                entry.bytes_in += len(chunk)
+                yield chunk
+
+        try:
+            yield chunks()
+            entry.exited = channel.recv_exit_status()
+            if entry.exited != 0:
+                error = channel.makefile_stderr('rb').read().decode('utf-8', 'replace')
+                raise IOError('[{0}] exited with {1}: {2}'.format(command, entry.exited, error.strip()))
+        finally:
+            channel.close()
+
+
+class ChunkReader(object):
+    """
+    File-like reader over an iterator of byte chunks, e.g. the one `remote_stdout` yields.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.pending = b''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.pending) < size:
+            chunk = next(self.chunks, b'')
+            if not chunk:
+                break
+            self.pending += chunk
+        if size < 0:
+            data, self.pending = self.pending, b''
+        else:
+            data, self.pending = self.pending[:size], self.pending[size:]
+        return data
@@ -1,7 +1,34 @@
-
-from dataclasses import dataclass
+import hashlib
+import os
+from dataclasses import dataclass, field
+from functools import lru_cache
 from io import StringIO
-from jinja2 import Environment, PackageLoader, select_autoescape
+from typing import Dict, Iterable, List, Optional
+
+from jinja2 import Environment, FileSystemBytecodeCache, PackageLoader, select_autoescape
+
+TEMPLATES_CACHE_SIZE = 64
+TEMPLATES_BYTECODE_DIR = os.environ.get('WISE_TEMPLATES_CACHE')
+
+
+@lru_cache(maxsize=None)
+def get_environment() -> Environment:
+    """
+    Process-wide Jinja environment, compiled templates are kept in a
+    bounded LRU and optionally persisted in `$WISE_TEMPLATES_CACHE`.
+    """
+    bytecode_cache = None
+    if TEMPLATES_BYTECODE_DIR:
+        os.makedirs(TEMPLATES_BYTECODE_DIR, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(TEMPLATES_BYTECODE_DIR)
+
+    return Environment(
+        loader=PackageLoader('src', 'templates'),
+        autoescape=select_autoescape(['html', 'xml']),
+        cache_size=TEMPLATES_CACHE_SIZE,
+        auto_reload=False,
+        bytecode_cache=bytecode_cache,
+    )
 
 
 @dataclass
@@ -13,17 +40,41 @@ class Template(StringIO):
         content = self.render(self.name, self.context)
         super().__init__(content)
 
-    def upload(self, connection, remote):
-        tmp_file = '/tmp/{0}'.format(self.name)
-        connection.put(local=self, remote=tmp_file)
-        connection.sudo('mv {0} {1}'.format(tmp_file, remote))
-
     @classmethod
     def render(cls, name, context=None):
         context = context or {}
-        env = Environment(
-            loader=PackageLoader('src', 'templates'),
-            autoescape=select_autoescape(['html', 'xml'])
-        )
-        template = env.get_template(name)
+        template = get_environment().get_template(name)
         return template.render(**context)
+
+    @classmethod
+    def render_many(cls, names: Iterable[str], contexts: Iterable[dict]) -> List[Dict[str, str]]:
+        """
+        Render every template in `names` for each context, compiling each template once.
+        """
+        templates = {name: get_environment().get_template(name) for name in names}
+        return [
+            {name: template.render(**context) for name, template in templates.items()}
+            for context in contexts
+        ]
+
+
+@dataclass
+class Artifact(object):
+    """
+    A rendered template managed on the server at `remote`,
+    `post_install` commands run as root each time it is installed.
+    """
+    template: Template
+    remote: str
+    mode: Optional[str] = None
+    owner: Optional[str] = None
+    service: Optional[str] = None
+    post_install: List[str] = field(default_factory=list)
+
+    @property
+    def content(self) -> str:
+        return self.template.getvalue()
+
+    @property
+    def checksum(self) -> str:
+        return hashlib.sha256(self.content.encode('utf-8')).hexdigest()
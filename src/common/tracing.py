@@ -0,0 +1,126 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import wraps
+from typing import Dict, List, Optional
+
+import click
+
+STEP = 'step'
+COMMAND = 'command'
+PIPELINE = 'pipeline'
+
+
+@dataclass
+class Span(object):
+    name: str
+    category: str
+    host: Optional[str]
+    start: float
+    end: float = 0.0
+    exit_code: Optional[int] = None
+    args: Dict = field(default_factory=dict)
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+class Tracer(object):
+    """
+    Collects nested spans for pipelines, steps and remote commands.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+
+    @contextmanager
+    def span(self, name: str, category: str, host: Optional[str] = None, **args):
+        if not self.enabled:
+            yield None
+            return
+        span = Span(name=name, category=category, host=host, start=time.perf_counter(), args=args)
+        try:
+            yield span
+        except Exception as exc:
+            if span.exit_code is None:
+                span.exit_code = getattr(getattr(exc, 'result', None), 'exited', 1)
+            raise
+        finally:
+            span.end = time.perf_counter()
+            with self._lock:
+                self.spans.append(span)
+
+    def to_chrome(self) -> dict:
+        """
+        Spans in Chrome trace-event format, one thread row per host.
+        """
+        rows = {}
+        events = []
+        for span in sorted(self.spans, key=lambda item: item.start):
+            row = rows.setdefault(span.host or 'local', len(rows) + 1)
+            args = dict(span.args, host=span.host)
+            if span.exit_code is not None:
+                args['exit_code'] = span.exit_code
+            events.append({
+                'name': span.name,
+                'cat': span.category,
+                'ph': 'X',
+                'ts': round((span.start - self._origin) * 1e6),
+                'dur': round(span.duration * 1e6),
+                'pid': 1,
+                'tid': row,
+                'args': args,
+            })
+        for host, row in rows.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': row, 'args': {'name': host}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def export(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.to_chrome(), f)
+
+    def summary(self, top: int = 10):
+        steps = sorted(
+            (span for span in self.spans if span.category == STEP),
+            key=lambda span: span.duration, reverse=True,
+        )[:top]
+        if not steps:
+            return
+        click.echo(click.style('\n>> Slowest steps', fg='green'))
+        for span in steps:
+            click.echo('{0:>8.2f}s  {1:<32} {2}'.format(span.duration, span.name, span.host or ''))
+
+
+tracer = Tracer()
+
+
+def context_host(args) -> Optional[str]:
+    connection = getattr(args[0], 'connection', None) if args else None
+    return getattr(connection, 'host', None)
+
+
+def traced_step(func, name: str):
+    @wraps(func)
+    def wrapped_function(*args, **kwargs):
+        host = context_host(args) if tracer.enabled else None
+        if host is None:
+            return func(*args, **kwargs)
+        with tracer.span(name, STEP, host=host):
+            return func(*args, **kwargs)
+    return wrapped_function
+
+
+def traced_steps(cls):
+    """
+    Record every static method of `cls` that receives a CommandContext as a step span.
+    """
+    for name, attr in list(vars(cls).items()):
+        if isinstance(attr, staticmethod):
+            setattr(cls, name, staticmethod(traced_step(attr.__func__, '{0}.{1}'.format(cls.__name__, name))))
+    return cls
@@ -0,0 +1,76 @@
+import os
+import shlex
+import tarfile
+from fnmatch import fnmatch
+from typing import Iterator, List
+
+# A leading `/` anchors the pattern to the project root, like in rsync.
+DEFAULT_IGNORE = [
+    '.git', '.env', '.envs', 'env', '*.pyc', '__pycache__', 'node_modules', '*.sqlite3',
+    '/.wise', '/backups', '/media',
+]
+
+
+def is_ignored(path: str, ignore: List[str]) -> bool:
+    parts = path.split(os.sep)
+    return any(
+        fnmatch(path, pattern[1:]) if pattern.startswith('/') else
+        fnmatch(path, pattern) or any(fnmatch(part, pattern) for part in parts)
+        for pattern in ignore
+    )
+
+
+def iter_files(root: str, ignore: List[str]) -> Iterator[str]:
+    """
+    Relative paths of every file under `root` not matched by `ignore`.
+    """
+    for base, dirs, files in os.walk(root):
+        relative_base = os.path.relpath(base, root)
+        relative_base = '' if relative_base == '.' else relative_base
+        dirs[:] = sorted(
+            name for name in dirs if not is_ignored(os.path.join(relative_base, name), ignore)
+        )
+        for name in sorted(files):
+            path = os.path.join(relative_base, name)
+            if not is_ignored(path, ignore):
+                yield path
+
+
+class CountingWriter(object):
+    def __init__(self, target):
+        self.target = target
+        self.bytes = 0
+
+    def write(self, data):
+        self.target.write(data)
+        self.bytes += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def write_tar(root: str, ignore: List[str], fileobj) -> int:
+    """
+    Stream a gzip compressed tar of `root` into `fileobj`, returns the bytes written.
+    """
+    writer = CountingWriter(fileobj)
+    with tarfile.open(fileobj=writer, mode='w|gz') as archive:
+        for path in iter_files(root, ignore):
+            archive.add(os.path.join(root, path), arcname=path, recursive=False)
+    return writer.bytes
+
+
+def private_key(key_filename: str) -> str:
+    key_filename = os.path.expanduser(key_filename)
+    return key_filename[:-len('.pub')] if key_filename.endswith('.pub') else key_filename
+
+
+def rsync_command(source: str, destination: str, ignore: List[str], port: int = 22, key_filename=None) -> str:
+    ssh = 'ssh -p {0}'.format(port)
+    if key_filename:
+        ssh += ' -i {0}'.format(shlex.quote(private_key(key_filename)))
+    excludes = ' '.join('--exclude={0}'.format(shlex.quote(pattern)) for pattern in ignore)
+    return 'rsync -az --delete --stats -e {0} {1} {2}/ {3}'.format(
+        shlex.quote(ssh), excludes, source.rstrip('/'), destination,
+    )
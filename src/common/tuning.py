@@ -0,0 +1,86 @@
+from dataclasses import dataclass
+
+WORKER_MEMORY_MB = 160
+RESERVED_MEMORY_MB = 512
+SYNC_WORKER_CLASS = 'sync'
+
+
+@dataclass
+class HostFacts(object):
+    cores: int = 1
+    memory_mb: int = 1024
+
+    @classmethod
+    def probe(cls, connection) -> 'HostFacts':
+        result = connection.run(
+            "nproc; awk '/MemTotal/ {print int($2 / 1024)}' /proc/meminfo",
+            warn=True, hide='both',
+        )
+        values = [int(value) for value in result.stdout.split() if value.isdigit()]
+        if len(values) != 2:
+            return cls()
+        return cls(cores=values[0], memory_mb=values[1])
+
+
+def gunicorn_settings(facts: HostFacts, overrides: dict = None) -> dict:
+    """
+    Gunicorn settings derived from the host size, `overrides` win over every derived value.
+    """
+    overrides = overrides or {}
+    by_cpu = facts.cores * 2 + 1
+    by_memory = max(1, (facts.memory_mb - RESERVED_MEMORY_MB) // WORKER_MEMORY_MB)
+    worker_class = overrides.get('worker_class', SYNC_WORKER_CLASS)
+    threads = overrides.get('threads', 4 if worker_class == 'gthread' else 1)
+    if threads > 1 and worker_class == SYNC_WORKER_CLASS:
+        worker_class = 'gthread'
+    max_requests = overrides.get('max_requests', 1000)
+
+    settings = {
+        'app': 'config.asgi:application' if 'uvicorn' in worker_class else 'config.wsgi:application',
+        'workers': min(by_cpu, by_memory),
+        'worker_class': worker_class,
+        'threads': threads,
+        # Sharing the loaded app by copy-on-write matters when memory bounds the worker count.
+        'preload': by_memory < by_cpu,
+        'max_requests': max_requests,
+        'max_requests_jitter': max(1, max_requests // 10),
+        'backlog': 2048,
+        'timeout': 30,
+        'worker_tmp_dir': '/dev/shm',
+    }
+    settings.update(overrides)
+    return settings
+
+
+def nginx_settings(facts: HostFacts, overrides: dict = None, worker_class: str = SYNC_WORKER_CLASS) -> dict:
+    """
+    Nginx performance profile derived from the host size, `overrides` win over every derived value.
+
+    Sync gunicorn workers close every connection, upstream keepalive is only
+    enabled for the gunicorn `worker_class`es that keep them open.
+    """
+    settings = {
+        'upstream_keepalive': max(16, facts.cores * 8) if worker_class != SYNC_WORKER_CLASS else 0,
+        'open_file_cache_max': 1000 * facts.cores,
+        'open_file_cache_inactive': '60s',
+        'client_max_body_size': '20M',
+        'client_body_buffer_size': '128k',
+        'proxy_buffering': True,
+        'proxy_buffer_size': '16k',
+        'proxy_buffers': '32 16k',
+        'proxy_busy_buffers_size': '64k',
+        'proxy_temp_file_write_size': '256k',
+        'proxy_connect_timeout': 60,
+        'proxy_send_timeout': 30,
+        'proxy_read_timeout': 3600,
+        # Compression competes with gunicorn for CPU on small hosts.
+        'gzip_comp_level': 4 if facts.cores <= 2 else 6,
+        'gzip_min_length': 256,
+        'gzip_types': [
+            'text/plain', 'text/css', 'text/xml', 'text/javascript', 'application/json',
+            'application/javascript', 'application/x-javascript', 'application/xml',
+            'application/xml+rss', 'image/svg+xml',
+        ],
+    }
+    settings.update(overrides or {})
+    return settings
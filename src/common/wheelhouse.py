@@ -0,0 +1,50 @@
+import glob
+import hashlib
+import os
+import shutil
+import tarfile
+import threading
+
+WHEELHOUSE_CACHE = '.wise/wheelhouse'
+WHEELHOUSE_COMMAND = 'pip wheel -r {requirements} -w {output}'
+REQUIREMENTS = 'requirements/production.txt'
+
+_build_lock = threading.Lock()
+
+
+def requirements_hash(python_version: str, root: str = '.') -> str:
+    """
+    Hash of every requirements file plus the target Python version.
+    """
+    digest = hashlib.sha256(python_version.encode('utf-8'))
+    for path in sorted(glob.glob(os.path.join(root, 'requirements', '*.txt'))):
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def build(requirements_digest: str, command: str = WHEELHOUSE_COMMAND) -> str:
+    """
+    Build the wheelhouse once per requirements hash and return its archive path.
+    """
+    archive = os.path.join(WHEELHOUSE_CACHE, '{0}.tar.gz'.format(requirements_digest))
+    with _build_lock:
+        if not os.path.isfile(archive):
+            _build(requirements_digest, command, archive)
+    return archive
+
+
+def _build(requirements_digest: str, command: str, archive: str):
+    output = os.path.join(WHEELHOUSE_CACHE, requirements_digest)
+    shutil.rmtree(output, ignore_errors=True)
+    os.makedirs(output)
+
+    from invoke import run
+    run(command.format(requirements=REQUIREMENTS, output=output))
+
+    partial = '{0}.part'.format(archive)
+    with tarfile.open(partial, 'w:gz') as f:
+        for name in sorted(os.listdir(output)):
+            f.add(os.path.join(output, name), arcname=name)
+    os.replace(partial, archive)
+    shutil.rmtree(output)
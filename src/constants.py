@@ -2,3 +2,9 @@
 CONFIG_FILE_NAME = 'django.json'
 HOME_BASE_PATH = '/srv'
 SHARED_GROUP = 'workload'
+LETSENCRYPT_PATH = '/opt/letsencrypt'
+LOG_FILES = {
+    'access': 'nginx-access.log',
+    'error': 'nginx-error.log',
+    'app': 'supervisor.log',
+}
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Precompress collected static files for nginx gzip_static / brotli_static.
+
+Keeps a manifest of content hashes in MANIFEST, outside of STATIC_ROOT so
+nginx never serves it, and only (re)writes the .gz / .br siblings of files
+whose content changed.
+
+    compress_static.py STATIC_ROOT MANIFEST
+"""
+import gzip
+import hashlib
+import json
+import os
+import sys
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Where the manifest used to live, inside STATIC_ROOT.
+LEGACY_MANIFEST = '.wise-static.json'
+MIN_SIZE = 256
+EXTENSIONS = ('.css', '.js', '.mjs', '.json', '.map', '.svg', '.txt', '.xml', '.html', '.ico', '.ttf', '.eot', '.otf')
+
+
+def checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_atomic(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def compress(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    write_atomic(path + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        write_atomic(path + '.br', brotli.compress(data, quality=11))
+
+
+def main(root, manifest_path):
+    for suffix in ('', '.gz', '.br'):
+        legacy = os.path.join(root, LEGACY_MANIFEST + suffix)
+        if os.path.exists(legacy):
+            os.remove(legacy)
+
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (IOError, ValueError):
+        manifest = {}
+
+    current, written = {}, 0
+    for base, _, files in os.walk(root):
+        for name in files:
+            path = os.path.join(base, name)
+            relative = os.path.relpath(path, root)
+            if os.path.abspath(path) == os.path.abspath(manifest_path):
+                continue
+            if not name.endswith(EXTENSIONS) or os.path.getsize(path) < MIN_SIZE:
+                continue
+            current[relative] = checksum(path)
+            missing = not os.path.exists(path + '.gz') or (brotli is not None and not os.path.exists(path + '.br'))
+            if manifest.get(relative) != current[relative] or missing:
+                compress(path)
+                written += 1
+
+    for relative in set(manifest) - set(current):
+        for suffix in ('.gz', '.br'):
+            path = os.path.join(root, relative + suffix)
+            if os.path.exists(path):
+                os.remove(path)
+
+    write_atomic(manifest_path, json.dumps(current, sort_keys=True).encode('utf-8'))
+    print('{0} of {1} static files compressed{2}'.format(written, len(current), '' if brotli else ' (gzip only)'))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1], sys.argv[2])
@@ -4,7 +4,7 @@ PROJECT_NAME={{ project_name }}                                 # Application Na
 
 PROJECT_PATH={{ project_path }}                             # Project path
 PROJECT_CODE_PATH={{ project_code_path }}                             # Project path
-PYTHON_ENV=${PROJECT_PATH}/env                              # Virtual environment path
+PYTHON_ENV={{ python_env }}                              # Virtual environment path
 
 SOCKET_PATH=/tmp                                            # Root socket path
 SOCKET_FILE=${SOCKET_PATH}/${PROJECT_NAME}.socket               # Socket file path
@@ -12,14 +12,14 @@ SOCKET_FILE=${SOCKET_PATH}/${PROJECT_NAME}.socket               # Socket file pa
 
 USER={{ project_user }}
 GROUP={{ project_group }}
-NUM_WORKERS=3                                               # workers CPUs*2+1
+NUM_WORKERS={{ workers }}                                   # CPUs*2+1 bounded by memory, see django.json [gunicorn]
 
 
 BIND=unix:$SOCKET_FILE                                      # Socket to binding
 
 echo "Starting $NAME as `whoami`"
 
-source ${PROJECT_PATH}/env/bin/activate
+source ${PYTHON_ENV}/bin/activate
 cd ${PROJECT_CODE_PATH}
 
 export DJANGO_SETTINGS_MODULE=config.settings.production
@@ -31,9 +31,17 @@ test -d ${SOCKET_PATH} || mkdir -p ${SOCKET_PATH}
 
 # Execute django app
 # Los programas que se ejecutaran bajo **supervisor** no deben demonizarse a si mismas (no usar --daemon)
-exec ${PYTHON_ENV}/bin/gunicorn config.wsgi:application \
+exec ${PYTHON_ENV}/bin/gunicorn {{ app }} \
   --name=${PROJECT_NAME} \
   --workers ${NUM_WORKERS} \
+  --worker-class={{ worker_class }} \
+  --threads={{ threads }} \
+  --max-requests={{ max_requests }} \
+  --max-requests-jitter={{ max_requests_jitter }} \
+  --backlog={{ backlog }} \
+  --timeout={{ timeout }} \
+  --worker-tmp-dir={{ worker_tmp_dir }} \{% if preload %}
+  --preload \{% endif %}
   --user=${USER} --group=${GROUP} \
   --bind=${BIND} \
   --log-file=-
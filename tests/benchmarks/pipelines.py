@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Remote commands, bytes and wall time of every pipeline against an in-process
+fake server with injected latency.
+
+    python -m tests.benchmarks.pipelines            # compare with baseline.json
+    python -m tests.benchmarks.pipelines --update   # store a new baseline
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+from contextlib import contextmanager, redirect_stdout
+from dataclasses import asdict, dataclass, replace
+from io import StringIO
+from os.path import abspath, dirname, join
+
+import click
+
+from src.cli import main as cli
+from src.commands.pipelines import Pipeline
+from src.common.ledger import ledger
+from src.common.session import Session
+from tests.fakes import FakeServer
+
+PIPELINES = ['setup_server', 'deploy', 'restart_server', 'clean_server']
+# Measured as well, with their pipeline and config overrides; https is the most expensive setup.
+VARIANTS = {
+    'setup_server_https': ('setup_server', {'https': True}),
+}
+SCENARIOS = PIPELINES + list(VARIANTS)
+LATENCY = 0.005
+BASELINE_FILE = join(dirname(abspath(__file__)), 'baseline.json')
+
+# Wall time is noisy, commands and bytes are not.
+WALL_TOLERANCE = 1.5
+WALL_SLACK = 0.1
+
+PROJECT = {
+    'project': 'bench',
+    'domain': 'bench.example.com',
+    'password': 'secret',
+    'superuser': 'admin',
+    'hosts': ['10.0.0.1'],
+}
+
+
+@dataclass
+class Measurement(object):
+    pipeline: str
+    commands: int
+    bytes: int
+    wall: float
+
+
+@contextmanager
+def project_dir(overrides=None):
+    """
+    Temporary working copy with a config file, an ssh key and a `.env`.
+    """
+    previous = os.getcwd()
+    with tempfile.TemporaryDirectory() as path:
+        key_file = join(path, 'id_rsa')
+        with open(key_file, 'w') as key:
+            key.write('fake key\n')
+        with open(join(path, '.env'), 'w') as env:
+            env.write('DJANGO_SECRET_KEY=bench\n')
+        data = dict(PROJECT, sshkey=key_file, **(overrides or {}))
+        with open(join(path, 'django.json'), 'w') as config_file:
+            json.dump(data, config_file)
+        os.chdir(path)
+        try:
+            yield path
+        finally:
+            os.chdir(previous)
+
+
+@contextmanager
+def strict_budgets():
+    previous, ledger.strict = ledger.strict, True
+    try:
+        yield
+    finally:
+        ledger.strict = previous
+
+
+def measure(pipeline: str, latency: float = LATENCY, overrides=None) -> Measurement:
+    """
+    Run `pipeline` against a fresh FakeServer, pipeline budgets raise `BudgetExceeded`.
+    """
+    server = FakeServer(latency=latency)
+    with project_dir(overrides), strict_budgets(), redirect_stdout(StringIO()):
+        session = Session(connection_factory=server.connect, sudo_pass='secret')
+        with click.Context(cli, obj=session):
+            started = time.monotonic()
+            getattr(Pipeline, pipeline)()
+            wall = time.monotonic() - started
+        session.close()
+    return Measurement(pipeline=pipeline, commands=server.stats.commands, bytes=server.stats.bytes, wall=wall)
+
+
+def measure_scenario(name: str, latency: float = LATENCY) -> Measurement:
+    """
+    `name` is a pipeline or one of VARIANTS, the measurement is stored under that name.
+    """
+    pipeline, overrides = VARIANTS.get(name, (name, None))
+    return replace(measure(pipeline, latency=latency, overrides=overrides), pipeline=name)
+
+
+def load_baseline() -> dict:
+    with open(BASELINE_FILE) as baseline:
+        return json.load(baseline)
+
+
+def main(update=False):
+    measurements = [measure_scenario(name) for name in SCENARIOS]
+    baseline = {} if update else load_baseline()
+
+    print('{0:<20} {1:>9} {2:>10} {3:>9}   {4}'.format('pipeline', 'commands', 'bytes', 'wall', 'baseline'))
+    for item in measurements:
+        expected = baseline.get(item.pipeline)
+        print('{0:<20} {1:>9} {2:>10} {3:>8.3f}s   {4}'.format(
+            item.pipeline, item.commands, item.bytes, item.wall,
+            '{commands} / {bytes} / {wall:.3f}s'.format(**expected) if expected else '-',
+        ))
+
+    if update:
+        with open(BASELINE_FILE, 'w') as baseline_file:
+            json.dump({
+                item.pipeline: dict(asdict(item), wall=round(item.wall, 3)) for item in measurements
+            }, baseline_file, indent=4)
+            baseline_file.write('\n')
+        print('Baseline written to {0}'.format(BASELINE_FILE))
+
+
+if __name__ == '__main__':
+    main(update='--update' in sys.argv[1:])
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+CLI import time from `python -X importtime`, run with `python -m tests.benchmarks.startup`.
+"""
+
+import subprocess
+import sys
+from typing import Dict
+
+MODULE = 'src.cli'
+HEAVY_MODULES = ['fabric', 'paramiko', 'invoke', 'jinja2', 'pkg_resources']
+
+
+def import_times(module: str = MODULE) -> Dict[str, int]:
+    """
+    Cumulative import time in microseconds of every module loaded by `import module`.
+    """
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import {0}'.format(module)],
+        capture_output=True, text=True, check=True,
+    )
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    times = import_times()
+    print('{0:<40} {1:>10}'.format('module', 'ms'))
+    for name, cumulative in sorted(times.items(), key=lambda item: item[1], reverse=True)[:15]:
+        print('{0:<40} {1:>10.1f}'.format(name, cumulative / 1000))
+    loaded = [name for name in HEAVY_MODULES if name in times]
+    print('Heavy modules loaded: {0}'.format(', '.join(loaded) or 'none'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Template render throughput, run with `python -m tests.benchmarks.templates`.
+"""
+
+import timeit
+
+from jinja2 import Environment, PackageLoader, select_autoescape
+
+from src.commands.config import ProjectConfig
+from src.commands.server import Server
+from src.common.template import Template
+from src.common.tuning import HostFacts
+
+NAMES = ['django_nginx.conf', 'start.sh', 'django_supervisor.conf']
+ROUNDS = 200
+
+
+def build_context(index):
+    """
+    Template context of project number `index`, built like `wise install` does for a default host.
+    """
+    name = 'project{0}'.format(index)
+    config = ProjectConfig(
+        project_name=name,
+        password='bench',
+        domain='{0}.example.com'.format(name),
+        ipv4='10.0.0.1',
+        project_user=name,
+        project_group='workload',
+        project_path='/srv/{0}'.format(name),
+    )
+    facts = HostFacts()
+    return {**Server.gunicorn_context(config, facts), **Server.nginx_context(config, facts)}
+
+
+def render_uncached(name, context):
+    env = Environment(
+        loader=PackageLoader('src', 'templates'),
+        autoescape=select_autoescape(['html', 'xml'])
+    )
+    return env.get_template(name).render(**context)
+
+
+def main():
+    contexts = [build_context(index) for index in range(ROUNDS)]
+    renders = ROUNDS * len(NAMES)
+
+    before = timeit.timeit(
+        lambda: [render_uncached(name, context) for context in contexts for name in NAMES], number=1,
+    )
+    after = timeit.timeit(
+        lambda: [Template.render(name, context) for context in contexts for name in NAMES], number=1,
+    )
+    bulk = timeit.timeit(lambda: Template.render_many(NAMES, contexts), number=1)
+
+    print('{0:<22} {1:>12}'.format('mode', 'renders/s'))
+    for label, elapsed in (('new environment', before), ('cached environment', after), ('render_many', bulk)):
+        print('{0:<22} {1:>12.0f}'.format(label, renders / elapsed))
+
+
+if __name__ == '__main__':
+    main()
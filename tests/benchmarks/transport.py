@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Code transport comparison, run with `python -m tests.benchmarks.transport`.
+
+Pushes a generated project with many small files to a local destination
+through git (bare repo + post-receive checkout), a tar stream and rsync,
+then repeats the push after touching a few files.
+"""
+
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+
+from src.commands.project import Project
+from src.common.transport import DEFAULT_IGNORE, write_tar
+
+FILES = 3000
+CHANGED = 10
+
+
+def sh(command, cwd=None):
+    return subprocess.run(command, shell=True, cwd=cwd, check=True, capture_output=True, text=True).stdout
+
+
+def make_project(root):
+    for index in range(FILES):
+        folder = os.path.join(root, 'apps', 'app{0}'.format(index // 100))
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, 'module{0}.py'.format(index)), 'w') as f:
+            f.write('# module {0}\n'.format(index) + 'VALUE = {0}\n'.format(index) * 20)
+    sh('git init -q -b master && git add -A && git -c user.name=b -c user.email=b@b commit -qm init', cwd=root)
+
+
+def touch_project(root, round_):
+    for index in range(CHANGED):
+        path = os.path.join(root, 'apps', 'app{0}'.format(index), 'module{0}.py'.format(index * 100))
+        with open(path, 'a') as f:
+            f.write('CHANGED = {0}\n'.format(round_))
+    sh('git add -A && git -c user.name=b -c user.email=b@b commit -qm change', cwd=root)
+
+
+def push_git(root, target):
+    bare, work = os.path.join(target, 'repo.git'), os.path.join(target, 'code')
+    if not os.path.exists(bare):
+        os.makedirs(work)
+        sh('git init -q --bare {0}'.format(bare))
+    output = subprocess.run(
+        'git push --progress {0} master'.format(bare), shell=True, cwd=root, capture_output=True, text=True,
+    ).stderr
+    sh('GIT_WORK_TREE={0} git --git-dir={1} checkout -q -f master'.format(work, bare))
+    sent = re.findall(r'Writing objects: .*?, ([\d.]+) (KiB|MiB|bytes)', output)
+    if not sent:
+        return 0
+    value, unit = sent[-1]
+    return int(float(value) * {'bytes': 1, 'KiB': 1024, 'MiB': 1024 ** 2}[unit])
+
+
+def push_tar(root, target):
+    os.makedirs(target, exist_ok=True)
+    process = subprocess.Popen(['bash', '-c', Project.tar_command(os.path.join(target, 'code'))], stdin=subprocess.PIPE)
+    sent = write_tar(root, DEFAULT_IGNORE, process.stdin)
+    process.stdin.close()
+    process.wait()
+    return sent
+
+
+def push_rsync(root, target):
+    code = os.path.join(target, 'code')
+    excludes = ' '.join('--exclude={0!r}'.format(pattern) for pattern in DEFAULT_IGNORE)
+    output = sh('rsync -az --delete --stats {0} {1}/ {2}/'.format(excludes, root, code))
+    return int(re.search(r'Total bytes sent: ([\d,.]+)', output).group(1).replace(',', '').replace('.', ''))
+
+
+def measure(push, root, target):
+    started = time.monotonic()
+    sent = push(root, target)
+    return sent, time.monotonic() - started
+
+
+def main():
+    workspace = tempfile.mkdtemp(prefix='wise-transport-')
+    try:
+        root = os.path.join(workspace, 'project')
+        make_project(root)
+        transports = [('git', push_git), ('tar', push_tar)]
+        if shutil.which('rsync'):
+            transports.append(('rsync', push_rsync))
+
+        print('{0:<8} {1:<12} {2:>12} {3:>9}'.format('mode', 'push', 'bytes sent', 'seconds'))
+        for round_, label in enumerate(['initial', 'repeat']):
+            if round_:
+                touch_project(root, round_)
+            for name, push in transports:
+                sent, elapsed = measure(push, root, os.path.join(workspace, name))
+                print('{0:<8} {1:<12} {2:>12} {3:>9.2f}'.format(name, label, sent, elapsed))
+    finally:
+        shutil.rmtree(workspace)
+
+
+if __name__ == '__main__':
+    main()
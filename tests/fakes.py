@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+In-process stand-in for an SSH server.
+
+`FakeServer.connect` has the signature of `build_connection`, so it can be
+handed to `Session(connection_factory=...)`. Every remote call sleeps for
+the configured latency, answers from a small rule table that mimics a fresh
+Ubuntu host and is counted in `FakeServer.stats`.
+"""
+
+import io
+import re
+import subprocess
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from invoke import Result, UnexpectedExit
+
+from src.commands.server import APT_LISTS_MARKER
+from src.common.batch import MARKER
+from src.common.connection import InstrumentedConnection
+from src.common.ledger import payload_size
+
+BATCH_PATTERN = re.compile(r'{0} (\d+) \$rc'.format(MARKER))
+
+# (pattern, stdout, exited), first match wins.
+FRESH_HOST = [
+    (r'^lsb_release', 'focal\n', 0),
+    (r'^nproc', '2\n4096\n', 0),
+    (r'^dpkg-query', '{0} 999999\n'.format(APT_LISTS_MARKER), 0),
+    (r'^id -u', '', 1),
+    (r'^test -d', '', 1),
+]
+
+
+@dataclass
+class FakeStats(object):
+    commands: int = 0
+    bytes_sent: int = 0
+    bytes_received: int = 0
+    local: List[str] = field(default_factory=list)
+
+    @property
+    def bytes(self) -> int:
+        return self.bytes_sent + self.bytes_received
+
+
+class FakeChannel(object):
+
+    def __init__(self, server: 'FakeServer'):
+        self.server = server
+        self.stdout = io.BytesIO()
+        self.exit_status = 0
+
+    def exec_command(self, command):
+        stdout, self.exit_status = self.server.remote_call(command)
+        self.stdout = io.BytesIO(stdout.encode('utf-8'))
+
+    def get_pty(self):
+        pass
+
+    def sendall(self, data):
+        self.server.count(sent=len(data))
+
+    def shutdown_write(self):
+        pass
+
+    def recv(self, size):
+        return self.stdout.read(size)
+
+    def exit_status_ready(self):
+        return True
+
+    def recv_exit_status(self):
+        return self.exit_status
+
+    def makefile_stderr(self, mode='rb'):
+        return io.BytesIO(b'')
+
+    def close(self):
+        pass
+
+
+class FakeTransport(object):
+
+    def __init__(self, server: 'FakeServer'):
+        self.server = server
+        self.active = True
+
+    def open_session(self):
+        return FakeChannel(self.server)
+
+
+class FakeConnection(InstrumentedConnection):
+    """
+    Connection whose run/sudo/put/get never leave the process.
+    """
+
+    def __init__(self, server: 'FakeServer', host: str, user: Optional[str] = None):
+        super().__init__(host=host, user=user)
+        self.server = server
+        self.transport = FakeTransport(server)
+        self._connected = False
+
+    @property
+    def is_connected(self):
+        return self._connected
+
+    def open(self):
+        self._connected = True
+
+    def close(self):
+        self._connected = False
+
+    def respond(self, command: str, warn: bool = False) -> Result:
+        self._connected = True
+        stdout, exited = self.server.remote_call(command)
+        stderr = ''
+        markers = BATCH_PATTERN.findall(command)
+        if markers:
+            stderr = ''.join('{0} {1} 0\n'.format(MARKER, index) for index in markers)
+        result = Result(stdout=stdout, stderr=stderr, command=command, exited=exited, hide=('stdout', 'stderr'))
+        if exited != 0 and not warn:
+            raise UnexpectedExit(result)
+        return result
+
+    def run(self, command, **kwargs):
+        return self.instrument('run', command, self.respond, command, warn=kwargs.get('warn', False))
+
+    def sudo(self, command, **kwargs):
+        return self.instrument('sudo', command, self.respond, command, warn=kwargs.get('warn', False))
+
+    def local(self, *args, **kwargs):
+        command = args[0] if args else kwargs.get('command', '')
+        return self.instrument('local', command, self.server.local_call, command)
+
+    def put(self, local, remote=None, **kwargs):
+        size = payload_size(local)
+        return self.instrument('put', 'put {0}'.format(remote), self.server.transfer, size, bytes_out=size)
+
+    def get(self, remote, local=None, **kwargs):
+        return self.instrument('get', 'get {0}'.format(remote), self.server.remote_call, 'get {0}'.format(remote))
+
+
+class FakeServer(object):
+    """
+    Shared state of every FakeConnection created for one run.
+    """
+
+    def __init__(self, latency: float = 0.0, responses: List[Tuple[str, str, int]] = None):
+        self.latency = latency
+        self.responses = list(responses or []) + FRESH_HOST
+        self.stats = FakeStats()
+        self._lock = threading.Lock()
+
+    def connect(self, config, host, allow_sudo=False, sudo_pass=None, stream=None, compress=False) -> FakeConnection:
+        user = config.superuser if allow_sudo else config.project_user
+        return FakeConnection(self, host=host, user=user)
+
+    def count(self, sent: int = 0, received: int = 0, commands: int = 0):
+        with self._lock:
+            self.stats.commands += commands
+            self.stats.bytes_sent += sent
+            self.stats.bytes_received += received
+
+    def local_call(self, command: str) -> Result:
+        self.stats.local.append(command)
+        return Result(command=command, exited=0)
+
+    def transfer(self, size: int):
+        time.sleep(self.latency)
+        self.count(sent=size, commands=1)
+
+    def remote_call(self, command: str) -> Tuple[str, int]:
+        time.sleep(self.latency)
+        stdout, exited = '', 0
+        for pattern, output, code in self.responses:
+            if re.search(pattern, command):
+                stdout, exited = output, code
+                break
+        self.count(sent=len(command.encode('utf-8')), received=len(stdout.encode('utf-8')), commands=1)
+        return stdout, exited
+
+
+class LocalConnection(object):
+    """
+    Runs every command with the local bash and records it in `calls`, `put` writes to the local `remote` path.
+    """
+
+    def __init__(self, host: str = 'localhost'):
+        self.host = host
+        self.calls: List[Tuple[str, str]] = []
+
+    def execute(self, method: str, command: str, warn: bool = False) -> Result:
+        self.calls.append((method, command))
+        process = subprocess.run(['bash', '-c', command], capture_output=True, text=True)
+        result = Result(
+            stdout=process.stdout, stderr=process.stderr, command=command, exited=process.returncode,
+            hide=('stdout', 'stderr'),
+        )
+        if result.failed and not warn:
+            raise UnexpectedExit(result)
+        return result
+
+    def run(self, command, warn=False, **kwargs):
+        return self.execute('run', command, warn=warn)
+
+    def sudo(self, command, warn=False, **kwargs):
+        return self.execute('sudo', command, warn=warn)
+
+    def put(self, local, remote=None, **kwargs):
+        self.calls.append(('put', remote))
+        with open(remote, 'wb') as f:
+            f.write(local.getvalue())
@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+
+from tests.benchmarks.startup import HEAVY_MODULES, MODULE, import_times
+
+# Generous for slow CI machines, the eager imports cost ~400 ms.
+IMPORT_BUDGET_US = 200 * 1000
+
+
+def test_cli_import_is_lazy():
+    times = import_times()
+
+    assert [name for name in HEAVY_MODULES if name in times] == []
+    assert times[MODULE] < IMPORT_BUDGET_US
@@ -1 +1,29 @@
 # -*- coding: utf-8 -*-
+
+from src.common import session as session_module
+from src.common.session import Session
+from tests.benchmarks.pipelines import project_dir
+from tests.fakes import FakeServer
+
+
+def test_session_reuses_config_password_and_connections(monkeypatch):
+    server = FakeServer()
+    built, prompts = [], []
+
+    def connect(config, host, **kwargs):
+        built.append((host, kwargs['allow_sudo']))
+        return server.connect(config, host, **kwargs)
+
+    monkeypatch.setattr(session_module, 'getpass', lambda prompt: prompts.append(prompt) or 'secret')
+    with project_dir({'hosts': ['10.0.0.1', '10.0.0.2']}):
+        session = Session(connection_factory=connect)
+        config = session.config
+
+        for _ in range(2):
+            for host in config.hosts:
+                assert session.connection(host, allow_sudo=True) is session.connection(host, allow_sudo=True)
+                session.connection(host)
+
+        assert session.config is config
+    assert len(prompts) == 1
+    assert sorted(built) == [('10.0.0.1', False), ('10.0.0.1', True), ('10.0.0.2', False), ('10.0.0.2', True)]
@@ -1 +1,36 @@
 # -*- coding: utf-8 -*-
+
+import pytest
+
+from src.commands.config import ProjectConfig
+from src.common.context import CommandContext
+from src.common.ledger import BudgetExceeded, budget
+from tests.benchmarks.pipelines import (
+    SCENARIOS, WALL_SLACK, WALL_TOLERANCE, load_baseline, measure_scenario, strict_budgets,
+)
+from tests.fakes import FakeServer
+
+CONFIG = ProjectConfig(project_name='bench', password='secret', domain='bench.example.com', ipv4='10.0.0.1')
+
+
+@pytest.mark.parametrize('scenario', SCENARIOS)
+def test_pipeline_within_baseline(scenario):
+    expected = load_baseline()[scenario]
+    measurement = measure_scenario(scenario)
+
+    assert measurement.commands <= expected['commands']
+    assert measurement.bytes <= expected['bytes']
+    assert measurement.wall <= expected['wall'] * WALL_TOLERANCE + WALL_SLACK
+
+
+def test_budget_overrun_fails_in_strict_mode():
+    server = FakeServer()
+    context = CommandContext(connection=server.connect(CONFIG, '10.0.0.1'), config=CONFIG)
+
+    @budget(commands=1)
+    def chatty(context):
+        context.connection.run('true')
+        context.connection.run('true')
+
+    with strict_budgets(), pytest.raises(BudgetExceeded):
+        chatty(context)
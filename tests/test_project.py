@@ -1 +1,201 @@
 # -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import subprocess
+
+import pytest
+
+from src.commands.backup import CHECKSUMS_NAME, MANIFEST_NAME, Backup, Restore
+from src.commands.config import ProjectConfig
+from src.commands.enums import Transport
+from src.commands.media import BATCH_FILES, Media
+from src.commands.project import Project
+from src.common import wheelhouse
+from src.common.context import CommandContext
+from src.common.ledger import ledger
+from src.common.transport import DEFAULT_IGNORE, write_tar
+from src.templates import compress_static
+from tests.fakes import FakeServer, LocalConnection
+
+CONFIG = ProjectConfig(project_name='bench', password='secret', domain='bench.example.com', ipv4='10.0.0.1')
+
+
+def test_backup_streams_parts_and_resumes(tmp_path):
+    server = FakeServer(responses=[(r'pg_dump', 'dump', 0), (r'tar -czf', 'media', 0)])
+    context = CommandContext(connection=server.connect(CONFIG, '10.0.0.1', allow_sudo=True), config=CONFIG)
+    output = str(tmp_path / 'backup')
+
+    Backup.run(context, output=output)
+
+    with open(os.path.join(output, MANIFEST_NAME)) as f:
+        parts = json.load(f)['parts']
+    assert parts['db']['sha256'] == hashlib.sha256(b'dump').hexdigest()
+    assert parts['media']['bytes'] == len('media')
+    with open(os.path.join(output, CHECKSUMS_NAME)) as f:
+        assert sorted(line.split()[1] for line in f) == ['db.dump', 'media.tar.gz']
+
+    os.remove(os.path.join(output, 'media.tar.gz'))
+    commands = server.stats.commands
+    Backup.run(context, output=output)
+
+    assert server.stats.commands == commands + 1
+    assert os.path.isfile(os.path.join(output, 'media.tar.gz'))
+
+
+def test_restore_runs_sections_with_one_job_per_core(tmp_path):
+    server = FakeServer(responses=[(r'pg_dump', 'dump', 0)])
+    context = CommandContext(connection=server.connect(CONFIG, '10.0.0.1', allow_sudo=True), config=CONFIG)
+    output = str(tmp_path / 'backup')
+    Backup.run(context, output=output, media=False)
+
+    mark = ledger.mark()
+    Restore.run(context, output)
+
+    restores = [entry.command for entry in ledger.since(mark) if 'pg_restore' in entry.command]
+    assert [command.split()[1] for command in restores] == [
+        '--section=pre-data', '--section=data', '--section=post-data',
+    ]
+    assert all('--jobs=2' in command for command in restores)
+    commands = [entry.command for entry in ledger.since(mark)]
+    stop = commands.index('supervisorctl stop bench')
+    drop = next(index for index, command in enumerate(commands) if 'DROP DATABASE IF EXISTS' in command)
+    assert stop < drop
+    assert 'pg_terminate_backend' in commands[drop]
+    assert 'rm -rf /tmp/wise-restore-' in commands[-1] and 'supervisorctl start bench' in commands[-1]
+
+
+@pytest.mark.parametrize('transport, local', [
+    (Transport.GIT, 'git push production master'),
+    (Transport.RSYNC, 'rsync -az --delete'),
+    (Transport.TAR, None),
+])
+def test_push_uses_the_configured_transport(tmp_path, monkeypatch, transport, local):
+    (tmp_path / 'manage.py').write_text('# manage\n')
+    monkeypatch.chdir(tmp_path)
+    config = ProjectConfig(
+        project_name='bench', password='secret', domain='bench.example.com', ipv4='10.0.0.1',
+        project_path='/srv/bench', transport=transport,
+    )
+    server = FakeServer()
+
+    Project.push(CommandContext(connection=server.connect(config, '10.0.0.1'), config=config))
+
+    if local is None:
+        assert server.stats.local == [] and server.stats.bytes_sent > 0
+    else:
+        assert [command.startswith(local) for command in server.stats.local] == [True]
+
+
+def test_push_tar_replaces_code_and_keeps_the_env_file(tmp_path):
+    tree, code = tmp_path / 'tree', tmp_path / 'bench' / 'code'
+    (tree / 'app').mkdir(parents=True)
+    (tree / 'app' / 'views.py').write_text('VIEWS = 2\n')
+    (tree / '.env').write_text('LOCAL=1\n')
+    (code / 'app').mkdir(parents=True)
+    (code / 'app' / 'views.py').write_text('VIEWS = 1\n')
+    (code / 'app' / 'removed.py').write_text('REMOVED = 1\n')
+    (code / '.env').write_text('SERVER=1\n')
+    process = subprocess.Popen(['bash', '-c', Project.tar_command(str(code))], stdin=subprocess.PIPE)
+    write_tar(str(tree), DEFAULT_IGNORE, process.stdin)
+    process.stdin.close()
+
+    assert process.wait() == 0
+    assert sorted(os.listdir(str(code / 'app'))) == ['views.py']
+    assert (code / 'app' / 'views.py').read_text() == 'VIEWS = 2\n'
+    assert (code / '.env').read_text() == 'SERVER=1\n'
+    assert os.listdir(str(tmp_path / 'bench')) == ['code']
+
+
+def release_config(path, **kwargs):
+    return ProjectConfig(
+        project_name='bench', password='secret', domain='bench.example.com', ipv4='10.0.0.1',
+        project_path=str(path), releases=True, **kwargs
+    )
+
+
+def test_install_release_swaps_current_atomically(tmp_path):
+    config = release_config(tmp_path)
+    server = FakeServer(responses=[(r'sha256sum', 'abc123\n', 0)])
+    context = CommandContext(connection=server.connect(config, '10.0.0.1'), config=config)
+    mark = ledger.mark()
+
+    Project.install_release(context)
+
+    swap = next(entry.command for entry in ledger.since(mark) if 'current.tmp' in entry.command)
+    release = swap.split()[2]
+    (tmp_path / 'releases' / 'old').mkdir(parents=True)
+    (tmp_path / 'current').symlink_to(tmp_path / 'releases' / 'old')
+    os.makedirs(release)
+    subprocess.run(['bash', '-c', swap], check=True)
+
+    assert os.readlink(str(tmp_path / 'current')) == release
+    assert not (tmp_path / 'current.tmp').exists()
+
+
+def test_prune_releases_keeps_the_newest_and_their_virtualenvs_and_wheelhouses(tmp_path):
+    for venv in ('old', 'used'):
+        (tmp_path / 'venvs' / venv).mkdir(parents=True)
+    for house in ('old', 'used', 'used.tmp'):
+        (tmp_path / 'wheelhouse' / house).mkdir(parents=True)
+    for index, venv in enumerate(['old', 'old', 'used', 'used']):
+        release = tmp_path / 'releases' / '2024010{0}000000'.format(index)
+        release.mkdir(parents=True)
+        (release / 'env').symlink_to(tmp_path / 'venvs' / venv)
+        (release / '.wheelhouse').write_text('{0}\n'.format(venv))
+    config = release_config(tmp_path, keep_releases=2)
+
+    Project.prune_releases(CommandContext(connection=LocalConnection(), config=config))
+
+    assert sorted(os.listdir(str(tmp_path / 'releases'))) == ['20240102000000', '20240103000000']
+    assert os.listdir(str(tmp_path / 'venvs')) == ['used']
+    assert os.listdir(str(tmp_path / 'wheelhouse')) == ['used']
+
+
+def test_wheelhouse_installs_offline_from_the_requirements_hash(tmp_path, monkeypatch):
+    (tmp_path / 'requirements').mkdir()
+    (tmp_path / 'requirements' / 'production.txt').write_text('Django==3.2\n')
+    monkeypatch.chdir(tmp_path)
+    config = release_config('/srv/bench', wheelhouse=True, wheelhouse_python='3.8')
+    digest = wheelhouse.requirements_hash('3.8')
+
+    assert Project.pip_options(config) == '--no-index --find-links /srv/bench/wheelhouse/{0} '.format(digest)
+
+    (tmp_path / 'requirements' / 'production.txt').write_text('Django==4.2\n')
+    assert wheelhouse.requirements_hash('3.8') != digest
+    assert wheelhouse.requirements_hash('3.9') != wheelhouse.requirements_hash('3.8')
+
+
+def test_media_scan_reuses_hashes_and_batches_changes(tmp_path, monkeypatch):
+    root = tmp_path / 'media'
+    (root / 'photos').mkdir(parents=True)
+    for index in range(BATCH_FILES + 1):
+        (root / 'photos' / '{0}.jpg'.format(index)).write_bytes(b'x' * index)
+    first = Media.scan(str(root))
+
+    (root / 'photos' / '1.jpg').write_bytes(b'changed')
+    hashed = []
+    monkeypatch.setattr(Media, 'hash_file', staticmethod(lambda path: hashed.append(path) or 'new'))
+    second = Media.scan(str(root))
+
+    assert hashed == [str(root / 'photos' / '1.jpg')]
+    assert Media.changes(second, first) == ['photos/1.jpg']
+    assert [len(batch) for batch in Media.batches(sorted(first), first)] == [BATCH_FILES, 1]
+
+
+def test_compress_static_keeps_its_manifest_out_of_static_root(tmp_path, capsys):
+    root, manifest = tmp_path / 'static', tmp_path / 'etc' / 'static.json'
+    root.mkdir()
+    manifest.parent.mkdir()
+    (root / 'app.json').write_text('{"key": "value"}' * 32)
+    (root / '.wise-static.json').write_text('{"app.json": "stale"}' * 32)
+
+    compress_static.main(str(root), str(manifest))
+    compress_static.main(str(root), str(manifest))
+
+    assert sorted(path.name for path in root.iterdir()) == ['app.json', 'app.json.gz'] + (
+        ['app.json.br'] if compress_static.brotli else []
+    )
+    assert list(json.loads(manifest.read_text())) == ['app.json']
+    assert capsys.readouterr().out.splitlines()[-1].startswith('0 of 1 ')
@@ -1 +1,236 @@
 # -*- coding: utf-8 -*-
+
+import gzip
+import os
+import subprocess
+import time
+
+import pytest
+
+from src.commands.analyze import Analytics
+from src.commands.balancer import Balancer
+from src.commands.config import ProjectConfig
+from src.commands.logs import Logs
+from src.commands.server import APT_LISTS_MARKER, Server
+from src.common.context import CommandContext
+from src.common.ledger import ledger
+from src.common.plan import CREATE, Plan
+from src.common.template import Template
+from src.common.tuning import HostFacts
+from tests.benchmarks.templates import NAMES, build_context
+from tests.fakes import FakeServer
+
+CONFIG = ProjectConfig(project_name='bench', password='secret', domain='bench.example.com', ipv4='10.0.0.1')
+
+
+@pytest.mark.parametrize('name', NAMES + ['django_nginx_ssl.conf'])
+def test_templates_render_with_the_pipeline_context(name):
+    assert Template.render(name, build_context(0))
+
+
+def test_nginx_proxy_temp_file_write_size_has_its_own_setting():
+    content = Template.render('django_nginx.conf', build_context(0))
+
+    assert 'proxy_busy_buffers_size 64k;' in content
+    assert 'proxy_temp_file_write_size 256k;' in content
+
+
+@pytest.mark.parametrize('gunicorn, keepalive', [({}, False), ({'threads': 4}, True)])
+def test_nginx_upstream_keepalive_follows_the_gunicorn_worker(gunicorn, keepalive):
+    config = ProjectConfig(
+        project_name='bench', password='secret', domain='bench.example.com', ipv4='10.0.0.1',
+        project_path='/srv/bench', gunicorn=gunicorn,
+    )
+    content = Template.render('django_nginx.conf', Server.nginx_context(config, HostFacts(cores=2)))
+
+    assert ('keepalive 16;' in content) is keepalive
+    assert ('proxy_http_version 1.1;' in content) is keepalive
+
+
+class RecordingBatch(object):
+
+    def __init__(self):
+        self.commands = []
+
+    def sudo(self, command, **kwargs):
+        self.commands.append(command)
+
+
+@pytest.mark.parametrize('start, action', [('gunicorn --preload', 'restart'), ('gunicorn', 'signal HUP')])
+def test_reload_restarts_preloaded_apps_and_hups_the_others(tmp_path, start, action):
+    (tmp_path / 'bin').mkdir()
+    (tmp_path / 'bin' / 'start.sh').write_text('exec {0} config.wsgi\n'.format(start))
+    supervisorctl = tmp_path / 'supervisorctl'
+    supervisorctl.write_text('#!/bin/sh\necho "$@"\n')
+    supervisorctl.chmod(0o755)
+    config = ProjectConfig(
+        project_name='bench', password='secret', domain='bench.example.com', ipv4='10.0.0.1',
+        project_path=str(tmp_path),
+    )
+    batch = RecordingBatch()
+    Server.reload_services(CommandContext(connection=None, config=config).fork(batch=batch))
+    reload = next(command for command in batch.commands if 'start.sh' in command)
+
+    result = subprocess.run(
+        ['bash', '-c', reload], capture_output=True, text=True,
+        env=dict(os.environ, PATH='{0}:{1}'.format(tmp_path, os.environ['PATH'])),
+    )
+
+    assert result.stdout == '{0} bench\n'.format(action)
+
+    batch = RecordingBatch()
+    Server.reload_services(CommandContext(connection=None, config=config).fork(batch=batch), {'gunicorn'})
+
+    assert 'supervisorctl restart bench' in batch.commands
+
+
+def test_balancer_install_updates_stale_apt_lists_first():
+    server = FakeServer(responses=[(r'^haproxy -v', 'HAProxy version 2.4.22\n', 0)])
+    context = CommandContext(connection=server.connect(CONFIG, '10.0.0.5', allow_sudo=True), config=CONFIG)
+    mark = ledger.mark()
+
+    Balancer.install(context)
+
+    apt = [entry.command for entry in ledger.since(mark) if entry.command.startswith('apt-get')]
+    assert apt == ['apt-get update', 'apt-get install -y --no-upgrade haproxy socat']
+
+
+@pytest.mark.parametrize('answer, ok', [('Server deleted.', True), ('No such server.', False)])
+def test_balancer_runtime_fails_on_unexpected_replies(tmp_path, answer, ok):
+    socat = tmp_path / 'socat'
+    socat.write_text('#!/bin/sh\ncat > /dev/null\nprintf "{0}\\n\\n"\n'.format(answer))
+    socat.chmod(0o755)
+    batch = RecordingBatch()
+    Balancer.runtime(batch, 'del server bench_cluster/node-10-0-0-2', reply='Server deleted.')
+
+    result = subprocess.run(
+        ['bash', '-c', batch.commands[0]], capture_output=True, text=True,
+        env=dict(os.environ, PATH='{0}:{1}'.format(tmp_path, os.environ['PATH'])),
+    )
+
+    assert (result.returncode == 0) is ok
+    assert ok or 'No such server.' in result.stderr
+
+
+def test_deps_installs_only_packages_dpkg_does_not_report_installed():
+    packages = Server.packages(CONFIG, 'focal')
+    statuses = ['{0}:amd64 install ok installed'.format(package) for package in packages if package != 'nginx']
+    statuses[0] = '{0} deinstall ok config-files'.format(packages[0])
+    dpkg = '\n'.join(statuses + ['{0} 60'.format(APT_LISTS_MARKER)]) + '\n'
+    server = FakeServer(responses=[(r'^dpkg-query', dpkg, 0)])
+    context = CommandContext(connection=server.connect(CONFIG, '10.0.0.1', allow_sudo=True), config=CONFIG)
+    mark = ledger.mark()
+
+    Server.deps(context)
+
+    apt = [entry.command for entry in ledger.since(mark) if entry.command.startswith('apt-get')]
+    assert apt == ['apt-get install -y --no-upgrade {0} nginx'.format(packages[0]), 'apt-get autoremove -y']
+
+
+ACCESS_LINE = (
+    '10.0.0.9 - - [01/May/2024:{0} +0000] "GET /api/users/{1}/ HTTP/1.1" {2} 12 "-" "curl" '
+    'rt={3} urt="{3}"'
+)
+
+
+def test_logs_filter_by_time_status_and_pattern(tmp_path):
+    (tmp_path / 'log').mkdir()
+    (tmp_path / 'log' / 'nginx-access.log').write_text('\n'.join([
+        ACCESS_LINE.format('09:59:59', 1, 500, '0.100'),
+        ACCESS_LINE.format('10:00:01', 2, 200, '0.010'),
+        ACCESS_LINE.format('10:00:02', 3, 502, '0.200'),
+    ]) + '\n')
+    (tmp_path / 'log' / 'supervisor.log').write_text(
+        '[2024-05-01 10:00:03 +0000] [7] [ERROR] Error handling request\nTraceback (most recent call last):\n'
+    )
+    config = ProjectConfig(
+        project_name='bench', password='secret', domain='bench.example.com', ipv4='10.0.0.1',
+        project_path=str(tmp_path),
+    )
+
+    def run(files, **filters):
+        command = Logs.command(config, files, '+1', False, **filters)
+        return subprocess.run(['bash', '-c', command], capture_output=True, text=True, check=True).stdout
+
+    errors = run(['access'], status=Logs.status_pattern('5xx'), since=Logs.stamp('2024-05-01 10:00'))
+    assert [line.split('\t')[:2] for line in errors.splitlines()] == [['20240501100002', 'access']]
+    assert '/api/users/3/' in errors
+
+    tracebacks = run(['access', 'app'], pattern='Traceback')
+    assert tracebacks == '20240501100003\tapp\tTraceback (most recent call last):\n'
+
+
+def test_analyze_reads_rotated_logs_inside_the_window(tmp_path):
+    log = tmp_path / 'log'
+    log.mkdir()
+    (log / 'nginx-access.log').write_text(ACCESS_LINE.format('12:00:00', 1, 200, '0.010') + '\n')
+    (log / 'nginx-access.log.1').write_text(ACCESS_LINE.format('11:00:00', 2, 200, '0.010') + '\n')
+    for name, moment in (('nginx-access.log.2.gz', '10:00:00'), ('nginx-access.log.3.gz', '10:30:00')):
+        with gzip.open(str(log / name), 'wt') as f:
+            f.write(ACCESS_LINE.format(moment, 3, 200, '0.010') + '\n')
+    # Last written before the window, its lines are not even read.
+    stale = time.mktime((2024, 5, 1, 9, 0, 0, 0, 0, -1))
+    os.utime(str(log / 'nginx-access.log.3.gz'), (stale, stale))
+    config = ProjectConfig(
+        project_name='bench', password='secret', domain='bench.example.com', ipv4='10.0.0.1',
+        project_path=str(tmp_path),
+    )
+    command = Logs.command(config, ['access'], '+1', False, since='20240501093000', rotated=True)
+
+    output = subprocess.run(['bash', '-c', command], capture_output=True, text=True, check=True).stdout
+
+    assert [line.split('\t')[0] for line in output.splitlines()] == [
+        '20240501100000', '20240501110000', '20240501120000',
+    ]
+
+
+@pytest.mark.parametrize('method, path, route', [
+    ('GET', '/api/users/42/?page=2', 'GET /api/users/:id/'),
+    ('PUT', '/orders/3f2504e0-4f89-11d3-9a0c-0305e82c3301/items/7', 'PUT /orders/:id/items/:id'),
+    ('GET', '/objects/507f1f77bcf86cd799439011', 'GET /objects/:id'),
+    ('GET', '/v2/health', 'GET /v2/health'),
+])
+def test_analyze_normalises_ids_in_routes(method, path, route):
+    assert Analytics.route(method, path) == route
+
+
+class RecordingServer(FakeServer):
+
+    def __init__(self, responses):
+        super().__init__(responses=responses)
+        self.commands = []
+
+    def remote_call(self, command):
+        self.commands.append(command)
+        return super().remote_call(command)
+
+
+def test_relative_times_count_back_from_each_server_clock():
+    servers = {
+        '10.0.0.1': RecordingServer([(r'^date ', '20240501120000\n', 0)]),
+        '10.0.0.2': RecordingServer([(r'^date ', '20240501150000\n', 0)]),
+    }
+    contexts = [
+        CommandContext(connection=server.connect(CONFIG, host), config=CONFIG) for host, server in servers.items()
+    ]
+
+    Logs.tail(contexts, ['access'], since='1h')
+
+    assert 'WISE_SINCE=20240501110000 ' in servers['10.0.0.1'].commands[-1]
+    assert 'WISE_SINCE=20240501140000 ' in servers['10.0.0.2'].commands[-1]
+
+
+def test_apply_enables_a_created_nginx_site():
+    server = FakeServer()
+    context = CommandContext(connection=server.connect(CONFIG, '10.0.0.1', allow_sudo=True), config=CONFIG)
+    site = Server.nginx_artifact(context)
+    plan = Plan.build(context.connection, [site])
+    mark = ledger.mark()
+
+    plan.apply(context)
+
+    assert [entry.action for entry in plan.entries] == [CREATE]
+    script = ledger.since(mark)[-1].command
+    install = script.index('/tmp/wise-bundle-')
+    assert install < script.index('rm -f /etc/nginx/sites-enabled/default')
+    assert install < script.index('ln -sfn {0} /etc/nginx/sites-enabled/bench.conf'.format(site.remote))
@@ -1 +1,248 @@
 # -*- coding: utf-8 -*-
+
+import io
+import json
+import os
+import stat
+import tarfile
+import threading
+
+import click
+import pytest
+from invoke import Result, UnexpectedExit
+
+from src.commands.config import ProjectConfig
+from src.common.batch import CommandBatch
+from src.common.bundle import INSTALL_NAME, MANIFEST_NAME, Bundle
+from src.common.context import CommandContext
+from src.common.fanout import HostStream, fan_out
+from src.common.plan import CREATE, UNCHANGED, UPDATE, Plan
+from src.common.scheduler import Scheduler
+from src.common.sketch import QuantileSketch
+from src.common.template import Artifact
+from src.common.tracing import COMMAND, STEP, Tracer
+from src.common.transport import DEFAULT_IGNORE, iter_files, rsync_command
+from tests.fakes import FakeServer, LocalConnection
+
+CONFIG = ProjectConfig(project_name='bench', password='secret', domain='bench.example.com', ipv4='10.0.0.1')
+
+
+class FakeContext(object):
+
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def fork(self, batch=None):
+        return self
+
+
+def record(name):
+    def step(context):
+        with context.lock:
+            context.calls.append(name)
+    step.__qualname__ = name
+    return step
+
+
+def test_fan_out_prefixes_output_and_collects_errors_per_host():
+    output = io.StringIO()
+
+    def job(host, fail):
+        def run():
+            click.echo('deploying {0}'.format(host))
+            if fail:
+                raise RuntimeError('{0} is down'.format(host))
+        return host, HostStream(host, target=output), run
+
+    results = fan_out([job('10.0.0.1', False), job('10.0.0.2', True)], concurrency=2)
+
+    assert [(result.host, result.ok, result.error) for result in results] == [
+        ('10.0.0.1', True, None), ('10.0.0.2', False, '10.0.0.2 is down'),
+    ]
+    lines = output.getvalue().splitlines()
+    assert sorted(lines) == [
+        '[10.0.0.1] deploying 10.0.0.1', '[10.0.0.2] -> 10.0.0.2 is down', '[10.0.0.2] deploying 10.0.0.2',
+    ]
+
+
+def test_scheduler_respects_dependencies_and_dedupes_steps():
+    first, second, third = record('first'), record('second'), record('third')
+    context = FakeContext()
+    (Scheduler(max_workers=3)
+     .add(first)
+     .add(third, after=[second])
+     .add(second, after=[first])
+     .add(third, after=[first])
+     .run(context))
+
+    assert context.calls == ['first', 'second', 'third']
+
+
+def test_scheduler_rejects_cycles():
+    first, second = record('first'), record('second')
+    scheduler = Scheduler().add(first, after=[second]).add(second, after=[first])
+
+    with pytest.raises(ValueError):
+        scheduler.run(FakeContext())
+
+
+def test_scheduler_flushes_batched_steps_once():
+    server = FakeServer()
+    context = CommandContext(connection=server.connect(CONFIG, '10.0.0.1', allow_sudo=True), config=CONFIG)
+    queued = []
+
+    def batched(name):
+        def step(context):
+            with context.batch() as batch:
+                batch.sudo('echo {0}'.format(name))
+            queued.append(server.stats.commands)
+        step.__qualname__ = name
+        return step
+
+    first, second = batched('first'), batched('second')
+
+    def after(context):
+        queued.append(server.stats.commands)
+
+    (Scheduler(max_workers=2)
+     .add(first, batched=True)
+     .add(second, after=[first], batched=True)
+     .add(after, after=[second])
+     .run(context))
+
+    assert queued == [0, 0, 1]
+
+
+def artifact(path, content, **kwargs):
+    return Artifact(template=io.StringIO(content), remote=str(path), **kwargs)
+
+
+def test_command_batch_keeps_the_exit_status_of_every_command():
+    connection = LocalConnection()
+    batch = CommandBatch(connection)
+    batch.sudo('true')
+    batch.sudo('exit 3', warn=True)
+    batch.sudo('echo done')
+
+    results = batch.execute()
+
+    assert [result.exited for result in results] == [0, 3, 0]
+    assert [method for method, _ in connection.calls] == ['sudo']
+
+
+def test_command_batch_stops_at_the_first_failure_without_warn(tmp_path):
+    batch = CommandBatch(LocalConnection())
+    batch.sudo('exit 4')
+    batch.sudo('touch {0}'.format(tmp_path / 'skipped'))
+
+    with pytest.raises(UnexpectedExit) as error:
+        batch.execute()
+
+    assert error.value.result.command == 'exit 4'
+    assert error.value.result.exited == 4
+    assert not (tmp_path / 'skipped').exists()
+
+
+def test_bundle_installs_every_artifact_with_one_put_and_one_sudo(tmp_path):
+    (tmp_path / 'b.conf').write_text('old')
+    artifacts = [
+        artifact(tmp_path / 'b.conf', 'second', mode='640', owner='0:0'),
+        artifact(tmp_path / 'a.conf', 'first'),
+    ]
+    with tarfile.open(fileobj=io.BytesIO(Bundle(artifacts).archive()), mode='r:gz') as tar:
+        manifest = json.load(tar.extractfile(MANIFEST_NAME))
+        script = tar.extractfile(INSTALL_NAME).read().decode('utf-8')
+    connection = LocalConnection()
+    batch = CommandBatch(connection)
+    for item in artifacts:
+        batch.install(item)
+
+    batch.execute()
+
+    assert [(entry['dest'], entry['mode'], entry['owner']) for entry in manifest] == [
+        (str(tmp_path / 'a.conf'), None, None), (str(tmp_path / 'b.conf'), '640', '0:0'),
+    ]
+    assert 'mv -f {0}.wise-new {0}'.format(tmp_path / 'b.conf') in script
+    assert [method for method, _ in connection.calls] == ['put', 'sudo']
+    assert (tmp_path / 'a.conf').read_text() == 'first'
+    assert (tmp_path / 'b.conf').read_text() == 'second'
+    assert stat.S_IMODE(os.stat(str(tmp_path / 'b.conf')).st_mode) == 0o640
+    assert sorted(os.listdir(str(tmp_path))) == ['a.conf', 'b.conf']
+
+
+def test_plan_checks_every_artifact_with_one_sha256sum_and_skips_unchanged(tmp_path):
+    (tmp_path / 'same.conf').write_text('same')
+    (tmp_path / 'old.conf').write_text('old')
+    artifacts = [
+        artifact(tmp_path / 'same.conf', 'same'),
+        artifact(tmp_path / 'old.conf', 'new'),
+        artifact(tmp_path / 'missing.conf', 'missing', post_install=[
+            'ln -sfn {0} {1}'.format(tmp_path / 'missing.conf', tmp_path / 'enabled.conf'),
+        ]),
+    ]
+    connection = LocalConnection()
+
+    plan = Plan.build(connection, artifacts)
+
+    assert [method for method, _ in connection.calls] == ['sudo']
+    assert connection.calls[0][1].startswith('sha256sum -- ')
+    assert [entry.action for entry in plan.entries] == [UNCHANGED, UPDATE, CREATE]
+
+    connection.calls.clear()
+    plan.apply(CommandContext(connection=connection, config=CONFIG))
+
+    assert [method for method, _ in connection.calls] == ['put', 'sudo']
+    assert (tmp_path / 'old.conf').read_text() == 'new'
+    assert (tmp_path / 'missing.conf').read_text() == 'missing'
+    assert (tmp_path / 'enabled.conf').read_text() == 'missing'
+    assert Plan.build(connection, artifacts).changed == []
+
+
+def test_tracer_exports_one_chrome_thread_per_host(tmp_path):
+    tracer = Tracer()
+    tracer.enabled = True
+    with tracer.span('Server.deps', STEP, host='10.0.0.1'):
+        with tracer.span('apt-get update', COMMAND, host='10.0.0.1'):
+            pass
+    with pytest.raises(UnexpectedExit), tracer.span('Server.git', STEP, host='10.0.0.2'):
+        raise UnexpectedExit(Result(command='git init', exited=128))
+    path = str(tmp_path / 'trace.json')
+
+    tracer.export(path)
+
+    with open(path) as f:
+        events = json.load(f)['traceEvents']
+    spans = {event['name']: event for event in events if event['ph'] == 'X'}
+    threads = {event['args']['name']: event['tid'] for event in events if event['ph'] == 'M'}
+    assert threads == {'10.0.0.1': 1, '10.0.0.2': 2}
+    assert spans['apt-get update']['tid'] == spans['Server.deps']['tid'] == 1
+    assert spans['Server.deps']['ts'] <= spans['apt-get update']['ts']
+    assert spans['Server.deps']['dur'] >= spans['apt-get update']['dur']
+    assert spans['Server.git']['args'] == {'host': '10.0.0.2', 'exit_code': 128}
+
+
+def test_transports_skip_the_local_wise_cache_backups_and_media(tmp_path):
+    for path in (
+        'manage.py', 'app/views.py', 'app/.wise/keep.py', '.wise/wheelhouse/abc.tar.gz',
+        'backups/bench-10.0.0.1-20240501-100000/db.dump', 'media/photos/1.jpg', 'app/media/app.css',
+    ):
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text('')
+
+    assert list(iter_files(str(tmp_path), DEFAULT_IGNORE)) == [
+        'manage.py', 'app/views.py', 'app/.wise/keep.py', 'app/media/app.css',
+    ]
+    rsync = rsync_command('.', 'bench@10.0.0.1:/srv/bench/code/', DEFAULT_IGNORE)
+    assert all('--exclude={0} '.format(path) in rsync for path in ('/.wise', '/backups', '/media'))
+
+
+def test_quantile_sketch_stays_within_relative_accuracy():
+    values = [index / 1000 for index in range(1, 10001)]
+    sketch = QuantileSketch(relative_accuracy=0.01)
+    for value in values:
+        sketch.add(value)
+
+    for q in (0.5, 0.95, 0.99):
+        exact = values[int(q * (len(values) - 1))]
+        assert abs(sketch.quantile(q) - exact) <= exact * 0.01